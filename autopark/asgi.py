@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'autopark.settings')
 
 application = get_asgi_application()
+
+# снятие просроченных неоплаченных броней в фоне (BOOKING_HOLD_SWEEP_INTERVAL, 0 — выключено)
+from rental.holds import start_scheduler  # noqa: E402
+
+start_scheduler()
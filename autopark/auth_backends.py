@@ -0,0 +1,51 @@
+"""Вход по email одним запросом.
+
+Стандартный путь (User по email, затем authenticate(username=...)) ищет пользователя
+дважды и проходит все бэкенды, а auth_user.email без индекса. EmailBackend ищет по
+lower(email) через уникальный частичный индекс, который создаётся после migrate
+(миграции auth не наши). Для неизвестного email хэш пароля всё равно считается,
+чтобы время ответа не выдавало, зарегистрирован ли адрес.
+"""
+import logging
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db import DatabaseError, connections, transaction
+from django.db.models.functions import Lower
+
+INDEX_NAME = "auth_user_email_lower_uniq"
+
+logger = logging.getLogger(__name__)
+
+
+def create_email_index(using="default", **kwargs):
+    """Уникальный индекс по lower(email) для непустых адресов (обработчик post_migrate)."""
+    table = get_user_model()._meta.db_table
+    try:
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            # условие "email > ''" должно совпадать с фильтром в EmailBackend, иначе SQLite не возьмёт индекс
+            cursor.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} (lower(email)) WHERE email > ''"
+            )
+    except DatabaseError:
+        logger.warning("Индекс %s не создан: в %s есть повторяющиеся email", INDEX_NAME, table)
+
+
+def users_by_email(email):
+    return get_user_model()._default_manager.alias(email_lower=Lower("email")).filter(
+        email_lower=email.lower(), email__gt=""
+    )
+
+
+class EmailBackend(ModelBackend):
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if not email or password is None:
+            return None
+        user = users_by_email(email).first()
+        if user is None:
+            # как ModelBackend: тот же хэшер на неизвестном адресе, чтобы время ответа не отличалось
+            get_user_model()().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,46 @@
+"""Настройки кэша Django.
+
+В кэше лежит состояние, которое должны видеть все процессы сразу после изменения:
+версия каталога (rental.caching), правила цен (rental.pricing), маски занятости
+(rental.occupancy), карточки авто (rental.cards). Поэтому при нескольких воркерах
+(gunicorn -w N) нужен общий кэш — задайте CACHE_URL. LocMemCache по умолчанию живёт
+в памяти одного процесса и годится только для runserver и тестов; manage.py check --deploy
+предупреждает о нём (autopark.W001).
+
+Переменные окружения:
+    CACHE_URL  redis://host:6379/0 (нужен пакет redis) или memcached://host:11211 (нужен pymemcache)
+"""
+import os
+from urllib.parse import urlparse
+
+from django.core.checks import Warning
+
+LOCMEM_BACKEND = "django.core.cache.backends.locmem.LocMemCache"
+
+
+def parse_url(url):
+    parsed = urlparse(url)
+    if parsed.scheme in ("redis", "rediss"):
+        return {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": url}
+    if parsed.scheme == "memcached":
+        return {"BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache", "LOCATION": parsed.netloc}
+    if parsed.scheme == "locmem":
+        return {"BACKEND": LOCMEM_BACKEND}
+    raise ValueError(f"Неподдерживаемая схема CACHE_URL: {parsed.scheme}")
+
+
+def cache_config(environ=os.environ):
+    """CACHES для settings.py."""
+    url = environ.get("CACHE_URL")
+    return {"default": parse_url(url) if url else {"BACKEND": LOCMEM_BACKEND}}
+
+
+def check_shared_cache(app_configs, **kwargs):
+    from django.conf import settings
+    if settings.CACHES["default"]["BACKEND"] == LOCMEM_BACKEND:
+        return [Warning(
+            "Кэш в памяти процесса: другие воркеры не увидят сброс версии каталога, цен и занятости",
+            hint="Задайте CACHE_URL (redis:// или memcached://)",
+            id="autopark.W001",
+        )]
+    return []
@@ -1,9 +1,13 @@
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django import forms
-from django.contrib.auth import authenticate
+from django.contrib.auth.signals import user_login_failed
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 
+from autopark.auth_backends import EmailBackend, users_by_email
+
+EMAIL_BACKEND = 'autopark.auth_backends.EmailBackend'
+
 class CustomLoginForm(forms.Form):
     email = forms.EmailField(
         widget=forms.EmailInput(attrs={
@@ -28,18 +32,20 @@ class CustomLoginForm(forms.Form):
         password = cleaned_data.get('password')
 
         if email and password:
-            try:
-                user = User.objects.get(email=email)
-            except User.DoesNotExist:
-                raise forms.ValidationError(_("Неверный email или пароль"))
-
-            user = authenticate(username=user.username, password=password)
+            # только EmailBackend: один запрос, без обхода остальных бэкендов при неверном пароле
+            user = EmailBackend().authenticate(self.request, email=email, password=password)
             if user is None:
+                user_login_failed.send(sender=__name__, credentials={'email': email}, request=self.request)
                 raise forms.ValidationError(_("Неверный email или пароль"))
 
+            user.backend = EMAIL_BACKEND
             self.user_cache = user
         return cleaned_data
 
+    def __init__(self, *args, request=None, **kwargs):
+        self.request = request
+        super().__init__(*args, **kwargs)
+
     def get_user(self):
         return getattr(self, 'user_cache', None)
 
@@ -67,6 +73,13 @@ class CustomRegisterForm(UserCreationForm):
         model = User
         fields = ('email', 'password1', 'password2')
 
+    def clean_email(self):
+        email = self.cleaned_data['email']
+        # email уникален без учёта регистра (индекс auth_user_email_lower_uniq)
+        if users_by_email(email).exists():
+            raise forms.ValidationError(_("Пользователь с таким email уже зарегистрирован"))
+        return email
+
     def save(self, commit=True):
         user = super().save(commit=False)
         user.username = self.cleaned_data['email']   # username = email
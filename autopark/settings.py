@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 
+from autopark.cache import cache_config
+from autopark.db import database_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -62,6 +65,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'autopark.timing.TimingMiddleware',  # первым: в общее время входят все остальные middleware
     'allauth.account.middleware.AccountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -73,6 +77,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# замеры запросов (autopark/timing.py): Server-Timing, лог медленных запросов, гистограммы в /admin/timings/
+REQUEST_TIMING = True
+REQUEST_TIMING_SLOW_MS = 500
+
 ROOT_URLCONF = 'autopark.urls'
 
 TEMPLATES = [
@@ -98,12 +106,13 @@ WSGI_APPLICATION = 'autopark.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# SQLite с WAL и прагмами или PostgreSQL из DATABASE_URL, реплика каталога — см. autopark/db.py
+DATABASES = database_config(BASE_DIR)
+DATABASE_ROUTERS = ['autopark.db.CatalogReplicaRouter']
+
+# Общий кэш из CACHE_URL (redis/memcached); без него — память процесса, только для одного воркера.
+# См. autopark/cache.py
+CACHES = cache_config()
 
 
 # Password validation
@@ -166,6 +175,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 SITE_ID = 1
 
 AUTHENTICATION_BACKENDS = [
+    'autopark.auth_backends.EmailBackend',  # вход по email одним запросом (CustomLoginForm)
     'django.contrib.auth.backends.ModelBackend',
     'allauth.account.auth_backends.AuthenticationBackend',
 ]
@@ -214,7 +224,7 @@ JAZZMIN_SETTINGS = {
         "rental.Booking": "fas fa-calendar-check",
         "rental.Payment": "fas fa-file-invoice-dollar",
         "rental.Review": "fas fa-comment-dots",
-        "rental.PricePlan": "fas fa-money-bill",
+        "rental.PriceRule": "fas fa-money-bill",
         "rental.Location": "fas fa-map-marker-alt",
         "rental.Feature": "fas fa-list",
         "rental.RentalPolicy": "fas fa-file-alt",
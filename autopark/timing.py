@@ -0,0 +1,183 @@
+"""Замеры запросов: SQL, шаблоны, общее время.
+
+TimingMiddleware на время запроса ставит execute_wrapper на соединения с БД и считает
+число и время SQL, время рендера шаблонов и общее время. Итог уходит в заголовок
+Server-Timing. Запросы дольше REQUEST_TIMING_SLOW_MS пишутся в лог вместе с самыми
+медленными SQL и местом их вызова. По имени URL копятся гистограммы времени (в памяти
+процесса), их отдаёт /admin/timings/ только для staff.
+
+REQUEST_TIMING = False убирает middleware из стека (MiddlewareNotUsed), и
+Template.render не подменяется: выключенные замеры ничего не стоят.
+"""
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template import base as template_base
+
+SLOW_MS = getattr(settings, "REQUEST_TIMING_SLOW_MS", 500)
+SLOW_SQL = getattr(settings, "REQUEST_TIMING_SLOW_SQL", 5)
+# верхние границы корзин гистограммы, мс; последняя корзина — всё, что дольше
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+PROJECT_DIR = str(settings.BASE_DIR)
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar("request_timing", default=None)
+
+
+def _call_site():
+    """Первый кадр стека из кода проекта (не Django и не сторонние пакеты)."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_DIR) and filename != __file__ and "site-packages" not in filename:
+            return f"{os.path.relpath(filename, PROJECT_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+class RequestTiming:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.templates = 0.0
+        self.depth = 0
+        self.slowest = []  # куча (время, номер, sql, место вызова) из SLOW_SQL самых долгих
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db += elapsed
+            # стек разбираем только для запросов, попадающих в топ
+            if len(self.slowest) < SLOW_SQL:
+                heapq.heappush(self.slowest, (elapsed, self.queries, sql, _call_site()))
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, self.queries, sql, _call_site()))
+
+    def server_timing(self, total):
+        return (
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} SQL", '
+            f"tpl;dur={self.templates * 1000:.1f}, total;dur={total * 1000:.1f}"
+        )
+
+
+_original_render = template_base.Template.render
+_patch_lock = threading.Lock()
+
+
+def _timed_render(self, context):
+    timing = _current.get()
+    if timing is None or timing.depth:
+        # вне замеряемого запроса или вложенный {% include %}: время уже считает внешний шаблон
+        return _original_render(self, context)
+    timing.depth += 1
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        timing.depth -= 1
+        timing.templates += time.perf_counter() - started
+
+
+def _install_template_timer():
+    with _patch_lock:
+        if template_base.Template.render is not _timed_render:
+            template_base.Template.render = _timed_render
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record(name, total_ms, timing):
+    with _stats_lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = {
+                "count": 0, "total_ms": 0.0, "max_ms": 0.0, "queries": 0, "db_ms": 0.0,
+                "buckets": [0] * (len(BUCKETS) + 1),
+            }
+        stat["count"] += 1
+        stat["total_ms"] += total_ms
+        stat["max_ms"] = max(stat["max_ms"], total_ms)
+        stat["queries"] += timing.queries
+        stat["db_ms"] += timing.db * 1000
+        stat["buckets"][bisect_left(BUCKETS, total_ms)] += 1
+
+
+def histograms():
+    """Сводка по именам URL: среднее, максимум, SQL на запрос и гистограмма времени."""
+    labels = [f"<={bound}" for bound in BUCKETS] + [f">{BUCKETS[-1]}"]
+    with _stats_lock:
+        return {
+            name: {
+                "count": stat["count"],
+                "avg_ms": round(stat["total_ms"] / stat["count"], 2),
+                "max_ms": round(stat["max_ms"], 2),
+                "avg_queries": round(stat["queries"] / stat["count"], 2),
+                "avg_db_ms": round(stat["db_ms"] / stat["count"], 2),
+                "histogram_ms": dict(zip(labels, stat["buckets"])),
+            }
+            for name, stat in sorted(_stats.items())
+        }
+
+
+def reset_histograms():
+    with _stats_lock:
+        _stats.clear()
+
+
+class TimingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_TIMING", True):
+            raise MiddlewareNotUsed
+        _install_template_timer()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timing))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        response["Server-Timing"] = timing.server_timing(total)
+        match = request.resolver_match
+        name = match.view_name if match else "<unresolved>"
+        record(name, total * 1000, timing)
+        if total * 1000 >= SLOW_MS:
+            self.log_slow(request, name, total, timing)
+        return response
+
+    @staticmethod
+    def log_slow(request, name, total, timing):
+        lines = [
+            f"  {elapsed * 1000:8.1f} мс  {site}: {sql[:300]}"
+            for elapsed, _, sql, site in sorted(timing.slowest, reverse=True)
+        ]
+        logger.warning(
+            "Медленный запрос %s %s (%s): %.1f мс, SQL: %d за %.1f мс, шаблоны: %.1f мс\n%s",
+            request.method, request.path, name, total * 1000, timing.queries, timing.db * 1000,
+            timing.templates * 1000, "\n".join(lines),
+        )
@@ -2,10 +2,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from autopark.views import AuthView, CustomLoginView, CustomRegisterView, CustomLogoutView
+from autopark.views import AuthView, CustomLoginView, CustomRegisterView, CustomLogoutView, request_timings
 
 urlpatterns = [
     path('i18n/', include('django.conf.urls.i18n')),
+    path('admin/timings/', request_timings, name='request_timings'),
     path('admin/', admin.site.urls),
     path('', include('rental.urls')),
 ]
@@ -5,6 +5,10 @@ from django.views import View
 from django.contrib.auth.views import LoginView
 from autopark.forms import CustomLoginForm, CustomRegisterForm
 from django.contrib.auth import logout, update_session_auth_hash, login
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from autopark.timing import BUCKETS, histograms
+import os
 from dj_rest_auth.registration.views import SocialLoginView
 
 class GoogleLogin(SocialLoginView):
@@ -29,7 +33,7 @@ class CustomLoginView(View):
     template_name = 'auth/login_register.html'
 
     def post(self, request):
-        login_form = CustomLoginForm(request.POST)
+        login_form = CustomLoginForm(request.POST, request=request)
         register_form = CustomRegisterForm()
 
         if login_form.is_valid():
@@ -68,4 +72,10 @@ class CustomRegisterView(View):
 class CustomLogoutView(View):
     def get(self, request):
         logout(request)
-        return redirect('home')
\ No newline at end of file
+        return redirect('home')
+
+
+@staff_member_required
+def request_timings(request):
+    # гистограммы копятся в памяти процесса: при нескольких воркерах у каждого свои
+    return JsonResponse({"pid": os.getpid(), "buckets_ms": BUCKETS, "views": histograms()})
@@ -1,11 +1,142 @@
-from django.contrib import admin
+import io
+import tempfile
+import zipfile
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.functional import cached_property
 from modeltranslation.admin import TranslationAdmin
+
+from autopark.auth_backends import users_by_email
 from .models import (
     Vehicle, VehicleType, Feature, Location,
-    VehicleAvailability, Booking, Payment, Review, RentalPolicy, VehicleImage
+    VehicleAvailability, Booking, Payment, Review, RentalPolicy, VehicleImage, PriceRule, PaymentEvent, DailyRollup
 )
+from .exports import export_response
+from .fleet_import import FleetImporter, detect_format, read_rows
+from .forms import FleetImportForm
+from . import ratings
+from .payments import DEFAULT_PROVIDERS
+from .rollups import GROUPS, parse_params, summary
 from django.utils.translation import gettext_lazy as _
 
+# до стольких строк отфильтрованный список считается точно, дальше показывается этот предел
+EXACT_COUNT_LIMIT = 10000
+
+
+def estimated_count(queryset):
+    """Оценка числа строк таблицы без COUNT(*): статистика PostgreSQL или max(rowid) в SQLite."""
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == "sqlite":
+            # rowid растёт монотонно: после удалений оценка завышена, но это один шаг по B-дереву
+            cursor.execute(f"SELECT max(rowid) FROM {table}")
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Счётчик списка без полного COUNT(*) на больших таблицах.
+
+    Без фильтров — оценка по статистике таблицы; с фильтрами — COUNT не дальше
+    EXACT_COUNT_LIMIT строк (подзапрос с LIMIT), чтобы время не росло вместе с таблицей.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+                return estimate
+        return queryset.order_by()[:EXACT_COUNT_LIMIT].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Списки таблиц на миллионы строк: оценка вместо COUNT(*) и без второго счётчика "всего"."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+def export_action(kind, fmt, description):
+    """Действие списка: потоковая выгрузка выбранных строк (rental.exports)."""
+    def action(modeladmin, request, queryset):
+        return export_response(kind, fmt, queryset=queryset)
+    action.__name__ = f"export_{fmt}"
+    action.short_description = description
+    return action
+
+
+class InputFilter(admin.SimpleListFilter):
+    """Фильтр полем ввода вместо списка всех значений FK в панели фильтров."""
+    template = "admin/rental/input_filter.html"
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        # has_output() показывает фильтр, только если есть хотя бы один вариант
+        return (("", ""),)
+
+    def queryset(self, request, queryset):
+        value = (self.value() or "").strip()
+        if value:
+            return queryset.filter(**{self.lookup: value})
+        return queryset
+
+
+class VehiclePlateFilter(InputFilter):
+    title = _("Госномер")
+    parameter_name = "plate"
+    lookup = "vehicle__plate"
+
+
+class UserEmailFilter(InputFilter):
+    title = _("Email клиента")
+    parameter_name = "email"
+
+    def queryset(self, request, queryset):
+        value = (self.value() or "").strip()
+        if value:
+            # по индексу lower(email), см. autopark.auth_backends
+            return queryset.filter(user__in=users_by_email(value))
+        return queryset
+
+
+class ProviderFilter(admin.SimpleListFilter):
+    """Провайдеры из настроек, а не SELECT DISTINCT по всей таблице оплат."""
+    title = _("Провайдер")
+    parameter_name = "provider"
+
+    def lookups(self, request, model_admin):
+        return [(name, name) for name in getattr(settings, "PAYMENT_PROVIDERS", DEFAULT_PROVIDERS)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(provider=self.value())
+        return queryset
+
+
+class RatingFilter(admin.SimpleListFilter):
+    title = _("Оценка")
+    parameter_name = "rating"
+
+    def lookups(self, request, model_admin):
+        return [(str(n), str(n)) for n in range(5, 0, -1)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(rating=self.value())
+        return queryset
+
 
 class VehicleImageInline(admin.TabularInline):
     model = VehicleImage
@@ -48,10 +179,12 @@ class VehicleAvailabilityInline(admin.TabularInline):
 
 @admin.register(Vehicle)
 class VehicleAdmin(TranslationAdmin):
-    list_display = ("title", "type", "plate", "seats", "location", "is_active", "price_per_day", "deposit")
+    list_display = ("title", "type", "plate", "seats", "location", "is_active", "price_per_day", "deposit",
+                    "rating_avg", "rating_count")
     list_filter = ("type", "transmission", "fuel", "is_active", "location")
     search_fields = ("title", "plate", "type__name", "location__city")
     ordering = ("title",)
+    list_select_related = ("type", "location")
     autocomplete_fields = ("type", "location")
     filter_horizontal = ("features",)
     inlines = [VehicleAvailabilityInline, VehicleImageInline]
@@ -62,11 +195,38 @@ class VehicleAdmin(TranslationAdmin):
         (_("Локация"), {"fields": ("location",)}),
     )
 
+    def get_urls(self):
+        return [
+            path("import/", self.admin_site.admin_view(self.import_view), name="rental_vehicle_import"),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Загрузка парка файлом CSV/JSONL с ZIP-архивом фото (rental.fleet_import)."""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        result = None
+        form = FleetImportForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["data"]
+            with tempfile.TemporaryDirectory() as image_dir:
+                if form.cleaned_data["images"]:
+                    with zipfile.ZipFile(form.cleaned_data["images"]) as archive:
+                        archive.extractall(image_dir)  # extractall отбрасывает абсолютные пути и ".."
+                text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+                result = FleetImporter(image_dir=image_dir).run(read_rows(text, detect_format(upload.name)))
+            level = messages.WARNING if result.errors else messages.SUCCESS
+            self.message_user(request, _("Добавлено авто: %(created)d, строк с ошибками: %(errors)d") % {
+                "created": result.created, "errors": len(result.errors)}, level)
+        return TemplateResponse(request, "admin/rental/vehicle/import.html", {
+            **self.admin_site.each_context(request), "opts": self.model._meta, "form": form, "result": result,
+        })
+
 
 @admin.register(VehicleAvailability)
 class VehicleAvailabilityAdmin(admin.ModelAdmin):
     list_display = ("vehicle", "date_from", "date_to", "reason")
-    list_filter = ("vehicle", "date_from", "date_to")
+    list_filter = (VehiclePlateFilter, "date_from", "date_to")
+    list_select_related = ("vehicle",)
     search_fields = ("vehicle__title", "reason")
     autocomplete_fields = ("vehicle",)
     verbose_name = _("Недоступность транспорта")
@@ -74,44 +234,122 @@ class VehicleAvailabilityAdmin(admin.ModelAdmin):
 
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
+class BookingAdmin(LargeTableAdmin):
     list_display = ("id", "vehicle", "user", "date_from", "date_to", "total_price", "status", "created_at")
-    list_filter = ("status", "vehicle")
+    list_filter = ("status", VehiclePlateFilter, UserEmailFilter)
+    list_select_related = ("vehicle", "user")
     search_fields = ("vehicle__title", "user__email", "user__username")
     readonly_fields = ("created_at",)
     autocomplete_fields = ("vehicle", "user")
     ordering = ("-created_at",)
+    actions = [
+        export_action("bookings", "csv", _("Выгрузить в CSV")),
+        export_action("bookings", "ndjson", _("Выгрузить в NDJSON")),
+    ]
     verbose_name = _("Бронирование")
     verbose_name_plural = _("Бронирования")
 
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(LargeTableAdmin):
     list_display = ("id", "booking", "provider", "amount", "currency", "status", "created_at", "updated_at")
-    list_filter = ("provider", "status")
+    list_filter = (ProviderFilter, "status")
+    list_select_related = ("booking__vehicle",)  # Booking.__str__ выводит авто
     search_fields = ("booking__id", "provider_intent_id")
     readonly_fields = ("created_at", "updated_at")
+    ordering = ("-created_at",)
     autocomplete_fields = ("booking",)
+    actions = [
+        export_action("payments", "csv", _("Выгрузить в CSV")),
+        export_action("payments", "ndjson", _("Выгрузить в NDJSON")),
+    ]
     verbose_name = _("Оплата")
     verbose_name_plural = _("Оплаты")
 
 
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(LargeTableAdmin):
+    list_display = ("id", "provider", "event_id", "intent_id", "status", "received_at", "processed_at")
+    list_filter = (ProviderFilter, "status")
+    search_fields = ("event_id", "intent_id")
+    readonly_fields = ("provider", "event_id", "intent_id", "status", "payload", "received_at", "processed_at")
+    ordering = ("-id",)
+
+
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(LargeTableAdmin):
     list_display = ("id", "user", "vehicle", "rating", "is_approved", "created_at")
-    list_filter = ("is_approved", "rating")
+    list_filter = ("is_approved", RatingFilter)
+    list_select_related = ("user", "vehicle")
     search_fields = ("user__username", "vehicle__title", "booking__id")
     readonly_fields = ("created_at",)
+    ordering = ("-created_at",)
     autocomplete_fields = ("user", "vehicle")
 
     actions = ["approve_reviews"]
 
     def approve_reviews(self, request, queryset):
-        updated = queryset.update(is_approved=True)
+        with transaction.atomic():
+            # только ещё не одобренные: их оценки прибавляются к рейтингу авто
+            rows = list(
+                queryset.filter(is_approved=False).select_for_update().values_list("pk", "vehicle_id", "rating")
+            )
+            updated = Review.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(is_approved=True)
+            # UPDATE минует сигналы
+            ratings.apply([((vehicle_id, rating, False), (vehicle_id, rating, True)) for _, vehicle_id, rating in rows])
         self.message_user(request, _("Отмечено как одобренные: %(count)d") % {"count": updated})
     approve_reviews.short_description = _("Одобрить выбранные отзывы")
 
 
+@admin.register(DailyRollup)
+class DailyRollupAdmin(LargeTableAdmin):
+    list_display = ("date", "vehicle", "location", "booked", "revenue", "refunds")
+    list_filter = ("location", VehiclePlateFilter)
+    list_select_related = ("vehicle", "location")
+    ordering = ("-date",)
+
+    # строки ведёт rental.rollups, вручную не правятся
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path("dashboard/", self.admin_site.admin_view(self.dashboard_view), name="rental_dailyrollup_dashboard"),
+        ] + super().get_urls()
+
+    def dashboard_view(self, request):
+        """Загрузка и выручка за период по локациям, авто или дням — только из сводок."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            params = parse_params(request.GET)
+        except ValueError as e:
+            self.message_user(request, str(e), messages.ERROR)
+            params = parse_params({})
+        return TemplateResponse(request, "admin/rental/dailyrollup/dashboard.html", {
+            **self.admin_site.each_context(request), "opts": self.model._meta, "params": params,
+            "groups": list(GROUPS), "locations": Location.objects.order_by("city", "address"),
+            "stats": summary(**params),
+        })
+
+
+@admin.register(PriceRule)
+class PriceRuleAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "name", "vehicle_type", "date_from", "date_to", "weekday", "min_days",
+                    "multiplier", "is_active")
+    list_filter = ("kind", "vehicle_type", "is_active")
+    list_editable = ("multiplier", "is_active")
+    search_fields = ("name",)
+    autocomplete_fields = ("vehicle_type",)
+    ordering = ("kind", "date_from", "weekday", "min_days")
+
+
 @admin.register(RentalPolicy)
 class RentalPolicyAdmin(TranslationAdmin):
     list_display = ("id", "title", "created_at", "updated_at")
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.models.signals import post_migrate
 
 
 class RentalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rental'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import create_index
+        from autopark.auth_backends import create_email_index
+        from autopark.cache import check_shared_cache
+        post_migrate.connect(create_index, sender=self)
+        post_migrate.connect(create_email_index, sender=self)
+        checks.register(check_shared_cache, checks.Tags.caches, deploy=True)
@@ -0,0 +1,149 @@
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connections, router, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import Vehicle, Booking, VehicleAvailability
+
+# Статусы брони, которые занимают авто
+ACTIVE_BOOKING_STATUSES = ("pending_payment", "paid")
+# Сколько неоплаченная бронь держит авто; после этого она свободна, даже если holds.expire_holds ещё не прошёл
+HOLD_TTL = timedelta(seconds=getattr(settings, "BOOKING_HOLD_TTL", 30 * 60))
+
+# Повторы при конфликте блокировок ("database is locked", deadlock)
+LOCK_RETRIES = 10
+LOCK_BACKOFF = 0.01
+
+
+class VehicleUnavailable(Exception):
+    pass
+
+
+def merge_intervals(intervals):
+    """Сливает пересекающиеся и смежные интервалы дат (границы включительно)."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def hold_cutoff():
+    """Неоплаченные брони, созданные до этого момента, просрочены."""
+    return timezone.now() - HOLD_TTL
+
+
+def hold_expired(booking):
+    return booking.status == "pending_payment" and booking.created_at <= hold_cutoff()
+
+
+def active_bookings():
+    return Booking.objects.filter(
+        Q(status="pending_payment", created_at__gt=hold_cutoff())
+        | Q(status__in=[s for s in ACTIVE_BOOKING_STATUSES if s != "pending_payment"])
+    )
+
+
+def overlapping_bookings(start, end):
+    # пересечение [date_from, date_to] и [start, end] — идёт по индексу (vehicle, date_from, date_to)
+    return active_bookings().filter(date_from__lte=end, date_to__gte=start)
+
+
+def overlapping_blocks(start, end):
+    return VehicleAvailability.objects.filter(date_from__lte=end, date_to__gte=start)
+
+
+def busy_intervals(vehicle, start=None, end=None):
+    """Занятые интервалы авто (брони + блокировки), слитые в один список за один запрос."""
+    bookings = active_bookings().filter(vehicle=vehicle)
+    blocks = VehicleAvailability.objects.filter(vehicle=vehicle)
+    if start is not None:
+        bookings = bookings.filter(date_to__gte=start)
+        blocks = blocks.filter(date_to__gte=start)
+    if end is not None:
+        bookings = bookings.filter(date_from__lte=end)
+        blocks = blocks.filter(date_from__lte=end)
+    rows = bookings.values_list("date_from", "date_to").union(
+        blocks.values_list("date_from", "date_to"), all=True
+    )
+    return merge_intervals(rows)
+
+
+def has_conflict(vehicle, start, end, exclude_booking=None, using=None):
+    """Одним запросом проверяет пересечение с активными бронями и блокировками авто."""
+    bookings = overlapping_bookings(start, end).filter(vehicle=OuterRef("pk"))
+    if exclude_booking is not None:
+        bookings = bookings.exclude(pk=exclude_booking.pk)
+    blocks = overlapping_blocks(start, end).filter(vehicle=OuterRef("pk"))
+    # авто может читаться с реплики, а подзапрос по броням выполняется в той же БД: занятость — с основной
+    vehicles = Vehicle.objects.using(using or router.db_for_read(Booking))
+    return vehicles.filter(pk=vehicle.pk).filter(Exists(bookings) | Exists(blocks)).exists()
+
+
+def is_available(vehicle, start, end):
+    return not has_conflict(vehicle, start, end)
+
+
+def free_vehicles(queryset, start, end):
+    """Авто из queryset, свободные на [start, end], — один anti-join запрос на весь парк.
+
+    Запрос уходит в БД броней, а не на реплику каталога: отставшая реплика показала бы
+    свободными уже занятые авто.
+    """
+    bookings = overlapping_bookings(start, end).filter(vehicle=OuterRef("pk"))
+    blocks = overlapping_blocks(start, end).filter(vehicle=OuterRef("pk"))
+    return queryset.using(router.db_for_read(Booking)).filter(~Exists(bookings), ~Exists(blocks))
+
+
+def conflicting_bookings(bookings):
+    """Брони из queryset, даты которых уже заняты другими активными бронями или блокировками авто."""
+    same_dates = {"vehicle": OuterRef("vehicle"), "date_from__lte": OuterRef("date_to"), "date_to__gte": OuterRef("date_from")}
+    others = active_bookings().filter(**same_dates).exclude(pk=OuterRef("pk"))
+    blocks = VehicleAvailability.objects.filter(**same_dates)
+    return bookings.filter(Exists(others) | Exists(blocks))
+
+
+def lock_vehicles(vehicle_ids, using):
+    """Блокирует авто до конца текущей транзакции одним запросом; брони других авто не ждут."""
+    vehicles = Vehicle.objects.using(using).filter(pk__in=vehicle_ids)
+    if connections[using].features.has_select_for_update:
+        # PostgreSQL и др.: блокировка строк, по порядку pk — без взаимных блокировок
+        list(vehicles.select_for_update().order_by("pk").values_list("pk"))
+    else:
+        # SQLite: пустой UPDATE сразу берёт write-lock, до проверки пересечений
+        vehicles.update(is_active=F("is_active"))
+
+
+def lock_vehicle(vehicle, using):
+    """Блокирует одно авто до конца текущей транзакции."""
+    lock_vehicles([vehicle.pk], using)
+
+
+def reserve(booking):
+    """Сохраняет бронь, если авто свободно: проверка и запись под блокировкой авто.
+    Изменённая бронь с собой не пересекается.
+
+    Бросает VehicleUnavailable при пересечении.
+    """
+    using = router.db_for_write(Booking, instance=booking)
+    exclude = None if booking._state.adding else booking
+    for attempt in range(LOCK_RETRIES):
+        try:
+            with transaction.atomic(using=using):
+                lock_vehicle(booking.vehicle, using)
+                if has_conflict(booking.vehicle, booking.date_from, booking.date_to, exclude, using=using):
+                    raise VehicleUnavailable("Автомобиль недоступен на выбранные даты")
+                booking.save(using=using)
+                return booking
+        except OperationalError:
+            if attempt == LOCK_RETRIES - 1:
+                raise
+            # экспоненциальная задержка со случайным разбросом, чтобы потоки не сталкивались снова
+            time.sleep(LOCK_BACKOFF * 2 ** attempt * random.random())
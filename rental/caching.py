@@ -0,0 +1,102 @@
+"""Версия каталога и валидаторы (ETag / Last-Modified) для условных GET-запросов.
+
+Версия — счётчик в кэше Django; его поднимают сигналы при любом изменении Vehicle,
+VehicleImage, Feature, Location, VehicleType (rental.signals). Подъём — атомарный incr,
+так что параллельные изменения не теряются, а общий кэш (autopark/cache.py) делает
+новую версию видимой всем воркерам. Рядом лежит время последнего изменения — для
+Last-Modified.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.utils.translation import get_language
+
+from .models import Vehicle
+
+CATALOG_VERSION_KEY = "catalog:version"
+CATALOG_MODIFIED_KEY = "catalog:modified"
+# выдача по датам зависит от броней, а не от каталога — такие запросы не валидируем
+DATE_PARAMS = {"date_from", "date_to"}
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def catalog_state():
+    """(версия, время изменения в мс). Если ключей нет (первый запуск, вытеснение), они
+    заводятся от текущего времени."""
+    keys = [CATALOG_VERSION_KEY, CATALOG_MODIFIED_KEY]
+    state = cache.get_many(keys)
+    if len(state) < len(keys):
+        # счётчик — в наносекундах: прежние значения (старт + число изменений) он не повторит
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        cache.add(CATALOG_MODIFIED_KEY, _now_ms(), None)
+        state = cache.get_many(keys)
+    return state[CATALOG_VERSION_KEY], state[CATALOG_MODIFIED_KEY]
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # версии нет — заведётся от текущего времени при чтении
+        cache.delete(CATALOG_MODIFIED_KEY)
+        return
+    cache.set(CATALOG_MODIFIED_KEY, _now_ms(), None)
+
+
+def _request_catalog_state(request):
+    # одно чтение на запрос, общее для ETag и Last-Modified
+    if not hasattr(request, "_catalog_state"):
+        request._catalog_state = catalog_state()
+    return request._catalog_state
+
+
+def _etag(*parts):
+    return hashlib.md5("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _user_key(request):
+    # в HTML есть меню профиля — страница зависит от пользователя
+    return request.user.pk if request.user.is_authenticated else ""
+
+
+def _catalog_cacheable(request):
+    return not DATE_PARAMS & request.GET.keys()
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    if _catalog_cacheable(request):
+        return datetime.fromtimestamp(_request_catalog_state(request)[1] / 1000, tz=dt_timezone.utc)
+
+
+def catalog_etag(request, *args, **kwargs):
+    if _catalog_cacheable(request):
+        return _etag(_request_catalog_state(request)[0], get_language(), request.get_full_path(), _user_key(request))
+
+
+def api_catalog_etag(request, *args, **kwargs):
+    if _catalog_cacheable(request):
+        return _etag(_request_catalog_state(request)[0], get_language(), request.get_full_path())
+
+
+def _vehicle_updated_at(request, vehicle_id):
+    # одна выборка по pk на запрос, общая для ETag и Last-Modified
+    if not hasattr(request, "_vehicle_updated_at"):
+        request._vehicle_updated_at = (
+            Vehicle.objects.filter(pk=vehicle_id).values_list("updated_at", flat=True).first()
+        )
+    return request._vehicle_updated_at
+
+
+def vehicle_last_modified(request, vehicle_id=None, pk=None, **kwargs):
+    return _vehicle_updated_at(request, vehicle_id or pk)
+
+
+def vehicle_etag(request, vehicle_id=None, pk=None, **kwargs):
+    updated_at = _vehicle_updated_at(request, vehicle_id or pk)
+    if updated_at is not None:
+        return _etag(updated_at.isoformat(), get_language(), _user_key(request))
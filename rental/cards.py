@@ -0,0 +1,65 @@
+"""Кэш отрендеренных карточек авто и броней по языку.
+
+Ключ карточки содержит версию объекта: для авто это updated_at, который сигналы
+поднимают при правке самого авто, его фото, типа, локации и особенностей
+(rental.signals). Поэтому правка в админке меняет ключ только у затронутых
+карточек, остальные продолжают отдаваться из кэша.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from .models import Vehicle, Booking
+
+CARD_TIMEOUT = getattr(settings, "CARD_CACHE_TIMEOUT", 24 * 3600)
+# поля, по которым строится ключ (тип и цена — для pricing.quote_many); всё остальное для карточки догружается только при промахе
+VEHICLE_KEY_FIELDS = ("id", "created_at", "updated_at", "type", "price_per_day")
+BOOKING_KEY_FIELDS = ("id", "status", "date_from", "date_to", "total_price", "created_at", "vehicle__updated_at")
+
+
+def _render(request, objects, template, name, version, load, extra=None):
+    variant = "user" if request.user.is_authenticated else "anon"
+    prefix = f"card:{template}:{get_language()}:{variant}"
+    # extra — данные карточки, которых нет в объекте (цена за выбранные даты); входят в ключ
+    extras = [extra(obj) if extra else {} for obj in objects]
+    keys = [
+        f"{prefix}:{obj.pk}:{version(obj)}" + "".join(f":{value}" for value in data.values())
+        for obj, data in zip(objects, extras)
+    ]
+    cards = cache.get_many(keys)
+
+    missing = [obj.pk for obj, key in zip(objects, keys) if key not in cards]
+    if missing:
+        loaded = {obj.pk: obj for obj in load(missing)}
+        rendered = {
+            key: render_to_string(template, {name: loaded[obj.pk], **data}, request)
+            for obj, key, data in zip(objects, keys, extras)
+            if key not in cards and obj.pk in loaded
+        }
+        cache.set_many(rendered, CARD_TIMEOUT)
+        cards.update(rendered)
+    return [mark_safe(cards[key]) for key in keys if key in cards]
+
+
+def vehicle_cards(request, vehicles, template, quotes=None):
+    """Карточки авто; vehicles достаточно загрузить с .only(*VEHICLE_KEY_FIELDS).
+
+    quotes — {vehicle.pk: цена за выбранные даты} из pricing.quote_many().
+    """
+    return _render(
+        request, vehicles, template, "vehicle",
+        version=lambda vehicle: vehicle.updated_at.timestamp(),
+        load=lambda pks: Vehicle.objects.for_cards().filter(pk__in=pks),
+        extra=(lambda vehicle: {"quote": quotes[vehicle.pk]}) if quotes else None,
+    )
+
+
+def booking_cards(request, bookings, template="rental/cards/booking_card.html"):
+    """Карточки броней; bookings достаточно загрузить с .only(*BOOKING_KEY_FIELDS)."""
+    return _render(
+        request, bookings, template, "booking",
+        version=lambda b: f"{b.status}:{b.date_from}:{b.date_to}:{b.total_price}:{b.vehicle.updated_at.timestamp()}",
+        load=lambda pks: Booking.objects.for_cards().filter(pk__in=pks),
+    )
@@ -0,0 +1,69 @@
+import django_filters
+from django import forms
+from django.db.models import Q
+from modeltranslation.utils import get_translation_fields
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Vehicle
+from .occupancy import free_vehicles
+from .pricing import MAX_QUOTE_DAYS
+from .search import search
+
+
+class VehicleFilterForm(forms.Form):
+    def clean(self):
+        data = super().clean()
+        date_from, date_to = data.get("date_from"), data.get("date_to")
+        # для выбранных дат считаются цены по дням: длинный охват — лишняя работа на каждый запрос
+        if date_from and date_to and (date_to - date_from).days >= MAX_QUOTE_DAYS:
+            self.add_error("date_to", f"Диапазон больше {MAX_QUOTE_DAYS} дней")
+        return data
+
+
+class VehicleFilter(django_filters.FilterSet):
+    date_from = django_filters.DateFilter(method="filter_dates")
+    date_to = django_filters.DateFilter(method="filter_dates")
+    city = django_filters.CharFilter(method="filter_city")
+
+    class Meta:
+        model = Vehicle
+        fields = ["type", "transmission", "fuel", "location"]
+        form = VehicleFilterForm
+
+    def filter_dates(self, queryset, name, value):
+        # даты применяются вместе в filter_queryset
+        return queryset
+
+    def filter_city(self, queryset, name, value):
+        # ищем по всем языковым колонкам: "Бишкек" и "Bishkek" дают один результат
+        query = Q()
+        for field in get_translation_fields("city"):
+            query |= Q(**{f"location__{field}__iexact": value})
+        return queryset.filter(query)
+
+    def date_range(self):
+        """(date_from, date_to), если обе даты заданы; вызывать после .qs."""
+        date_from = self.form.cleaned_data.get("date_from")
+        date_to = self.form.cleaned_data.get("date_to")
+        return (date_from, date_to) if date_from and date_to else None
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if "date_to" in self.form.errors:
+            # API отвечает 400 раньше (DjangoFilterBackend), каталог показывает пустую выдачу
+            return queryset.none()
+        dates = self.date_range()
+        if dates:
+            if dates[1] < dates[0]:
+                return queryset.none()
+            queryset = free_vehicles(queryset, *dates)
+        return queryset
+
+
+class VehicleSearchFilter(BaseFilterBackend):
+    """?search= для API через полнотекстовый индекс, с сортировкой по релевантности."""
+    search_param = "search"
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, "").strip()
+        return search(queryset, query) if query else queryset
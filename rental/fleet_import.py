@@ -0,0 +1,239 @@
+"""Массовый импорт парка из CSV/JSONL и каталога фото.
+
+Строка — одно авто. Колонки (для пар ru/en можно дать одну общую колонку: title, type, city, address):
+    plate, title_ru, title_en, type_ru, type_en, city_ru, city_en, address_ru, address_en,
+    transmission, fuel, seats, price_per_day, deposit, is_active,
+    features — названия через "|" (в JSONL можно списком),
+    images — имена файлов в каталоге фото через "|" (в JSONL можно списком).
+
+Типы, локации и особенности ищутся по русскому названию в словарях, загруженных одним
+запросом на модель; отсутствующие создаются в транзакции пачки, вместе с её авто. Авто,
+связи с особенностями и фото вставляются bulk_create пачками. Ошибки проверки собираются
+по номерам строк, остальные строки импортируются; пачка, которую не удалось записать
+(например, номер занят параллельным импортом), откатывается целиком и уходит в ошибки. bulk_create минует сигналы, поэтому поисковый индекс, версия
+каталога и превью фото обновляются здесь после коммита пачки.
+"""
+import csv
+import json
+import os
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, transaction
+
+from . import search, thumbnails
+from .caching import bump_catalog_version
+from .models import Feature, Location, Vehicle, VehicleImage, VehicleType
+
+CHUNK_SIZE = 1000
+LIST_SEPARATOR = "|"
+TRUE_VALUES = {"1", "true", "yes", "y", "t", "да"}
+FALSE_VALUES = {"0", "false", "no", "n", "f", "нет"}
+
+
+def read_rows(fileobj, fmt):
+    """(номер строки, dict или None, ошибка) из текстового файла CSV или JSONL."""
+    if fmt == "csv":
+        for line, row in enumerate(csv.DictReader(fileobj), start=2):
+            yield line, row, None
+        return
+    for line, text in enumerate(fileobj, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            yield line, None, f"неверный JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line, None, "ожидался объект JSON"
+            continue
+        yield line, row, None
+
+
+def detect_format(filename):
+    return "jsonl" if os.path.splitext(filename)[1].lower() in (".jsonl", ".ndjson", ".json") else "csv"
+
+
+def _text(row, name):
+    value = row.get(name)
+    return "" if value is None else str(value).strip()
+
+
+def _pair(row, name):
+    """(ru, en): колонки name_ru/name_en, иначе общая name; пустой en берётся из ru."""
+    ru = _text(row, f"{name}_ru") or _text(row, name)
+    return ru, _text(row, f"{name}_en") or ru
+
+
+def _list(value):
+    items = value if isinstance(value, list) else str(value or "").split(LIST_SEPARATOR)
+    return [str(item).strip() for item in items if str(item).strip()]
+
+
+def _bool(value, default=True):
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValidationError({"is_active": f"ожидалось да/нет, получено {value!r}"})
+
+
+def _messages(error):
+    if hasattr(error, "message_dict"):
+        return "; ".join(f"{field}: {' '.join(msgs)}" for field, msgs in error.message_dict.items())
+    return " ".join(error.messages)
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []  # (номер строки, сообщение)
+
+
+class FleetImporter:
+    def __init__(self, image_dir=None, chunk_size=CHUNK_SIZE, thumbnails=True):
+        self.image_dir = os.path.realpath(image_dir) if image_dir else None
+        self.chunk_size = chunk_size
+        self.thumbnails = thumbnails
+        # словари по русскому названию в нижнем регистре -> pk
+        self.known = {
+            VehicleType: {name.lower(): pk for pk, name in VehicleType.objects.values_list("pk", "name_ru") if name},
+            Location: {
+                (city.lower(), (address or "").lower()): pk
+                for pk, city, address in Location.objects.values_list("pk", "city_ru", "address_ru") if city
+            },
+            Feature: {name.lower(): pk for pk, name in Feature.objects.values_list("pk", "name_ru") if name},
+        }
+        self.seen_plates = set()
+        self.stored = {}  # путь в каталоге фото -> имя в storage: общий файл копируется один раз
+
+    def run(self, rows):
+        result = ImportResult()
+        chunk = []
+        for line, row, error in rows:
+            if error:
+                result.errors.append((line, error))
+                continue
+            try:
+                chunk.append((line, *self.build(row)))
+            except ValidationError as e:
+                result.errors.append((line, _messages(e)))
+            if len(chunk) >= self.chunk_size:
+                self.insert(chunk, result)
+                chunk = []
+        if chunk:
+            self.insert(chunk, result)
+        result.errors.sort()  # дубли номеров с БД находятся позже, при вставке пачки
+        return result
+
+    def image_path(self, name):
+        if not self.image_dir:
+            raise ValidationError({"images": "не указан каталог фото"})
+        path = os.path.realpath(os.path.join(self.image_dir, name))
+        # имя из файла не должно выводить за пределы каталога фото
+        if not path.startswith(self.image_dir + os.sep) or not os.path.isfile(path):
+            raise ValidationError({"images": f"нет файла {name}"})
+        return path
+
+    def build(self, row):
+        """Проверенное авто (без записи в БД), его тип, локация и особенности — (ключ, поля) —
+        и пути к фото."""
+        title_ru, title_en = _pair(row, "title")
+        type_ru, type_en = _pair(row, "type")
+        city_ru, city_en = _pair(row, "city")
+        address_ru, address_en = _pair(row, "address")
+        missing = {name: "обязательное поле" for name, value in
+                   (("title", title_ru), ("type", type_ru), ("city", city_ru)) if not value}
+        if missing:
+            raise ValidationError(missing)
+
+        vehicle = Vehicle(
+            id=uuid.uuid4(), title=title_ru, title_ru=title_ru, title_en=title_en, plate=_text(row, "plate"),
+            transmission=_text(row, "transmission"), fuel=_text(row, "fuel"), seats=_text(row, "seats") or 5,
+            price_per_day=_text(row, "price_per_day") or 0, deposit=_text(row, "deposit") or 0,
+            is_active=_bool(row.get("is_active")),
+        )
+        # уникальность номера проверяется одним запросом на пачку (insert), а не запросом на строку
+        vehicle.full_clean(exclude=["type", "location"], validate_unique=False, validate_constraints=False)
+        if vehicle.plate in self.seen_plates:
+            raise ValidationError({"plate": f"номер {vehicle.plate} повторяется в файле"})
+        images = [self.image_path(name) for name in _list(row.get("images"))]
+        self.seen_plates.add(vehicle.plate)
+
+        vehicle_type = (type_ru.lower(), {"name_ru": type_ru, "name_en": type_en})
+        location = (
+            (city_ru.lower(), address_ru.lower()),
+            {"city_ru": city_ru, "city_en": city_en, "address_ru": address_ru, "address_en": address_en},
+        )
+        features = [(name.lower(), {"name": name, "name_ru": name, "name_en": name})
+                    for name in _list(row.get("features"))]
+        return vehicle, vehicle_type, location, features, images
+
+    def resolve(self, created, model, key, fields):
+        """pk связанной записи; новые создаются в транзакции пачки и попадают в self.known
+        только после её записи, чтобы откат не оставил в словаре несуществующих pk."""
+        pk = self.known[model].get(key) or created[model].get(key)
+        if pk is None:
+            pk = created[model][key] = model.objects.create(**fields).pk
+        return pk
+
+    @staticmethod
+    def existing_plates(plates):
+        return set(Vehicle.objects.filter(plate__in=plates).values_list("plate", flat=True))
+
+    def store(self, path):
+        if path not in self.stored:
+            with open(path, "rb") as f:
+                # файлы копируются до вставки: при откате пачки останутся только лишние файлы
+                self.stored[path] = default_storage.save(f"vehicles/{os.path.basename(path)}", File(f))
+        return self.stored[path]
+
+    def insert(self, chunk, result):
+        existing = self.existing_plates([row[1].plate for row in chunk])
+        rows = []
+        for line, vehicle, *related in chunk:
+            if vehicle.plate in existing:
+                result.errors.append((line, f"plate: авто с номером {vehicle.plate} уже есть"))
+                continue
+            rows.append((line, vehicle, *related))
+        if not rows:
+            return
+
+        created = {model: {} for model in self.known}
+        vehicles, links, images = [], [], []
+        try:
+            with transaction.atomic():
+                for line, vehicle, vehicle_type, location, features, paths in rows:
+                    vehicle.type_id = self.resolve(created, VehicleType, *vehicle_type)
+                    vehicle.location_id = self.resolve(created, Location, *location)
+                    feature_ids = dict.fromkeys(self.resolve(created, Feature, *feature) for feature in features)
+                    vehicles.append(vehicle)
+                    links += [Vehicle.features.through(vehicle_id=vehicle.pk, feature_id=pk) for pk in feature_ids]
+                    images += [VehicleImage(vehicle_id=vehicle.pk, image=self.store(path)) for path in paths]
+                Vehicle.objects.bulk_create(vehicles)
+                Vehicle.features.through.objects.bulk_create(links)
+                VehicleImage.objects.bulk_create(images)
+                vehicle_ids = [vehicle.pk for vehicle in vehicles]
+                transaction.on_commit(lambda: self.after_commit(vehicle_ids, images))
+        except DatabaseError as e:
+            result.errors += [(line, f"пачка не записана: {e}") for line, *_ in rows]
+            return
+        for model, pks in created.items():
+            self.known[model].update(pks)
+        result.created += len(vehicles)
+
+    def after_commit(self, vehicle_ids, images):
+        search.index_vehicles(vehicle_ids)
+        bump_catalog_version()
+        if self.thumbnails:
+            for image in images:
+                if image.pk is not None:
+                    thumbnails.schedule(image.pk, image.image.name)
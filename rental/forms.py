@@ -1,5 +1,8 @@
+import zipfile
+
 from django import forms
 from .models import Booking
+from .pricing import MAX_QUOTE_DAYS
 
 class BookingForm(forms.ModelForm):
     class Meta:
@@ -10,6 +13,16 @@ class BookingForm(forms.ModelForm):
             'date_to': forms.DateInput(attrs={'type': 'date'}),
         }
 
+    def clean(self):
+        data = super().clean()
+        date_from, date_to = data.get("date_from"), data.get("date_to")
+        if date_from and date_to:
+            if date_to < date_from:
+                self.add_error("date_to", "Дата окончания раньше даты начала")
+            elif (date_to - date_from).days >= MAX_QUOTE_DAYS:
+                self.add_error("date_to", f"Бронь длиннее {MAX_QUOTE_DAYS} дней")
+        return data
+
 
 class DemoPaymentForm(forms.Form):
     card_number = forms.CharField(max_length=19, label="Номер карты", widget=forms.TextInput(attrs={
@@ -30,3 +43,14 @@ class DemoPaymentForm(forms.Form):
         if not v.isdigit() or len(v) < 12:
             raise forms.ValidationError("Неверный номер карты")
         return v
+
+
+class FleetImportForm(forms.Form):
+    data = forms.FileField(label="Файл CSV/JSONL")
+    images = forms.FileField(label="Фото (ZIP)", required=False)
+
+    def clean_images(self):
+        archive = self.cleaned_data.get("images")
+        if archive and not zipfile.is_zipfile(archive):
+            raise forms.ValidationError("Ожидался ZIP-архив")
+        return archive
@@ -0,0 +1,90 @@
+"""Снятие просроченных неоплаченных броней.
+
+Для проверок занятости бронь pending_payment старше HOLD_TTL и так считается свободной
+(availability.active_bookings). Здесь она получает статус "expired" и уходит из
+рабочего набора проверок. Запуск: команда expire_holds или фоновый поток в процессе
+веб-сервера (start_scheduler из autopark/wsgi.py, интервал BOOKING_HOLD_SWEEP_INTERVAL).
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, router, transaction
+
+from . import occupancy
+from .availability import hold_cutoff
+from .models import Booking
+
+BATCH_SIZE = 500
+SWEEP_INTERVAL = getattr(settings, "BOOKING_HOLD_SWEEP_INTERVAL", 60)
+
+logger = logging.getLogger(__name__)
+
+
+def expire_batch(batch_size=BATCH_SIZE):
+    """Одна пачка: выборка по индексу (status, created_at) и один UPDATE. Возвращает число снятых броней."""
+    using = router.db_for_write(Booking)
+    with transaction.atomic(using=using):
+        rows = list(
+            Booking.objects.using(using)
+            .filter(status="pending_payment", created_at__lte=hold_cutoff())
+            .order_by("created_at")
+            .values_list("pk", "vehicle_id")[:batch_size]
+        )
+        if not rows:
+            return 0
+        # статус в условии: бронь, оплаченную за это время, не трогаем
+        expired = Booking.objects.using(using).filter(
+            pk__in=[pk for pk, _ in rows], status="pending_payment"
+        ).update(status="expired")
+        # UPDATE минует сигналы
+        vehicle_ids = {vehicle_id for _, vehicle_id in rows}
+        transaction.on_commit(lambda: [occupancy.invalidate(v) for v in vehicle_ids], using=using)
+    return expired
+
+
+def expire_holds(batch_size=BATCH_SIZE):
+    total = 0
+    while True:
+        expired = expire_batch(batch_size)
+        total += expired
+        if expired < batch_size:
+            return total
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _run(interval, stop):
+    while not stop.wait(interval):
+        try:
+            expired = expire_holds()
+            if expired:
+                logger.info("Снято просроченных броней: %d", expired)
+        except Exception:
+            logger.exception("Ошибка при снятии просроченных броней")
+        finally:
+            close_old_connections()
+
+
+def start_scheduler(interval=SWEEP_INTERVAL):
+    """Запускает фоновый поток очистки один раз на процесс; interval=0 отключает."""
+    global _scheduler
+    if not interval:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            stop = threading.Event()
+            thread = threading.Thread(target=_run, args=(interval, stop), name="expire-holds", daemon=True)
+            thread.start()
+            _scheduler = thread, stop
+    return _scheduler
+
+
+def stop_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler[1].set()
+            _scheduler = None
@@ -0,0 +1,104 @@
+import random
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from rental.availability import VehicleUnavailable, reserve
+from rental.models import Booking, Location, Vehicle, VehicleType
+
+
+class Command(BaseCommand):
+    help = ("Пропускная способность брони под конкуренцией: потоки вызывают availability.reserve() "
+            "на общих авто и датах, в конце проверяется, что двойных броней нет. Нужна БД в файле "
+            "(у потоков свои соединения); созданные данные удаляются")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--attempts", type=int, default=200, help="Попыток брони на поток")
+        parser.add_argument("--vehicles", type=int, default=3)
+        parser.add_argument("--days", type=int, default=30, help="Окно дат, в котором выбираются брони")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, threads, attempts, vehicles, days, seed, **options):
+        user, fleet = self.populate(vehicles)
+        try:
+            created, rejected, errors = [], [], []
+            start = timezone.localdate() + timedelta(days=365)
+
+            def worker(n):
+                rnd = random.Random(seed * 1000 + n)
+                try:
+                    for _ in range(attempts):
+                        date_from = start + timedelta(days=rnd.randrange(days))
+                        booking = Booking(
+                            user=user, vehicle=rnd.choice(fleet), total_price=1, status="pending_payment",
+                            date_from=date_from, date_to=date_from + timedelta(days=rnd.randrange(4)),
+                        )
+                        try:
+                            reserve(booking)
+                            created.append(booking.pk)
+                        except VehicleUnavailable:
+                            rejected.append(booking)
+                except Exception as e:  # noqa: BLE001 — ошибки потоков выводим ниже
+                    errors.append(e)
+                finally:
+                    connection.close()
+
+            workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+            started = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            overlaps = self.overlaps(fleet)
+        finally:
+            self.cleanup(user, fleet)
+
+        attempted = len(created) + len(rejected)
+        self.stdout.write(
+            f"{threads} потоков, {attempted} попыток за {elapsed:.2f}s: {attempted / elapsed:.0f} попыток/с, "
+            f"броней {len(created)} ({len(created) / elapsed:.0f}/с), отказов {len(rejected)}"
+        )
+        if errors:
+            raise CommandError(f"Ошибки в потоках ({len(errors)}): {errors[0]!r}")
+        if overlaps:
+            raise CommandError(f"Двойные брони: {overlaps}")
+
+    @staticmethod
+    def populate(count):
+        suffix = uuid.uuid4().hex[:8]
+        user = User.objects.create(username=f"bench-bookings-{suffix}")
+        vehicle_type = VehicleType.objects.create(name=f"bench-{suffix}")
+        location = Location.objects.create(city=f"bench-{suffix}")
+        fleet = [
+            Vehicle.objects.create(type=vehicle_type, location=location, title=f"bench {n}",
+                                   plate=f"BB-{suffix}-{n}", transmission="AT", fuel="petrol", price_per_day=1000)
+            for n in range(count)
+        ]
+        return user, fleet
+
+    @staticmethod
+    def overlaps(fleet):
+        """Число пар пересекающихся броней одного авто."""
+        found = 0
+        for vehicle in fleet:
+            intervals = sorted(Booking.objects.filter(vehicle=vehicle).values_list("date_from", "date_to"))
+            found += sum(prev_to >= next_from for (_, prev_to), (next_from, _) in zip(intervals, intervals[1:]))
+        return found
+
+    @staticmethod
+    def cleanup(user, fleet):
+        Booking.objects.filter(vehicle__in=fleet).delete()
+        vehicle_type, location = fleet[0].type, fleet[0].location
+        for vehicle in fleet:
+            vehicle.delete()
+        vehicle_type.delete()
+        location.delete()
+        user.delete()
@@ -0,0 +1,200 @@
+import json
+import time
+import tracemalloc
+from datetime import timedelta
+from itertools import count
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.db.models import Max
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rental.models import Booking, Vehicle
+
+# файл базы в .gitignore: замеры зависят от машины и данных
+DEFAULT_BASELINE = Path(getattr(settings, "BENCH_ENDPOINTS_BASELINE", Path(settings.BASE_DIR) / "bench_endpoints.json"))
+
+
+def percentile(values, p):
+    """Ближайший ранг по отсортированному списку."""
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+class Command(BaseCommand):
+    help = ("Замеры горячих endpoint'ов в процессе на текущих данных (см. generate_fleet): p50/p95, "
+            "число запросов и пик памяти на запрос. Результат сравнивается с JSON-базой; при регрессии "
+            "сверх порога команда завершается с ошибкой. Каждый запрос идёт в своей транзакции, как в проде "
+            "(on_commit-хуки срабатывают); созданные замерами брони после замеров удаляются")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+        parser.add_argument("--save", action="store_true", help="Записать результат как новую базу")
+        parser.add_argument("--repeat", type=int, default=30)
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument("--only", nargs="+", help="Только указанные сценарии")
+        parser.add_argument("--cold", action="store_true", help="Очищать кэш перед каждым запросом")
+        parser.add_argument("--query", help="Строка поиска для vehicles_list_q (по умолчанию из названия авто)")
+        parser.add_argument("--threshold", type=float, default=0.25, help="Допустимый рост p50/p95 и памяти")
+        parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                            help="Рост задержки меньше этого не считается регрессией (шум)")
+
+    def handle(self, *args, **options):
+        vehicle = Vehicle.objects.active().order_by("pk").first()
+        if vehicle is None:
+            raise CommandError("Нет активных авто: сначала заполните базу (generate_fleet)")
+        dataset = {"vehicles": Vehicle.objects.count(), "bookings": Booking.objects.count()}
+
+        user, created = self.bench_user()
+        # брони сценариев — на свободные даты после всех существующих броней авто
+        last = Booking.objects.filter(vehicle=vehicle).aggregate(last=Max("date_to"))["last"]
+        free = max(last or timezone.localdate(), timezone.localdate()) + timedelta(days=30)
+        try:
+            # DEBUG=False, как в проде: иначе каждый запрос к БД ещё и пишется в connection.queries
+            with override_settings(DEBUG=False):
+                client = Client(HTTP_HOST="localhost")
+                client.force_login(user)
+                scenarios = self.scenarios(client, vehicle, free, options["query"])
+                unknown = set(options["only"] or ()) - {name for name, *_ in scenarios}
+                if unknown:
+                    raise CommandError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+                results = {}
+                for name, request, expected in scenarios:
+                    if options["only"] and name not in options["only"]:
+                        continue
+                    results[name] = self.measure(name, request, expected, options)
+                    self.stdout.write(
+                        f"{name:>22}: p50 {results[name]['p50_ms']:7.2f} ms, p95 {results[name]['p95_ms']:7.2f} ms, "
+                        f"{results[name]['queries']:3d} запросов, {results[name]['alloc_kb']:8.1f} KB"
+                    )
+        finally:
+            self.cleanup(vehicle, free, user if created else None)
+
+        report = {"dataset": dataset, "repeat": options["repeat"], "cold": options["cold"], "endpoints": results}
+        baseline = options["baseline"]
+        if options["save"] or not baseline.exists():
+            baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+            self.stdout.write(f"База сохранена: {baseline}")
+            return
+        self.compare(report, json.loads(baseline.read_text()), options)
+
+    @staticmethod
+    def bench_user():
+        """(пользователь, создан ли): с историей броней, чтобы профиль был не пустым."""
+        user_id = Booking.objects.order_by("pk").values_list("user_id", flat=True).first()
+        User = get_user_model()
+        if user_id is not None:
+            return User.objects.get(pk=user_id), False
+        return User.objects.get_or_create(username="bench-endpoints", defaults={"email": "bench-endpoints@example.com"})
+
+    @staticmethod
+    def cleanup(vehicle, since, user=None):
+        """Удаляет брони сценариев (все они — с даты since) через ORM: сигналы обновят сводки,
+        кэш занятости и каталог, как после отмены брони."""
+        Booking.objects.filter(vehicle=vehicle, date_from__gte=since).delete()
+        if user is not None:
+            user.delete()
+
+    @staticmethod
+    def scenarios(client, vehicle, free, query):
+        """(имя, функция запроса, ожидаемый код ответа); брони создаются с даты free."""
+        offsets = count()
+        held = Booking.objects.create(
+            user_id=client.session["_auth_user_id"], vehicle=vehicle, date_from=free, date_to=free + timedelta(days=2),
+            total_price=vehicle.price_per_day * 3, status="pending_payment",
+        )
+        free += timedelta(days=10)
+
+        def post_booking():
+            date_from = free + timedelta(days=3 * next(offsets))
+            return client.post(reverse("create_booking", args=[vehicle.pk]), {
+                "date_from": date_from.isoformat(), "date_to": (date_from + timedelta(days=1)).isoformat(),
+            })
+
+        query = query or vehicle.title.split()[0]
+        return [
+            ("home", lambda: client.get(reverse("home")), 200),
+            ("vehicles_list", lambda: client.get(reverse("vehicles")), 200),
+            ("vehicles_list_q", lambda: client.get(reverse("vehicles"), {"q": query}), 200),
+            ("vehicle_detail", lambda: client.get(reverse("vehicle_detail", args=[vehicle.pk])), 200),
+            ("create_booking_get", lambda: client.get(reverse("create_booking", args=[vehicle.pk])), 200),
+            ("create_booking_post", post_booking, 302),
+            ("payment_page", lambda: client.get(reverse("payment_page", args=[held.pk])), 200),
+            ("profile", lambda: client.get(reverse("profile")), 200),
+            # /vehicles/ занят HTML-каталогом, список API отдаётся с суффиксом формата
+            ("api_vehicles", lambda: client.get(reverse("vehicle-list", kwargs={"format": "json"})), 200),
+            ("api_bookings", lambda: client.get(reverse("booking-list"), HTTP_ACCEPT="application/json"), 200),
+        ]
+
+    @staticmethod
+    def measure(name, request, expected, options):
+        def run():
+            if options["cold"]:
+                cache.clear()
+            response = request()
+            if response.status_code != expected:
+                raise CommandError(f"{name}: ответ {response.status_code}, ожидался {expected}")
+
+        for _ in range(options["warmup"]):
+            run()
+
+        timings = []
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        # запросы и память — отдельными прогонами: учёт запросов и tracemalloc искажают время
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        # следующий запрос очистит connection.queries (сигнал request_started): считаем сразу
+        query_count = len(queries)
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(3):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                run()
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p95_ms": round(percentile(timings, 95), 3),
+            "queries": query_count,
+            "alloc_kb": round(percentile(peaks, 50) / 1024, 1),
+        }
+
+    def compare(self, report, baseline, options):
+        if baseline.get("dataset") != report["dataset"] or baseline.get("cold") != report["cold"]:
+            self.stdout.write(self.style.WARNING(
+                f"База снята на других данных или режиме кэша: {baseline.get('dataset')}, cold={baseline.get('cold')}"
+            ))
+        threshold = 1 + options["threshold"]
+        regressions = []
+        for name, current in report["endpoints"].items():
+            base = baseline.get("endpoints", {}).get(name)
+            if base is None:
+                continue
+            for metric in ("p50_ms", "p95_ms"):
+                if current[metric] > base[metric] * threshold and current[metric] - base[metric] > options["min_delta_ms"]:
+                    regressions.append(f"{name}.{metric}: {base[metric]} -> {current[metric]}")
+            # число запросов детерминировано: любой рост — регрессия
+            if current["queries"] > base["queries"]:
+                regressions.append(f"{name}.queries: {base['queries']} -> {current['queries']}")
+            if current["alloc_kb"] > base["alloc_kb"] * threshold:
+                regressions.append(f"{name}.alloc_kb: {base['alloc_kb']} -> {current['alloc_kb']}")
+        if regressions:
+            raise CommandError("Регрессия относительно {}:\n  {}".format(options["baseline"], "\n  ".join(regressions)))
+        self.stdout.write(self.style.SUCCESS(f"Без регрессий относительно {options['baseline']}"))
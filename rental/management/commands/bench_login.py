@@ -0,0 +1,70 @@
+import random
+import time
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+
+from autopark.auth_backends import create_email_index
+from autopark.forms import CustomLoginForm
+
+PASSWORD = "bench-password"
+FAST_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+
+class Command(BaseCommand):
+    help = ("Пропускная способность входа по email: прежний путь (User.objects.get + authenticate) "
+            "и EmailBackend на таблице пользователей заданного размера (данные откатываются)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100000)
+        parser.add_argument("--logins", type=int, default=500)
+        parser.add_argument("--real-hasher", action="store_true",
+                            help="Хэшер из настроек; по умолчанию MD5, чтобы мерить поиск, а не PBKDF2")
+
+    def handle(self, *args, users, logins, real_hasher, **options):
+        hashers = {} if real_hasher else {"PASSWORD_HASHERS": FAST_HASHERS}
+        with override_settings(**hashers), transaction.atomic():
+            password = make_password(PASSWORD)
+            User.objects.bulk_create(
+                (User(username=f"bench{n}", email=f"bench{n}@example.com", password=password) for n in range(users)),
+                batch_size=5000,
+            )
+            create_email_index(connection.alias)
+            rnd = random.Random(1)
+            known = [f"bench{rnd.randrange(users)}@example.com" for _ in range(logins)]
+            unknown = [f"nobody{n}@example.com" for n in range(logins)]
+
+            for label, emails in (("известный email", known), ("неизвестный email", unknown)):
+                old = self.measure(emails, self.old_login)
+                new = self.measure(emails, self.new_login)
+                self.stdout.write(
+                    f"{label:>17}: прежний путь {len(emails) / old:8.0f} входов/с, "
+                    f"EmailBackend {len(emails) / new:8.0f} входов/с (x{old / new:.1f})"
+                )
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def old_login(email):
+        # как было в CustomLoginForm.clean
+        try:
+            user = User.objects.get(email=email)
+        except User.DoesNotExist:
+            return None
+        return authenticate(username=user.username, password=PASSWORD)
+
+    @staticmethod
+    def new_login(email):
+        form = CustomLoginForm({"email": email, "password": PASSWORD})
+        form.is_valid()
+        return form.get_user()
+
+    @staticmethod
+    def measure(emails, login):
+        started = time.perf_counter()
+        for email in emails:
+            login(email)
+        return time.perf_counter() - started
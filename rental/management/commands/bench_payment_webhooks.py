@@ -0,0 +1,97 @@
+import json
+import random
+import time
+import uuid
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from rental.models import Booking, Location, Payment, Vehicle, VehicleType
+from rental.payments import complete, reset_providers, sign_webhook
+from rental.webhooks import BATCH_SIZE, process_pending
+
+SECRET = "bench-secret"
+PROVIDERS = {"bench": {"class": "rental.payments.DemoProvider", "webhook_secret": SECRET}}
+
+
+class Command(BaseCommand):
+    help = ("Пропускная способность вебхуков оплат: приём через endpoint и пакетное применение "
+            "против транзакции на событие (локальный генератор событий, данные откатываются)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--payments", type=int, default=2000)
+        parser.add_argument("--duplicates", type=float, default=0.2, help="Доля повторных доставок")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, payments, duplicates, batch_size, seed, **options):
+        rnd = random.Random(seed)
+        with override_settings(PAYMENT_PROVIDERS=PROVIDERS), transaction.atomic():
+            reset_providers()
+            batched = self.populate(payments)
+            single = self.populate(payments)
+            events = self.generate(batched, duplicates, rnd)
+
+            client = Client(HTTP_HOST="localhost")
+            url = reverse("payment_webhook", args=["bench"])
+            started = time.perf_counter()
+            results = [
+                client.post(url, body, content_type="application/json", HTTP_X_SIGNATURE=sign_webhook(SECRET, body))
+                .json()["status"]
+                for body in events
+            ]
+            ingest = time.perf_counter() - started
+
+            started = time.perf_counter()
+            applied = process_pending(batch_size)
+            batch = time.perf_counter() - started
+
+            # для сравнения: каждое событие — своя транзакция с двумя UPDATE, как в payments.complete()
+            started = time.perf_counter()
+            for payment in single:
+                complete(payment, "succeeded")
+            per_event = time.perf_counter() - started
+
+            paid = Booking.objects.filter(payment__in=batched, status="paid").count()
+            transaction.set_rollback(True)
+        reset_providers()
+
+        self.stdout.write(
+            f"приём: {len(events)} запросов за {ingest:.2f}s ({len(events) / ingest:.0f}/с), "
+            f"в очереди {results.count('queued')}, дублей {results.count('duplicate')}"
+        )
+        self.stdout.write(f"пачками по {batch_size}: {applied} событий за {batch:.2f}s ({applied / batch:.0f}/с), "
+                          f"оплачено броней {paid}")
+        self.stdout.write(f"по одному: {len(single)} событий за {per_event:.2f}s ({len(single) / per_event:.0f}/с)")
+
+    def populate(self, count):
+        user, _ = User.objects.get_or_create(username="bench-webhooks")
+        vehicle = Vehicle.objects.create(
+            type=VehicleType.objects.create(name="bench"), location=Location.objects.create(city="bench"),
+            title="bench", plate=f"BENCH-{uuid.uuid4().hex[:8]}", transmission="AT", fuel="petrol", price_per_day=1000,
+        )
+        # по дню на бронь: пересекающиеся брони оплата не переводит в "paid"
+        days = [date(2040, 1, 1) + timedelta(days=n) for n in range(count)]
+        bookings = Booking.objects.bulk_create([
+            Booking(user=user, vehicle=vehicle, date_from=day, date_to=day, total_price=1000, status="pending_payment")
+            for day in days
+        ])
+        return Payment.objects.bulk_create([
+            Payment(booking=booking, provider="bench", amount=1000, status="requires_action",
+                    provider_intent_id=str(uuid.uuid4()))
+            for booking in bookings
+        ])
+
+    @staticmethod
+    def generate(payments, duplicates, rnd):
+        events = [
+            json.dumps({"id": f"evt_{uuid.uuid4().hex}", "intent_id": p.provider_intent_id, "status": "succeeded"})
+            for p in payments
+        ]
+        events += rnd.sample(events, int(len(events) * duplicates))
+        rnd.shuffle(events)
+        return [body.encode() for body in events]
@@ -0,0 +1,71 @@
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import requests
+from django.core.management.base import BaseCommand
+
+from rental.models import Payment
+from rental.payment_stub import StubServer
+from rental.payments import HTTPProvider, idempotency_key
+
+
+class Command(BaseCommand):
+    help = ("Нагрузка на путь оплаты через HTTPProvider: пул keep-alive соединений против "
+            "нового соединения на каждый платёж (по умолчанию — локальная заглушка, без БД)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", dest="count", type=int, default=1000)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--latency", type=float, default=0.0, help="Задержка заглушки, секунды")
+        parser.add_argument("--url", help="Адрес уже запущенного провайдера вместо встроенной заглушки")
+
+    def handle(self, *args, count, threads, latency, url, **options):
+        server = None if url else StubServer(latency=latency).start()
+        base_url = url or server.url
+        try:
+            provider = HTTPProvider("bench", base_url=base_url, pool_size=threads)
+            payments = [
+                Payment(booking_id=uuid.uuid4(), provider="bench", amount=Decimal("1000.00"),
+                        currency="KGS", status="requires_action", provider_intent_id=str(uuid.uuid4()))
+                for _ in range(count)
+            ]
+            pooled = self.run(lambda p: provider.charge(p, "4242424242424242"), payments, threads)
+            fresh = self.run(lambda p: self.charge_without_pool(base_url, p), payments, threads)
+        finally:
+            if server:
+                server.stop()
+        for label, (elapsed, latencies) in (("пул keep-alive", pooled), ("новое соединение", fresh)):
+            latencies.sort()
+            self.stdout.write(
+                f"{label:>17}: {len(latencies) / elapsed:7.0f} платежей/с, "
+                f"p50 {statistics.median(latencies) * 1000:6.2f} ms, "
+                f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.2f} ms"
+            )
+
+    @staticmethod
+    def charge_without_pool(base_url, payment):
+        # как было бы без общего клиента: requests.post открывает и закрывает соединение
+        response = requests.post(
+            f"{base_url}/charges",
+            json={"amount": str(payment.amount), "currency": payment.currency,
+                  "card_number": "4242424242424242", "reference": str(payment.booking_id)},
+            headers={"Idempotency-Key": idempotency_key(payment) + "-fresh"},
+            timeout=(2, 10),
+        )
+        response.raise_for_status()
+        return response.json()["status"]
+
+    @staticmethod
+    def run(charge, payments, threads):
+        def timed(payment):
+            started = time.perf_counter()
+            charge(payment)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(timed, payments))
+        return time.perf_counter() - started, latencies
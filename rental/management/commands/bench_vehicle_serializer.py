@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rental.models import Vehicle, VehicleType, Location, Feature
+from rental.serializers import VehicleSerializer, VEHICLE_VALUES, vehicle_rows
+
+
+class Command(BaseCommand):
+    help = "Сравнивает VehicleSerializer и быстрый путь vehicle_rows() на 1k/10k авто (данные откатываются)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, sizes, repeat, **options):
+        with transaction.atomic():
+            vehicle_type = VehicleType.objects.create(name="bench")
+            location = Location.objects.create(city="bench")
+            features = [Feature.objects.create(name=f"bench-{n}") for n in range(5)]
+            created = 0
+            for size in sorted(sizes):
+                created += self.populate(size - created, created, vehicle_type, location, features)
+                queryset = Vehicle.objects.filter(type=vehicle_type)
+
+                slow = self.measure(repeat, lambda: VehicleSerializer(queryset.prefetch_related("features"), many=True).data)
+                fast = self.measure(repeat, lambda: vehicle_rows(queryset.values(*VEHICLE_VALUES)))
+                self.stdout.write(
+                    f"{size:>7} авто: VehicleSerializer {slow * 1000:8.1f} ms, "
+                    f"vehicle_rows {fast * 1000:8.1f} ms, x{slow / fast:.1f}"
+                )
+            transaction.set_rollback(True)
+
+    def populate(self, count, offset, vehicle_type, location, features):
+        vehicles = Vehicle.objects.bulk_create([
+            Vehicle(type=vehicle_type, location=location, title=f"bench {n}", plate=f"BENCH{n}",
+                    transmission="AT", fuel="petrol", price_per_day=1000)
+            for n in range(offset, offset + count)
+        ], batch_size=1000)
+        Vehicle.features.through.objects.bulk_create([
+            Vehicle.features.through(vehicle_id=vehicle.pk, feature_id=feature.pk)
+            for n, vehicle in enumerate(vehicles) for feature in features[:n % len(features) + 1]
+        ], batch_size=1000)
+        return count
+
+    @staticmethod
+    def measure(repeat, func):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
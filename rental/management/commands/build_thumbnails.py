@@ -0,0 +1,52 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rental.models import VehicleImage
+from rental.thumbnails import generate, touch_vehicles
+
+
+class Command(BaseCommand):
+    help = "Строит WebP/AVIF миниатюры для уже загруженных фото авто (параллельно, пулом процессов)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--force", action="store_true", help="Перестроить и уже готовые миниатюры")
+
+    def handle(self, *args, workers, batch_size, force, **options):
+        rows = VehicleImage.objects.order_by("pk").values_list("pk", "image", "derivatives")
+        todo = [
+            (pk, name) for pk, name, derivatives in rows.iterator(chunk_size=2000)
+            if name and (force or derivatives.get("source") != name)
+        ]
+        self.stdout.write(f"Фото к обработке: {len(todo)}")
+
+        done = failed = 0
+        batch = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(generate, name): pk for pk, name in todo}
+            for future in as_completed(futures):
+                try:
+                    derivatives = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {e}")
+                    continue
+                batch.append(VehicleImage(pk=futures[future], derivatives=derivatives))
+                if len(batch) >= batch_size:
+                    done += self.flush(batch)
+        done += self.flush(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Готово: {done}, ошибок: {failed}"))
+
+    def flush(self, batch):
+        count = len(batch)
+        if batch:
+            with transaction.atomic():
+                VehicleImage.objects.bulk_update(batch, ["derivatives"], batch_size=count)
+                touch_vehicles(VehicleImage.objects.filter(pk__in=[image.pk for image in batch]))
+            batch.clear()
+        return count
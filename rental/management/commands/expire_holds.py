@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from rental.holds import BATCH_SIZE, expire_holds
+
+
+class Command(BaseCommand):
+    help = "Снимает неоплаченные брони старше BOOKING_HOLD_TTL (пачками, один UPDATE на пачку)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, batch_size, **options):
+        self.stdout.write(f"Снято просроченных броней: {expire_holds(batch_size)}")
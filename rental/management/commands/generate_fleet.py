@@ -0,0 +1,260 @@
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from rental import ratings, rollups, search
+from rental.caching import bump_catalog_version
+from rental.models import Booking, Feature, Location, Payment, Review, Vehicle, VehicleImage, VehicleType
+
+CITIES = [
+    ("Бишкек", "Bishkek"), ("Ош", "Osh"), ("Каракол", "Karakol"), ("Чолпон-Ата", "Cholpon-Ata"),
+    ("Нарын", "Naryn"), ("Джалал-Абад", "Jalal-Abad"), ("Талас", "Talas"), ("Баткен", "Batken"),
+]
+STREETS = [("пр. Чуй", "Chuy Ave"), ("ул. Киевская", "Kievskaya St"), ("пр. Манаса", "Manas Ave"),
+           ("ул. Ленина", "Lenin St"), ("ул. Токтогула", "Toktogul St")]
+TYPES = [("Седан", "Sedan"), ("Внедорожник", "SUV"), ("Хэтчбек", "Hatchback"), ("Минивэн", "Minivan"),
+         ("Кроссовер", "Crossover"), ("Пикап", "Pickup")]
+FEATURES = [
+    ("Кондиционер", "Air conditioning"), ("Навигатор", "Navigation"), ("Камера заднего вида", "Rear camera"),
+    ("Подогрев сидений", "Heated seats"), ("Bluetooth", "Bluetooth"), ("Круиз-контроль", "Cruise control"),
+    ("Детское кресло", "Child seat"), ("Люк", "Sunroof"), ("Полный привод", "All-wheel drive"),
+    ("Парктроник", "Parking sensors"),
+]
+MODELS = ["Toyota Camry", "Toyota RAV4", "Honda CR-V", "Hyundai Sonata", "Kia Sportage", "Lexus RX",
+          "Mercedes E-Class", "BMW X5", "Subaru Forester", "Nissan X-Trail", "Volkswagen Polo", "Chevrolet Cobalt"]
+COLORS = [("белый", "white"), ("чёрный", "black"), ("серебристый", "silver"), ("синий", "blue"), ("красный", "red")]
+REVIEWS = [
+    ("Отличная машина, всё понравилось", "Great car, everything was fine"),
+    ("Чистый салон, быстрая выдача", "Clean interior, quick pickup"),
+    ("Нормально, но расход великоват", "Fine, but fuel consumption is high"),
+    ("Были проблемы с кондиционером", "Had issues with the air conditioning"),
+]
+FUELS = ["petrol", "diesel", "hybrid", "ev"]
+
+BOOKING_FIELDS = ("id", "user", "vehicle", "date_from", "date_to", "total_price", "status", "created_at")
+PAYMENT_FIELDS = ("booking", "provider", "amount", "currency", "status", "provider_intent_id", "created_at",
+                  "updated_at")
+REVIEW_FIELDS = ("booking", "user", "vehicle", "rating", "text", "text_ru", "text_en", "is_approved", "created_at")
+
+
+@contextmanager
+def manual_timestamps(*models):
+    """bulk_create вызывает pre_save: auto_now/auto_now_add затёрли бы сгенерированные даты."""
+    fields = [f for model in models for f in model._meta.concrete_fields if getattr(f, "auto_now", False)
+              or getattr(f, "auto_now_add", False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def insert_rows(model, names, rows):
+    """INSERT через executemany, минуя создание моделей и компилятор запросов.
+
+    Для миллионов строк bulk_create тратит больше половины времени на экземпляры моделей
+    и на pre_save/prepare каждого значения; здесь остаётся только get_db_prep_save.
+    """
+    fields = [model._meta.get_field(name) for name in names]
+    quote = connection.ops.quote_name
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        quote(model._meta.db_table), ", ".join(quote(f.column) for f in fields), ", ".join(["%s"] * len(fields))
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [f.get_db_prep_save(value, connection) for f, value in zip(fields, row)] for row in rows
+        ])
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = ("Генерирует синтетический парк для нагрузочных проверок: авто с особенностями и фото, "
+            "непересекающиеся брони, оплаты и отзывы, ru/en колонки заполнены, детерминированно по --seed. "
+            "Авто пишутся bulk_create пачками, брони, оплаты и отзывы — сырым INSERT (executemany) мимо "
+            "моделей и сигналов: рейтинги, дневные сводки и поисковый индекс пересчитываются в конце; "
+            "с --no-rollups/--no-index запустите потом rebuild_rollups/rebuild_search_index")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vehicles", type=int, default=50000)
+        parser.add_argument("--bookings", type=int, default=1000000)
+        parser.add_argument("--users", type=int, default=20000)
+        parser.add_argument("--locations", type=int, default=40)
+        parser.add_argument("--images", type=int, default=2, help="Фото на авто")
+        parser.add_argument("--review-ratio", type=float, default=0.3, help="Доля завершённых броней с отзывом")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--start-date", type=lambda v: datetime.strptime(v, "%Y-%m-%d").date(),
+                            help="Начало истории броней (по умолчанию так, чтобы ~20%% броней были будущими)")
+        parser.add_argument("--chunk-size", type=int, default=20000)
+        parser.add_argument("--prefix", default="SYN", help="Префикс номеров и логинов сгенерированных данных")
+        parser.add_argument("--no-index", action="store_true", help="Не перестраивать поисковый индекс")
+        parser.add_argument("--no-rollups", action="store_true", help="Не пересчитывать дневные сводки")
+
+    def handle(self, *args, **options):
+        # префикс входит в seed: повторный запуск с другим --prefix не повторит id авто и броней
+        self.rnd = random.Random(f"{options['prefix']}:{options['seed']}")
+        self.chunk_size = options["chunk_size"]
+        self.prefix = options["prefix"]
+        self.today = timezone.localdate()
+        self.tz = timezone.get_current_timezone()
+        # бронь с разрывом в среднем 6,5 дней: по умолчанию ~80% броней в прошлом, остальные — будущие
+        per_vehicle = options["bookings"] // max(options["vehicles"], 1)
+        self.start = options["start_date"] or self.today - timedelta(days=per_vehicle * 26 // 5)
+        if options["vehicles"] < 1:
+            raise CommandError("--vehicles должно быть больше нуля")
+        if Vehicle.objects.filter(plate__startswith=self.prefix).exists():
+            raise CommandError(f"Данные с префиксом {self.prefix} уже есть, укажите другой --prefix")
+
+        started = time.perf_counter()
+        with manual_timestamps(Vehicle):
+            with transaction.atomic():
+                types, features, locations = self.catalog(options["locations"])
+                user_ids = self.create_users(options["users"])
+            vehicles = self.create_vehicles(options["vehicles"], types, features, locations, options["images"])
+            self.create_bookings(options["bookings"], vehicles, user_ids, options["review_ratio"])
+
+        transaction.on_commit(bump_catalog_version)
+        # отзывы вставлены мимо сигналов: рейтинги авто считаются одним агрегатом
+        self.stdout.write(f"Рейтинги: {ratings.recompute()} авто")
+        if not options["no_index"]:
+            self.stdout.write(f"Поисковый индекс: {search.rebuild()} авто")
+        last = Booking.objects.aggregate(last=Max("date_to"))["last"]
+        if not options["no_rollups"] and last is not None:
+            # вставка минует сигналы: сводки за всю сгенерированную историю пересчитываются целиком
+            rows = sum(count for _, count in rollups.rebuild_range(self.start, last))
+            self.stdout.write(f"Дневные сводки: {rows} строк")
+        self.stdout.write(f"Готово за {time.perf_counter() - started:.0f}s")
+
+    def uuid(self):
+        # uuid4 из генератора с seed — одинаковые id при одинаковом --seed
+        return uuid.UUID(int=self.rnd.getrandbits(128), version=4)
+
+    def moment(self, day):
+        return datetime.combine(day, dt_time(self.rnd.randrange(8, 22), self.rnd.randrange(60), tzinfo=self.tz))
+
+    def catalog(self, location_count):
+        # повторный запуск с другим --prefix берёт уже созданные типы и локации
+        types = [VehicleType.objects.get_or_create(name_ru=ru, defaults={"name_en": en})[0] for ru, en in TYPES]
+        existing = set(Feature.objects.values_list("name", flat=True))
+        Feature.objects.bulk_create([
+            Feature(name=ru, name_ru=ru, name_en=en) for ru, en in FEATURES if ru not in existing
+        ])
+        features = list(Feature.objects.filter(name__in=[ru for ru, _ in FEATURES]).values_list("pk", flat=True))
+        locations = [
+            Location.objects.get_or_create(
+                city_ru=CITIES[n % len(CITIES)][0], address_ru=f"{STREETS[n % len(STREETS)][0]}, {n + 1}",
+                defaults={"city_en": CITIES[n % len(CITIES)][1],
+                          "address_en": f"{STREETS[n % len(STREETS)][1]}, {n + 1}"},
+            )[0]
+            for n in range(location_count)
+        ]
+        return [t.pk for t in types], features, [loc.pk for loc in locations]
+
+    def create_users(self, count):
+        password = make_password(None)  # вход для сгенерированных пользователей не нужен
+        login = self.prefix.lower()
+        users = User.objects.bulk_create(
+            (User(username=f"{login}{n}", email=f"{login}{n}@example.com", password=password) for n in range(count)),
+            batch_size=self.chunk_size,
+        )
+        if users and users[0].pk is None:
+            return list(User.objects.filter(username__startswith=login).values_list("pk", flat=True))
+        return [u.pk for u in users]
+
+    def create_vehicles(self, count, types, features, locations, images):
+        rnd = self.rnd
+        vehicles = []
+        for chunk in chunked(range(count), self.chunk_size):
+            objs, links, photos = [], [], []
+            for n in chunk:
+                model, (color_ru, color_en), year = rnd.choice(MODELS), rnd.choice(COLORS), rnd.randrange(2012, 2025)
+                created = self.moment(self.start - timedelta(days=rnd.randrange(365)))
+                vehicle = Vehicle(
+                    id=self.uuid(), type_id=rnd.choice(types), location_id=rnd.choice(locations),
+                    title_ru=f"{model} {year}, {color_ru}", title_en=f"{model} {year}, {color_en}",
+                    plate=f"{self.prefix}{n:07d}", transmission=rnd.choice(["AT", "MT"]), fuel=rnd.choice(FUELS),
+                    seats=rnd.choice([2, 4, 5, 5, 5, 7, 8]), price_per_day=Decimal(rnd.randrange(15, 120) * 100),
+                    deposit=Decimal(rnd.randrange(0, 30) * 1000), is_active=rnd.random() > 0.03,
+                    created_at=created, updated_at=created,
+                )
+                objs.append(vehicle)
+                links += [Vehicle.features.through(vehicle_id=vehicle.pk, feature_id=f)
+                          for f in rnd.sample(features, rnd.randrange(len(features) + 1))]
+                photos += [VehicleImage(vehicle_id=vehicle.pk, image=f"vehicles/synthetic/{n}-{i}.jpg")
+                           for i in range(images)]
+            with transaction.atomic():
+                Vehicle.objects.bulk_create(objs)
+                Vehicle.features.through.objects.bulk_create(links)
+                VehicleImage.objects.bulk_create(photos)
+            vehicles += [(v.pk, v.price_per_day) for v in objs]
+            self.stdout.write(f"авто: {len(vehicles)}/{count}")
+        return vehicles
+
+    def bookings(self, total, vehicles, user_ids):
+        """Брони подряд по каждому авто с разрывами — пересечений нет по построению."""
+        rnd = self.rnd
+        per_vehicle, extra = divmod(total, len(vehicles))
+        for index, (vehicle_id, price) in enumerate(vehicles):
+            day = self.start + timedelta(days=rnd.randrange(7))
+            for _ in range(per_vehicle + (index < extra)):
+                days = rnd.randint(1, 7)
+                date_from, date_to = day, day + timedelta(days=days - 1)
+                day = date_to + timedelta(days=1 + rnd.randrange(6))
+                yield vehicle_id, price, rnd.choice(user_ids), date_from, date_to, days
+
+    def create_bookings(self, total, vehicles, user_ids, review_ratio):
+        rnd = self.rnd
+        now = timezone.now()
+        reviewed = set()
+        created = 0
+        started = time.perf_counter()
+        for chunk in chunked(self.bookings(total, vehicles, user_ids), self.chunk_size):
+            bookings, payments, reviews = [], [], []
+            for vehicle_id, price, user_id, date_from, date_to, days in chunk:
+                if date_to < self.today:
+                    status = "completed" if rnd.random() < 0.9 else "canceled"
+                else:
+                    status = "paid" if rnd.random() < 0.9 else "canceled"
+                booking_id, total_price = self.uuid(), price * days
+                booked = min(self.moment(date_from - timedelta(days=rnd.randrange(1, 30))), now)
+                bookings.append((booking_id, user_id, vehicle_id, date_from, date_to, total_price, status, booked))
+                if status != "canceled" or rnd.random() < 0.5:
+                    payments.append((
+                        booking_id, "demo", total_price, "KGS", "succeeded" if status != "canceled" else "refunded",
+                        str(self.uuid()), booked, booked,
+                    ))
+                # один отзыв пользователя на авто (unique_together)
+                if status == "completed" and rnd.random() < review_ratio and (user_id, vehicle_id) not in reviewed:
+                    reviewed.add((user_id, vehicle_id))
+                    rating = rnd.choices([5, 4, 3, 2, 1], weights=[50, 30, 10, 6, 4])[0]
+                    text_ru, text_en = REVIEWS[0 if rating == 5 else 1 if rating == 4 else 2 if rating == 3 else 3]
+                    # text дублирует text_ru, как при сохранении через modeltranslation
+                    reviews.append((
+                        booking_id, user_id, vehicle_id, rating, text_ru, text_ru, text_en,
+                        rnd.random() < 0.8, self.moment(date_to),
+                    ))
+            with transaction.atomic():
+                insert_rows(Booking, BOOKING_FIELDS, bookings)
+                insert_rows(Payment, PAYMENT_FIELDS, payments)
+                insert_rows(Review, REVIEW_FIELDS, reviews)
+            created += len(bookings)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"брони: {created}/{total} ({created / elapsed:.0f}/с)")
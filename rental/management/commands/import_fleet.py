@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rental.fleet_import import CHUNK_SIZE, FleetImporter, detect_format, read_rows
+
+MAX_ERRORS_SHOWN = 50
+
+
+class Command(BaseCommand):
+    help = ("Массовый импорт авто из CSV/JSONL с фото из каталога: типы, локации и особенности "
+            "создаются при необходимости, ошибки выводятся по строкам (формат — rental/fleet_import.py)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--images", help="Каталог с фото, на которые ссылается колонка images")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="По умолчанию — по расширению файла")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument("--no-thumbnails", action="store_true",
+                            help="Не строить миниатюры сразу (потом — build_thumbnails)")
+
+    def handle(self, *args, path, images, format, chunk_size, no_thumbnails, **options):
+        started = time.perf_counter()
+        importer = FleetImporter(image_dir=images, chunk_size=chunk_size, thumbnails=not no_thumbnails)
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                result = importer.run(read_rows(f, format or detect_format(path)))
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for line, message in result.errors[:MAX_ERRORS_SHOWN]:
+            self.stderr.write(f"строка {line}: {message}")
+        if len(result.errors) > MAX_ERRORS_SHOWN:
+            self.stderr.write(f"... и ещё {len(result.errors) - MAX_ERRORS_SHOWN} ошибок")
+        self.stdout.write(
+            f"Добавлено авто: {result.created}, строк с ошибками: {len(result.errors)} "
+            f"за {time.perf_counter() - started:.1f}s"
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from rental.payment_stub import StubServer
+
+
+class Command(BaseCommand):
+    help = "Запускает локальную заглушку платёжного провайдера (для HTTPProvider в разработке и нагрузке)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа, секунды")
+
+    def handle(self, *args, host, port, latency, **options):
+        server = StubServer((host, port), latency=latency)
+        self.stdout.write(f"Заглушка провайдера: {server.url}/charges")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
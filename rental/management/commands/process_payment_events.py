@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rental.webhooks import BATCH_SIZE, process_pending
+
+
+class Command(BaseCommand):
+    help = "Применяет очередь вебхуков оплат пачками (один UPDATE платежей и броней на пачку)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--loop", action="store_true", help="Не завершаться, опрашивать очередь")
+        parser.add_argument("--interval", type=float, default=1.0, help="Пауза между опросами, секунды")
+
+    def handle(self, *args, batch_size, loop, interval, **options):
+        while True:
+            processed = process_pending(batch_size)
+            if processed or not loop:
+                self.stdout.write(f"Обработано событий: {processed}")
+            if not loop:
+                break
+            time.sleep(interval)
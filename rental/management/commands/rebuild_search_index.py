@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import router
+
+from rental import search
+from rental.models import Vehicle
+
+
+class Command(BaseCommand):
+    help = "Пересобирает полнотекстовый индекс авто"
+
+    def handle(self, *args, **options):
+        search.create_index(using=router.db_for_write(Vehicle))
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано авто: {count}"))
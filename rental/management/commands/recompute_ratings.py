@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rental import ratings
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рейтинг авто (rating_avg, rating_count) из одобренных отзывов"
+
+    def handle(self, *args, **options):
+        count = ratings.recompute()
+        self.stdout.write(self.style.SUCCESS(f"Исправлен рейтинг авто: {count}"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+
+from rental.models import PaymentEvent
+from rental.webhooks import BATCH_SIZE, process_pending, replay
+
+
+class Command(BaseCommand):
+    help = "Возвращает сохранённые вебхуки оплат в очередь (и по желанию сразу применяет)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--provider")
+        parser.add_argument("--since", help="Получены не раньше, ISO 8601")
+        parser.add_argument("--event-id", nargs="+", default=[])
+        parser.add_argument("--intent", nargs="+", default=[], help="provider_intent_id платежей")
+        parser.add_argument("--process", action="store_true", help="Сразу применить очередь")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, provider, since, event_id, intent, process, batch_size, **options):
+        events = PaymentEvent.objects.all()
+        if provider:
+            events = events.filter(provider=provider)
+        if since:
+            events = events.filter(received_at__gte=parse_datetime(since))
+        if event_id:
+            events = events.filter(event_id__in=event_id)
+        if intent:
+            events = events.filter(intent_id__in=intent)
+        self.stdout.write(f"Возвращено в очередь: {replay(events)}")
+        if process:
+            self.stdout.write(f"Обработано событий: {process_pending(batch_size)}")
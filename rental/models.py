@@ -1,5 +1,4 @@
 import uuid
-from decimal import Decimal
 
 from django.db import models
 from django.conf import settings
@@ -40,6 +39,17 @@ class Location(models.Model):
         verbose_name_plural = _("Адресы")
 
 
+class VehicleQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(is_active=True)
+
+    def for_cards(self):
+        # всё, что нужно карточке авто: тип, локация и фото — постоянное число запросов на страницу
+        return self.select_related("type", "location").prefetch_related(
+            models.Prefetch("images", queryset=VehicleImage.objects.order_by("pk"), to_attr="prefetched_images")
+        )
+
+
 class Vehicle(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     type = models.ForeignKey(VehicleType, on_delete=models.PROTECT)
@@ -56,34 +66,77 @@ class Vehicle(models.Model):
     is_active = models.BooleanField(default=True)
     price_per_day = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     deposit = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # по одобренным отзывам; ведёт rental.ratings
+    rating_avg = models.FloatField(default=0, editable=False, verbose_name=_("Рейтинг"))
+    rating_count = models.PositiveIntegerField(default=0, editable=False, verbose_name=_("Отзывов"))
+    created_at = models.DateTimeField(auto_now_add=True)
+    # меняется и при правке фото, типа, локации, особенностей — это валидатор для vehicle_detail
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = VehicleQuerySet.as_manager()
+
+    RATING_FIELDS = ("rating_avg", "rating_count")
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            # рейтинг меняют UPDATE-ы из rental.ratings; сохранение формы с прочитанным раньше
+            # значением не должно их затирать (отложенные поля, как и без update_fields, не пишутся)
+            skip = {*self.RATING_FIELDS, *self.get_deferred_fields()}
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skip and field.name not in skip
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def primary_image(self):
+        # после for_cards() фото уже загружены, иначе — отдельный запрос
+        if hasattr(self, "prefetched_images"):
+            return self.prefetched_images[0] if self.prefetched_images else None
+        return self.images.first()
+
     def get_price_for_dates(self, start, end):
-        days = (end - start).days + 1
-        return (self.price_per_day * Decimal(days)).quantize(Decimal("0.01"))
+        # сезон, день недели и скидка за длительность — из rental.pricing; дни считаются включительно
+        from .pricing import quote
+        return quote(self, start, end)
 
     def is_available(self, start_date, end_date):
-        # Проверяем уже существующие брони с оплатой или ожидающие оплату
-        overlapping_bookings = self.bookings.filter(
-            status__in=["pending_payment", "paid"],
-            date_from__lte=end_date,
-            date_to__gte=start_date
-        )
-        return not overlapping_bookings.exists()
+        # Проверяем по маске занятости из кэша (брони + блокировки), вне горизонта — запросом
+        from .occupancy import is_free
+        return is_free(self, start_date, end_date)
 
     class Meta:
         verbose_name = _("Транспортное средство")
         verbose_name_plural = _("Транспортные средствы")
+        # порядок каталога и keyset-пагинация: (created_at, id) уникален и стабилен
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="vehicle_created_idx"),
+            # сортировка по рейтингу (pagination.ORDERINGS["rating"]) с тем же уникальным хвостом
+            models.Index(fields=["-rating_avg", "-rating_count", "-created_at", "-id"], name="vehicle_rating_idx"),
+        ]
 
 class VehicleImage(models.Model):
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="images")
     image = models.ImageField(upload_to="vehicles/")
+    # {"source": имя оригинала, "webp": {"320": путь, ...}, "avif": {...}} — заполняет rental.thumbnails
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Фото для {self.vehicle}"
 
+    @property
+    def webp_srcset(self):
+        from .thumbnails import srcset
+        return srcset(self.derivatives, "webp")
+
+    @property
+    def avif_srcset(self):
+        from .thumbnails import srcset
+        return srcset(self.derivatives, "avif")
+
 
 class VehicleAvailability(models.Model):
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="availabilities")
@@ -94,16 +147,25 @@ class VehicleAvailability(models.Model):
     class Meta:
         verbose_name = _("Недоступность авто")
         verbose_name_plural = _("Недоступности авто")
+        indexes = [models.Index(fields=["vehicle", "date_from", "date_to"])]
 
     def __str__(self):
         return f"{self.vehicle} недоступен с {self.date_from} по {self.date_to}"
 
 
+class BookingQuerySet(models.QuerySet):
+    def for_cards(self):
+        return self.select_related("vehicle__type", "vehicle__location").prefetch_related(
+            models.Prefetch("vehicle__images", queryset=VehicleImage.objects.order_by("pk"), to_attr="prefetched_images")
+        )
+
+
 class Booking(models.Model):
     STATUS = [
         ("new", "Новый"),
         ("pending_payment", "Ожидает оплаты"),
         ("paid", "Оплачен"),
+        ("expired", "Истёк срок оплаты"),
         ("canceled", "Отменён"),
         ("completed", "Завершён"),
     ]
@@ -116,10 +178,20 @@ class Booking(models.Model):
     status = models.CharField(max_length=20, choices=STATUS, default="new")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = BookingQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("Бронирование")
         verbose_name_plural = _("Бронирования")
-        indexes = [models.Index(fields=["vehicle", "date_from", "date_to"])]
+        indexes = [
+            models.Index(fields=["vehicle", "date_from", "date_to"]),
+            models.Index(fields=["user", "-created_at", "-id"], name="booking_user_created_idx"),
+            # поиск просроченных неоплаченных броней (holds.expire_holds); id — для фильтра по статусу
+            # в админке, где сортировка (-created_at, -id)
+            models.Index(fields=["status", "created_at", "id"], name="booking_status_created_idx"),
+            # сортировка списка в админке (ordering + pk)
+            models.Index(fields=["-created_at", "-id"], name="booking_created_idx"),
+        ]
         constraints = [
             models.CheckConstraint(
                 check=models.Q(date_to__gte=models.F("date_from")),
@@ -148,7 +220,7 @@ class Payment(models.Model):
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     currency = models.CharField(max_length=10, default="KGS")
     status = models.CharField(max_length=20, choices=STATUS)
-    provider_intent_id = models.CharField(max_length=120, blank=True)
+    provider_intent_id = models.CharField(max_length=120, blank=True, db_index=True)  # по нему приходят вебхуки
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -158,6 +230,33 @@ class Payment(models.Model):
     class Meta:
         verbose_name = _("Оплата")
         verbose_name_plural = _("Оплаты")
+        indexes = [models.Index(fields=["-created_at", "-id"], name="payment_created_idx")]
+
+
+class PaymentEvent(models.Model):
+    """Очередь вебхуков провайдера: принимаются сразу, применяются пачками (rental.webhooks)."""
+    provider = models.CharField(max_length=40)
+    event_id = models.CharField(max_length=120)
+    intent_id = models.CharField(max_length=120)
+    status = models.CharField(max_length=20, choices=Payment.STATUS)
+    payload = models.JSONField(default=dict)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Событие оплаты")
+        verbose_name_plural = _("События оплат")
+        constraints = [
+            # повторная доставка того же события отбрасывается на вставке
+            models.UniqueConstraint(fields=["provider", "event_id"], name="payment_event_unique"),
+        ]
+        indexes = [
+            # выборка необработанных событий по порядку поступления
+            models.Index(fields=["processed_at", "id"], name="payment_event_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.provider}:{self.event_id} -> {self.status}"
 
 
 class Review(models.Model):
@@ -173,11 +272,76 @@ class Review(models.Model):
         verbose_name = _("Обзор")
         verbose_name_plural = _("Обзоры")
         unique_together = ("user", "vehicle")  # нельзя дважды отзыв на одно авто
+        indexes = [models.Index(fields=["-created_at", "-id"], name="review_created_idx")]
 
     def __str__(self):
         return f"Отзыв {self.user} - {self.vehicle}"
 
 
+class DailyRollup(models.Model):
+    """Загрузка и выручка авто за день; ведётся инкрементально (rental.rollups)."""
+    date = models.DateField(verbose_name=_("Дата"))
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="rollups")
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name="rollups")
+    booked = models.IntegerField(default=0, verbose_name=_("Занято"))  # 1 — авто занято в этот день
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name=_("Выручка"))
+    refunds = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name=_("Возвраты"))
+
+    class Meta:
+        verbose_name = _("Дневная сводка")
+        verbose_name_plural = _("Дневные сводки")
+        constraints = [
+            # цель ON CONFLICT при инкрементальном обновлении; индекс служит и выборке по датам
+            models.UniqueConstraint(fields=["date", "vehicle", "location"], name="daily_rollup_key"),
+        ]
+        indexes = [models.Index(fields=["location", "date"], name="daily_rollup_location_idx")]
+
+    def __str__(self):
+        return f"{self.vehicle} {self.date}"
+
+
+class PriceRule(models.Model):
+    KIND = [
+        ("season", _("Сезон")),
+        ("weekday", _("День недели")),
+        ("duration", _("Длительность аренды")),
+    ]
+    WEEKDAYS = [
+        (0, _("Понедельник")), (1, _("Вторник")), (2, _("Среда")), (3, _("Четверг")),
+        (4, _("Пятница")), (5, _("Суббота")), (6, _("Воскресенье")),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND, verbose_name=_("Вид"))
+    name = models.CharField(max_length=120, blank=True, verbose_name=_("Название"))
+    # пусто — правило для всех типов транспорта
+    vehicle_type = models.ForeignKey(VehicleType, on_delete=models.CASCADE, null=True, blank=True,
+                                     verbose_name=_("Тип транспорта"))
+    date_from = models.DateField(null=True, blank=True, verbose_name=_("С"))      # season
+    date_to = models.DateField(null=True, blank=True, verbose_name=_("По"))       # season
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAYS, null=True, blank=True,
+                                               verbose_name=_("День недели"))     # weekday
+    min_days = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("От дней"))  # duration
+    # 1.25 — наценка 25%, 0.9 — скидка 10%
+    multiplier = models.DecimalField(max_digits=5, decimal_places=3, verbose_name=_("Коэффициент"))
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        verbose_name = _("Правило цены")
+        verbose_name_plural = _("Правила цен")
+        constraints = [
+            models.CheckConstraint(
+                check=(
+                    models.Q(kind="season", date_from__isnull=False, date_to__gte=models.F("date_from"))
+                    | models.Q(kind="weekday", weekday__isnull=False)
+                    | models.Q(kind="duration", min_days__isnull=False)
+                ),
+                name="price_rule_kind_fields",
+            )
+        ]
+
+    def __str__(self):
+        return self.name or f"{self.get_kind_display()} ×{self.multiplier}"
+
+
 class RentalPolicy(models.Model):
     title = models.CharField(max_length=255, verbose_name="Заголовок")
     rules = models.TextField(verbose_name="Условия проката")
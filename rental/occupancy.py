@@ -0,0 +1,197 @@
+"""Кэш занятости авто: ближайшие HORIZON_DAYS дней как битовая маска (int) в кэше Django.
+
+Бит i установлен, если авто занято в день origin + i, где origin — текущая дата.
+Проверка диапазона — это AND, а не запрос. Неоплаченные брони держат авто только
+HOLD_TTL: маска с такой бронью хранит срок её истечения и после него строится заново.
+Окончательную проверку при бронировании всё равно делает availability.reserve() по БД.
+
+Маски не правятся на месте: после коммита изменения брони или блокировки сигналы
+(rental.signals) поднимают поколение авто — атомарный счётчик в кэше, входящий в ключ
+маски. Маска, прочитанная из БД до изменения и записанная после, ляжет под старым
+ключом и читаться уже не будет.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.utils import timezone
+
+from . import availability
+from .availability import HOLD_TTL, active_bookings, has_conflict, merge_intervals
+from .models import VehicleAvailability
+
+HORIZON_DAYS = getattr(settings, "OCCUPANCY_HORIZON_DAYS", 365)
+CACHE_TIMEOUT = getattr(settings, "OCCUPANCY_CACHE_TIMEOUT", 2 * 24 * 3600)
+# ограничение числа параметров в IN (...) для SQLite
+QUERY_CHUNK = 500
+
+
+def _key(vehicle_id, origin, generation):
+    # дата в ключе: с наступлением нового дня маски строятся заново от новой точки отсчёта
+    return f"occupancy:{origin.isoformat()}:{vehicle_id}:{generation}"
+
+
+def _generation_key(vehicle_id):
+    return f"occupancy:generation:{vehicle_id}"
+
+
+def _generations(vehicle_ids):
+    """{авто: поколение}; отсутствующие счётчики заводятся от текущего времени, чтобы после
+    вытеснения из кэша не совпасть с прежними значениями."""
+    keys = {_generation_key(vehicle_id): vehicle_id for vehicle_id in vehicle_ids}
+    found = cache.get_many(list(keys))
+    missing = [key for key in keys if key not in found]
+    if missing:
+        start = time.time_ns()
+        for key in missing:
+            cache.add(key, start, None)
+        found.update(cache.get_many(missing))
+    return {keys[key]: generation for key, generation in found.items()}
+
+
+def range_mask(start, end, origin):
+    """Маска дней [start, end] относительно origin, обрезанная по горизонту."""
+    first = max((start - origin).days, 0)
+    last = min((end - origin).days, HORIZON_DAYS - 1)
+    if last < first:
+        return 0
+    return ((1 << (last - first + 1)) - 1) << first
+
+
+def build_bitmap(intervals, origin):
+    bits = 0
+    for start, end in intervals:
+        bits |= range_mask(start, end, origin)
+    return bits
+
+
+def bitmap_intervals(bits, origin):
+    """Обратное преобразование: маска -> слитые интервалы дат."""
+    intervals = []
+    day = 0
+    while bits:
+        if bits & 1:
+            start = day
+            while bits & 1:
+                bits >>= 1
+                day += 1
+            intervals.append((origin + timedelta(days=start), origin + timedelta(days=day - 1)))
+        else:
+            # пропускаем сразу весь хвост нулевых бит
+            skip = (bits & -bits).bit_length() - 1
+            bits >>= skip
+            day += skip
+    return intervals
+
+
+def _earliest(*moments):
+    moments = [m for m in moments if m is not None]
+    return min(moments) if moments else None
+
+
+def _load(vehicle_ids, origin):
+    """Маски из БД и для каждого авто — когда истекает самая ранняя неоплаченная бронь (или None)."""
+    horizon_end = origin + timedelta(days=HORIZON_DAYS - 1)
+    intervals = {vehicle_id: [] for vehicle_id in vehicle_ids}
+    expires = dict.fromkeys(vehicle_ids)
+    hold_created = Case(When(status="pending_payment", then=F("created_at")), output_field=DateTimeField())
+    for i in range(0, len(vehicle_ids), QUERY_CHUNK):
+        chunk = vehicle_ids[i:i + QUERY_CHUNK]
+        bookings = active_bookings().filter(vehicle_id__in=chunk, date_to__gte=origin, date_from__lte=horizon_end)
+        blocks = VehicleAvailability.objects.filter(vehicle_id__in=chunk, date_to__gte=origin, date_from__lte=horizon_end)
+        rows = bookings.values_list("vehicle_id", "date_from", "date_to", hold_created).union(
+            blocks.values_list("vehicle_id", "date_from", "date_to", Value(None, output_field=DateTimeField())),
+            all=True,
+        )
+        for vehicle_id, start, end, created_at in rows:
+            intervals[vehicle_id].append((start, end))
+            if created_at is not None:
+                expires[vehicle_id] = _earliest(expires[vehicle_id], created_at + HOLD_TTL)
+    bitmaps = {vehicle_id: build_bitmap(merge_intervals(items), origin) for vehicle_id, items in intervals.items()}
+    return bitmaps, expires
+
+
+def fleet_bitmaps(vehicle_ids, origin=None):
+    """Маски для набора авто: одним get_many из кэша, промахи — одним запросом на пачку.
+
+    В кэше лежит (маска, срок): срок — когда истекает самая ранняя неоплаченная бронь
+    в маске; после него маска считается устаревшей и строится заново.
+    """
+    origin = origin or timezone.localdate()
+    now = timezone.now()
+    vehicle_ids = list(vehicle_ids)
+    # поколения читаются до выборки из БД: изменение после неё уже поднимет поколение
+    generations = _generations(vehicle_ids)
+    keys = {_key(vehicle_id, origin, generations[vehicle_id]): vehicle_id for vehicle_id in vehicle_ids}
+    cached = cache.get_many(list(keys))
+    bitmaps = {
+        keys[key]: bits for key, (bits, expires) in cached.items() if expires is None or expires > now
+    }
+    missing = [vehicle_id for vehicle_id in vehicle_ids if vehicle_id not in bitmaps]
+    if missing:
+        loaded, expires = _load(missing, origin)
+        cache.set_many(
+            {
+                _key(vehicle_id, origin, generations[vehicle_id]): (bits, expires[vehicle_id])
+                for vehicle_id, bits in loaded.items()
+            },
+            CACHE_TIMEOUT,
+        )
+        bitmaps.update(loaded)
+    return bitmaps
+
+
+def vehicle_bitmap(vehicle_id, origin=None):
+    origin = origin or timezone.localdate()
+    return fleet_bitmaps([vehicle_id], origin)[vehicle_id]
+
+
+def _in_horizon(start, end, origin):
+    return origin <= start and (end - origin).days < HORIZON_DAYS
+
+
+def is_free(vehicle, start, end):
+    origin = timezone.localdate()
+    if not _in_horizon(start, end, origin):
+        # за пределами горизонта маски нет — спрашиваем БД
+        return not has_conflict(vehicle, start, end)
+    return not vehicle_bitmap(vehicle.pk, origin) & range_mask(start, end, origin)
+
+
+def free_vehicle_ids(vehicle_ids, start, end):
+    """Свободные на [start, end] авто из набора: одна маска диапазона, AND по всему парку."""
+    origin = timezone.localdate()
+    if not _in_horizon(start, end, origin):
+        raise ValueError("Диапазон за пределами горизонта кэша занятости")
+    mask = range_mask(start, end, origin)
+    return [vehicle_id for vehicle_id, bits in fleet_bitmaps(vehicle_ids, origin).items() if not bits & mask]
+
+
+def free_vehicles(queryset, start, end):
+    """Авто из queryset, свободные на [start, end]: в пределах горизонта — по маскам
+    (выборка id и get_many из кэша), за его пределами — anti-join в БД."""
+    if not _in_horizon(start, end, timezone.localdate()):
+        return availability.free_vehicles(queryset, start, end)
+    vehicle_ids = queryset.order_by().values_list("pk", flat=True)
+    return queryset.filter(pk__in=free_vehicle_ids(vehicle_ids, start, end))
+
+
+def calendar_ranges(vehicle):
+    """Занятые диапазоны в пределах горизонта в формате flatpickr."""
+    origin = timezone.localdate()
+    return [
+        {"from": start.isoformat(), "to": end.isoformat()}
+        for start, end in bitmap_intervals(vehicle_bitmap(vehicle.pk, origin), origin)
+    ]
+
+
+def invalidate(vehicle_id):
+    """Новое поколение масок авто; вызывать после коммита изменения."""
+    key = _generation_key(vehicle_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # счётчика нет: следующее чтение заведёт новый от текущего времени, старые маски не найдутся
+        pass
@@ -0,0 +1,119 @@
+import base64
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+PAGE_SIZE = 24
+
+# сортировки каталога (?ordering=): поля по убыванию; хвост (created_at, id) делает порядок уникальным,
+# под каждую есть индекс (vehicle_created_idx, vehicle_rating_idx)
+ORDERINGS = {
+    "new": ("created_at", "id"),
+    "rating": ("rating_avg", "rating_count", "created_at", "id"),
+}
+DEFAULT_ORDERING = ORDERINGS["new"]
+
+
+def ordering_fields(params):
+    return ORDERINGS.get(params.get("ordering"), DEFAULT_ORDERING)
+
+
+def _value(obj, field):
+    # строки .values() — словари, остальное — модели
+    return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+
+def encode_cursor(obj, fields=DEFAULT_ORDERING):
+    raw = "|".join(
+        value.isoformat() if hasattr(value, "isoformat") else str(value)
+        for value in (_value(obj, field) for field in fields)
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, model, fields=DEFAULT_ORDERING):
+    """Значения полей сортировки из курсора или None, если курсор испорчен."""
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if len(values) != len(fields):
+            return None
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except (ValueError, UnicodeDecodeError, ValidationError):
+        return None
+
+
+def keyset_page(queryset, cursor=None, size=PAGE_SIZE, fields=DEFAULT_ORDERING):
+    """Страница по fields по убыванию. Глубокие страницы стоят столько же, сколько первая:
+    вместо OFFSET — условие по индексу от последней строки предыдущей страницы.
+    """
+    queryset = queryset.order_by(*[f"-{field}" for field in fields])
+    position = decode_cursor(cursor, queryset.model, fields) if cursor else None
+    if position:
+        # (a, b, ...) < (a0, b0, ...) в порядке сортировки: a < a0 или a = a0 и b < b0 и т.д.
+        after = Q()
+        for i, field in enumerate(fields):
+            after |= Q(**dict(zip(fields[:i], position[:i])), **{f"{field}__lt": position[i]})
+        # условие на первое поле отдельно — по нему индекс ищет начало страницы
+        queryset = queryset.filter(after, **{f"{fields[0]}__lte": position[0]})
+    items = list(queryset[:size + 1])
+    next_cursor = encode_cursor(items[size - 1], fields) if len(items) > size else None
+    return items[:size], next_cursor
+
+
+def is_ranked(queryset):
+    return "search_rank" in queryset.query.order_by
+
+
+def rank_page(queryset, cursor=None, size=PAGE_SIZE):
+    """Страница выдачи поиска (rental.search: порядок по search_rank — месту авто в выдаче).
+
+    Курсор — место первого авто следующей страницы; условие search_rank >= N вместо OFFSET.
+    """
+    try:
+        position = int(base64.urlsafe_b64decode(cursor.encode()).decode()) if cursor else 0
+    except (ValueError, UnicodeDecodeError):
+        position = 0
+    items = list(queryset.filter(search_rank__gte=position)[:size + 1])
+    next_cursor = base64.urlsafe_b64encode(str(position + size).encode()).decode() if len(items) > size else None
+    return items[:size], next_cursor
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    page_size = PAGE_SIZE
+    ordering = ("-created_at", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.forward_cursor = None
+        if is_ranked(queryset):
+            # выдача поиска — по релевантности, курсор — место в выдаче
+            return self.forward_page(request, rank_page(
+                queryset, request.query_params.get(self.cursor_query_param), self.page_size
+            ))
+        return super().paginate_queryset(queryset, request, view)
+
+    def forward_page(self, request, page):
+        """Страница из keyset_page/rank_page: (объекты, курсор следующей страницы), только вперёд."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page, self.forward_cursor = page
+        self.has_next, self.has_previous = self.forward_cursor is not None, False
+        return self.page
+
+    def get_next_link(self):
+        if self.forward_cursor is None:
+            return super().get_next_link()
+        return replace_query_param(self.base_url, self.cursor_query_param, self.forward_cursor)
+
+
+class VehicleCursorPagination(CreatedAtCursorPagination):
+    """Каталог API: ?ordering=rating — keyset_page по рейтингу (только вперёд), иначе как у базового класса."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        fields = ordering_fields(request.query_params)
+        if fields == DEFAULT_ORDERING or is_ranked(queryset):
+            return super().paginate_queryset(queryset, request, view)
+        return self.forward_page(request, keyset_page(
+            queryset, request.query_params.get(self.cursor_query_param), self.page_size, fields
+        ))
@@ -0,0 +1,81 @@
+"""Локальная заглушка платёжного провайдера для тестов и нагрузочных прогонов.
+
+Реализует протокол HTTPProvider. POST /charges с JSON {amount, currency,
+card_number, reference} и заголовком Idempotency-Key. Карта ...4242 — успех,
+остальные — отказ. Повтор с тем же ключом возвращает сохранённый ответ. Соединения
+keep-alive (HTTP/1.1), запросы обрабатываются в потоках.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # заголовки и тело уходят отдельными пакетами: без TCP_NODELAY keep-alive упирается в delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.rstrip("/") != "/charges":
+            return self.reply(404, {"error": "not found"})
+        try:
+            data = json.loads(body)
+            card = str(data["card_number"])
+        except (ValueError, KeyError):
+            return self.reply(400, {"error": "bad request"})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        key = self.headers.get("Idempotency-Key")
+        with self.server.lock:
+            self.server.requests += 1
+            response = self.server.charges.get(key) if key else None
+            if response is None:
+                response = {
+                    "id": str(uuid.uuid4()),
+                    "status": "succeeded" if card.endswith("4242") else "failed",
+                    "amount": data.get("amount"),
+                    "reference": data.get("reference"),
+                }
+                self.server.charges[key] = response
+        self.reply(200, response)
+
+    def reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.charges = {}
+        self.requests = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Запуск в фоновом потоке (тесты, бенчмарк)."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,250 @@
+"""Платёжные провайдеры и переход статусов Payment/Booking.
+
+Провайдеры настраиваются в settings.PAYMENT_PROVIDERS, например:
+
+    PAYMENT_PROVIDERS = {
+        "demo": {"class": "rental.payments.DemoProvider"},
+        "stub": {"class": "rental.payments.HTTPProvider", "base_url": "http://127.0.0.1:8765",
+                 "timeout": (1, 5), "pool_size": 20, "webhook_secret": "..."},
+    }
+    PAYMENT_PROVIDER = "stub"
+
+Экземпляр провайдера создаётся один раз на процесс, и HTTP-провайдер держит
+requests.Session с пулом keep-alive соединений. Поэтому оплата не открывает новое
+TCP/TLS-соединение внутри запроса. Ключ идемпотентности берётся из
+Payment.provider_intent_id, так что повтор запроса (ретрай, двойной клик) не спишет
+деньги дважды.
+"""
+import hashlib
+import hmac
+import logging
+import threading
+import uuid
+from collections import defaultdict
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import occupancy, rollups
+from .availability import conflicting_bookings, has_conflict, lock_vehicles
+from .models import Booking, Payment
+
+DEFAULT_PROVIDERS = {"demo": {"class": "rental.payments.DemoProvider"}}
+# (connect, read), секунды
+DEFAULT_TIMEOUT = (2, 10)
+# статусы, из которых можно пробовать оплатить снова
+PAYABLE_STATUSES = ("requires_action", "failed")
+UNPAID_BOOKING_STATUSES = ("new", "pending_payment")
+# статусы брони, которые успешная оплата переводит в "paid", если даты ещё свободны
+PAYABLE_BOOKING_STATUSES = (*UNPAID_BOOKING_STATUSES, "expired")
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """Провайдер недоступен или ответил ошибкой; статус платежа не меняется."""
+
+
+def idempotency_key(payment):
+    return f"autopark-{payment.provider_intent_id}"
+
+
+def sign_webhook(secret, body):
+    """Подпись тела вебхука, как её считает провайдер (генератор событий, тесты)."""
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class PaymentProvider:
+    name = None
+
+    def __init__(self, name, **options):
+        self.name = name
+        self.options = options
+
+    def charge(self, payment, card_number):
+        """Списывает payment.amount. Возвращает "succeeded" или "failed", при сбое — ProviderError."""
+        raise NotImplementedError
+
+    def verify_webhook(self, body, headers):
+        """HMAC-SHA256 тела с webhook_secret провайдера в заголовке X-Signature.
+
+        Без секрета вебхуки провайдера не принимаются.
+        """
+        secret = self.options.get("webhook_secret")
+        if not secret:
+            return False
+        return hmac.compare_digest(sign_webhook(secret, body), headers.get("X-Signature", ""))
+
+    def parse_webhook(self, payload):
+        """(event_id, intent_id, status) из тела вебхука; формат заглушки — {"id", "intent_id", "status"}."""
+        try:
+            event = (str(payload["id"]), str(payload["intent_id"]), payload["status"])
+        except (TypeError, KeyError) as e:
+            raise ValueError("Неверный формат события") from e
+        if event[2] not in dict(Payment.STATUS):
+            raise ValueError(f"Неизвестный статус платежа: {event[2]}")
+        return event
+
+
+class DemoProvider(PaymentProvider):
+    """Без сети: успешна только тестовая карта ...4242."""
+
+    def charge(self, payment, card_number):
+        return "succeeded" if card_number.endswith("4242") else "failed"
+
+
+class HTTPProvider(PaymentProvider):
+    """Провайдер с JSON API: POST {base_url}/charges с заголовком Idempotency-Key.
+
+    Этот протокол реализует и локальная заглушка (rental.payment_stub).
+    """
+
+    def __init__(self, name, base_url, timeout=DEFAULT_TIMEOUT, pool_size=10, retries=2, api_key="", **options):
+        super().__init__(name, **options)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = tuple(timeout) if isinstance(timeout, (list, tuple)) else timeout
+        self.session = requests.Session()
+        # повтор POST безопасен: провайдер отвечает по Idempotency-Key тем же результатом
+        retry = Retry(total=retries, backoff_factor=0.1, status_forcelist=(502, 503, 504), allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def charge(self, payment, card_number):
+        try:
+            response = self.session.post(
+                f"{self.base_url}/charges",
+                json={
+                    "amount": str(payment.amount),
+                    "currency": payment.currency,
+                    "card_number": card_number,
+                    "reference": str(payment.booking_id),
+                },
+                headers={"Idempotency-Key": idempotency_key(payment)},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            status = response.json()["status"]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise ProviderError(str(e)) from e
+        if status not in ("succeeded", "failed"):
+            raise ProviderError(f"Неизвестный статус платежа: {status}")
+        return status
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name=None):
+    """Провайдер по имени из настроек; экземпляр (и его пул соединений) общий для процесса."""
+    name = name or getattr(settings, "PAYMENT_PROVIDER", "demo")
+    provider = _providers.get(name)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(name)
+            if provider is None:
+                options = dict(getattr(settings, "PAYMENT_PROVIDERS", DEFAULT_PROVIDERS)[name])
+                provider = import_string(options.pop("class"))(name, **options)
+                _providers[name] = provider
+    return provider
+
+
+def reset_providers():
+    """Закрывает сессии; нужно тестам при смене настроек."""
+    with _providers_lock:
+        for provider in _providers.values():
+            session = getattr(provider, "session", None)
+            if session is not None:
+                session.close()
+        _providers.clear()
+
+
+def payable_bookings(bookings):
+    """pk броней из queryset, которые оплата может перевести в "paid".
+
+    Просроченная бронь свои даты уже не держит, их могли отдать другому клиенту; бронь
+    "new" не держала их никогда. Поэтому даты проверяются заново под блокировкой авто
+    (как в availability.reserve), блокировка держится до конца текущей транзакции.
+    Из пересекающихся между собой броней проходит созданная раньше.
+    """
+    rows = list(
+        bookings.filter(status__in=PAYABLE_BOOKING_STATUSES)
+        .order_by("created_at")
+        .values_list("pk", "vehicle_id", "date_from", "date_to")
+    )
+    if not rows:
+        return set()
+    lock_vehicles({vehicle_id for _, vehicle_id, _, _ in rows}, bookings.db)
+    taken = set(conflicting_bookings(bookings.filter(pk__in=[pk for pk, *_ in rows])).values_list("pk", flat=True))
+    payable, claimed = set(), defaultdict(list)
+    for pk, vehicle_id, date_from, date_to in rows:
+        if pk in taken or any(date_from <= end and date_to >= start for start, end in claimed[vehicle_id]):
+            continue
+        payable.add(pk)
+        claimed[vehicle_id].append((date_from, date_to))
+    return payable
+
+
+def complete(payment, status):
+    """Атомарно переводит платёж и бронь в итоговый статус.
+
+    Оба UPDATE условные: если платёж уже обработан другим запросом (или
+    ключ идемпотентности сменился), ничего не меняется и возвращается False.
+    Успешное списание за бронь, которую уже нельзя оплатить (payable_bookings),
+    записывается как отказ: бронь не меняется, деньги возвращают через провайдера.
+    """
+    with transaction.atomic():
+        refused = status == "succeeded" and not payable_bookings(Booking.objects.filter(pk=payment.booking_id))
+        if refused:
+            status = "failed"
+        changes = {"status": status, "updated_at": timezone.now()}
+        if status == "failed":
+            # следующая попытка — новая операция у провайдера, с новым ключом
+            changes["provider_intent_id"] = str(uuid.uuid4())
+        # состояние до перехода — для дневных сводок; отказ в оплате их не меняет
+        before = rollups.load_states([payment.booking_id]).get(payment.booking_id) if status == "succeeded" else None
+        updated = Payment.objects.filter(
+            pk=payment.pk, status__in=PAYABLE_STATUSES, provider_intent_id=payment.provider_intent_id
+        ).update(**changes)
+        if updated and status == "succeeded":
+            paid = Booking.objects.filter(pk=payment.booking_id, status__in=PAYABLE_BOOKING_STATUSES).update(status="paid")
+            if paid:
+                # UPDATE минует сигналы; бронь "new" или просроченная не занимала даты в кэше занятости
+                vehicle_id = payment.booking.vehicle_id
+                transaction.on_commit(lambda: occupancy.invalidate(vehicle_id))
+            # условные UPDATE прошли, значит до них оплата ещё не была успешной, а бронь — оплаченной
+            after = before._replace(status="paid" if paid else before.status, payment_status=status)
+            rollups.apply([(before, after)])
+    if updated:
+        if refused:
+            logger.error("Списание %s не применено: бронь %s уже нельзя оплатить, нужен возврат",
+                         payment.provider_intent_id, payment.booking_id)
+        for field, value in changes.items():
+            setattr(payment, field, value)
+    return bool(updated)
+
+
+def pay(payment, card_number, provider=None):
+    """Списание через провайдера и переход статусов. Возвращает итоговый статус платежа.
+
+    За бронь, которую уже нельзя оплатить, деньги не списываются: платёж сразу "failed".
+    """
+    if payment.status not in PAYABLE_STATUSES:
+        return payment.status
+    booking = payment.booking
+    if booking.status in PAYABLE_BOOKING_STATUSES and not has_conflict(
+            booking.vehicle, booking.date_from, booking.date_to, exclude_booking=booking):
+        status = (provider or get_provider(payment.provider)).charge(payment, card_number)
+    else:
+        status = "failed"
+    if not complete(payment, status):
+        payment.refresh_from_db(fields=["status", "provider_intent_id"])
+    return payment.status
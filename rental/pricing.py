@@ -0,0 +1,118 @@
+"""Расчёт стоимости аренды: базовая цена авто × сезонный коэффициент × коэффициент дня недели,
+к сумме — скидка за длительность. Правила хранятся в PriceRule и кэшируются целиком.
+
+Дни считаются включительно: бронь [date_from, date_to] занимает date_to (так же
+считают календарь и availability), поэтому 1–3 число — это 3 дня.
+
+quote_many() считает M авто × N диапазонов за один проход: правила читаются один
+раз, для каждого типа авто строится массив дневных коэффициентов на весь охват дат
+с префиксными суммами, и цена любого диапазона — разность двух сумм.
+"""
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import PriceRule
+
+RULES_KEY = "pricing:rules"
+# сигналы сбрасывают кэш сразу; срок — страховка от правок мимо сигналов (.update(), SQL)
+# и от воркеров с кэшем в своей памяти (без CACHE_URL, см. autopark.cache)
+RULES_TIMEOUT = getattr(settings, "PRICE_RULES_CACHE_TIMEOUT", 300)
+CENTS = Decimal("0.01")
+ONE = Decimal(1)
+# ограничения пакетного запроса в API
+MAX_QUOTE_VEHICLES = 500
+MAX_QUOTE_RANGES = 20
+# охват дат одного расчёта (от самой ранней даты до самой поздней): коэффициент считается на каждый день
+MAX_QUOTE_DAYS = 366
+
+
+def load_rules():
+    """Активные правила одним запросом; кэш сбрасывают сигналы при правке PriceRule и RULES_TIMEOUT."""
+    rules = cache.get(RULES_KEY)
+    if rules is None:
+        rules = list(
+            PriceRule.objects.filter(is_active=True)
+            .order_by("pk")
+            .values_list("kind", "vehicle_type_id", "date_from", "date_to", "weekday", "min_days", "multiplier")
+        )
+        cache.set(RULES_KEY, rules, RULES_TIMEOUT)
+    return rules
+
+
+def invalidate_rules():
+    cache.delete(RULES_KEY)
+
+
+class TypeRules:
+    """Правила, действующие для одного типа авто. Правило типа важнее общего правила."""
+
+    def __init__(self, rules, vehicle_type_id):
+        self.seasons = []
+        weekdays, durations = {}, {}
+        # общие правила первыми: правила типа перезаписывают их
+        applicable = sorted(
+            (rule for rule in rules if rule[1] in (None, vehicle_type_id)),
+            key=lambda rule: rule[1] is not None,
+        )
+        for kind, type_id, date_from, date_to, weekday, min_days, multiplier in applicable:
+            if kind == "season":
+                self.seasons.append((type_id is not None, date_from, date_to, multiplier))
+            elif kind == "weekday":
+                weekdays[weekday] = multiplier
+            elif kind == "duration":
+                durations[min_days] = multiplier
+        # при пересечении сезонов берём правило типа, затем начавшееся позже
+        self.seasons.sort(key=lambda season: (season[0], season[1]), reverse=True)
+        self.weekdays = [weekdays.get(day, ONE) for day in range(7)]
+        self.durations = sorted(durations.items(), reverse=True)
+
+    def day_factor(self, day):
+        season = next((m for _, start, end, m in self.seasons if start <= day <= end), ONE)
+        return season * self.weekdays[day.weekday()]
+
+    def duration_factor(self, days):
+        return next((m for min_days, m in self.durations if days >= min_days), ONE)
+
+
+def quote_many(vehicles, ranges, rules=None):
+    """Цены для всех пар (авто, диапазон): {(vehicle.pk, date_from, date_to): Decimal}.
+
+    От авто нужны только pk, type_id и price_per_day. Диапазоны вместе должны укладываться
+    в MAX_QUOTE_DAYS дней, иначе ValueError.
+    """
+    ranges = list(ranges)
+    for start, end in ranges:
+        if end < start:
+            raise ValueError("Дата окончания раньше даты начала")
+    vehicles = list(vehicles)
+    if not vehicles or not ranges:
+        return {}
+    rules = load_rules() if rules is None else rules
+
+    origin = min(start for start, _ in ranges)
+    span = (max(end for _, end in ranges) - origin).days + 1
+    if span > MAX_QUOTE_DAYS:
+        raise ValueError(f"Охват дат больше {MAX_QUOTE_DAYS} дней")
+    days = [origin + timedelta(days=i) for i in range(span)]
+    offsets = [((start - origin).days, (end - origin).days + 1) for start, end in ranges]
+
+    by_type = {}
+    quotes = {}
+    for vehicle in vehicles:
+        if vehicle.type_id not in by_type:
+            type_rules = TypeRules(rules, vehicle.type_id)
+            prefix = [Decimal(0), *accumulate(type_rules.day_factor(day) for day in days)]
+            by_type[vehicle.type_id] = type_rules, prefix
+        type_rules, prefix = by_type[vehicle.type_id]
+        for (start, end), (i, j) in zip(ranges, offsets):
+            total = vehicle.price_per_day * (prefix[j] - prefix[i]) * type_rules.duration_factor(j - i)
+            quotes[(vehicle.pk, start, end)] = total.quantize(CENTS)
+    return quotes
+
+
+def quote(vehicle, start, end):
+    return quote_many([vehicle], [(start, end)])[(vehicle.pk, start, end)]
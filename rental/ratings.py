@@ -0,0 +1,86 @@
+"""Рейтинг авто по одобренным отзывам: Vehicle.rating_avg и rating_count.
+
+Отзыв даёт вклад (оценка, 1), пока он одобрен. При одобрении, правке и удалении к авто
+прибавляется разница вкладов одним UPDATE с F-выражениями, без агрегата по всем отзывам:
+новое среднее = (среднее * число + Δсумма) / (число + Δчисло). save/delete ловят сигналы
+(rental.signals), queryset.update (ReviewAdmin.approve_reviews) вызывает apply() сам.
+Команда recompute_ratings пересчитывает значения из отзывов целиком.
+
+Рейтинг выводится в карточках, поэтому вместе с ним поднимаются updated_at авто и версия
+каталога.
+"""
+import math
+from collections import defaultdict
+
+from django.db import router, transaction
+from django.db.models import Avg, Case, Count, ExpressionWrapper, F, FloatField, Value, When
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+
+from .caching import bump_catalog_version
+from .models import Review, Vehicle
+
+BATCH_SIZE = 1000
+
+
+def load_state(review_pk, using=None):
+    """(авто, оценка, одобрен) отзыва из БД или None."""
+    return Review.objects.using(using).filter(pk=review_pk).values_list("vehicle_id", "rating", "is_approved").first()
+
+
+def delta(changes):
+    """{авто: (Δсумма оценок, Δчисло)} по парам (старое состояние, новое); None — отзыва нет."""
+    totals = defaultdict(lambda: [0, 0])
+    for old, new in changes:
+        for sign, state in ((-1, old), (1, new)):
+            if state is not None and state[2]:
+                vehicle_id, rating, _ = state
+                totals[vehicle_id][0] += sign * rating
+                totals[vehicle_id][1] += sign
+    return {vehicle_id: tuple(total) for vehicle_id, total in totals.items() if total != [0, 0]}
+
+
+def apply(changes, using=None):
+    """Прибавляет разницу к рейтингу авто: один UPDATE на каждую разную пару (Δсумма, Δчисло)."""
+    using = using or router.db_for_write(Vehicle)
+    groups = defaultdict(list)
+    for vehicle_id, change in delta(changes).items():
+        groups[change].append(vehicle_id)
+    now = timezone.now()
+    for (rating_sum, count), vehicle_ids in groups.items():
+        new_count = F("rating_count") + count
+        Vehicle.objects.using(using).filter(pk__in=vehicle_ids).update(
+            # в SET справа — значения до UPDATE, порядок присваиваний не важен
+            rating_avg=Case(
+                When(GreaterThan(new_count, 0), then=ExpressionWrapper(
+                    (F("rating_avg") * F("rating_count") + rating_sum) / new_count, output_field=FloatField()
+                )),
+                default=Value(0.0),
+            ),
+            rating_count=new_count,
+            updated_at=now,
+        )
+    if groups:
+        transaction.on_commit(bump_catalog_version, using=using)
+    return sum(len(vehicle_ids) for vehicle_ids in groups.values())
+
+
+def recompute(using=None):
+    """Пересчёт из отзывов: один агрегат по одобренным, запись только расходящихся авто. Возвращает их число."""
+    using = using or router.db_for_write(Vehicle)
+    actual = {
+        vehicle_id: (count, avg)
+        for vehicle_id, count, avg in Review.objects.using(using).filter(is_approved=True)
+        .values_list("vehicle_id").annotate(Count("pk"), Avg("rating")).order_by()
+    }
+    now = timezone.now()
+    stale = []
+    for pk, count, avg in Vehicle.objects.using(using).values_list("pk", "rating_count", "rating_avg").iterator():
+        new_count, new_avg = actual.get(pk, (0, 0.0))
+        if count != new_count or not math.isclose(avg, new_avg):
+            stale.append(Vehicle(pk=pk, rating_count=new_count, rating_avg=new_avg, updated_at=now))
+    with transaction.atomic(using=using):
+        Vehicle.objects.using(using).bulk_update(stale, ["rating_count", "rating_avg", "updated_at"], BATCH_SIZE)
+        if stale:
+            transaction.on_commit(bump_catalog_version, using=using)
+    return len(stale)
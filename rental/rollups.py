@@ -0,0 +1,268 @@
+"""Дневные сводки загрузки и выручки: таблица DailyRollup с ключом (дата, авто, локация).
+
+booked — авто занято в этот день оплаченной или завершённой бронью, за которую не вернули
+деньги; revenue — валовая выручка: полученная оплата, в том числе потом возвращённая;
+refunds — возвращённая оплата, так что нетто = revenue − refunds. Суммы разнесены по дням
+аренды (остаток от деления — на последний день, так что сумма по дням равна сумме оплаты).
+
+Вклад брони в сводки целиком определяется её состоянием (State): даты, авто, статусы
+брони и оплаты. При изменении в БД пишется разница вкладов старого и нового состояния —
+один INSERT ... ON CONFLICT DO UPDATE SET x = x + excluded.x на все затронутые дни, в той
+же транзакции, что и само изменение. save/delete ловят сигналы (rental.signals), пакетные
+UPDATE (payments.complete, webhooks.process_batch) вызывают apply() сами; снятие
+просроченных броней (holds) сводки не меняет.
+
+Локация — текущая локация авто. После переноса авто или если счётчики разошлись
+с историей, диапазон пересчитывает команда rebuild_rollups.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import ROUND_DOWN, Decimal
+
+import django
+from django.db import connections, router, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import Booking, DailyRollup, Vehicle
+
+# статусы брони, при которых авто занято
+OCCUPYING_STATUSES = ("paid", "completed")
+# статусы оплаты, при которых деньги получены (выручка) и возвращены (ещё и возвраты)
+REVENUE_STATUSES = ("succeeded", "refunded")
+REFUND_STATUSES = ("refunded",)
+VALUE_COLUMNS = ("booked", "revenue", "refunds")
+
+STATE_FIELDS = (
+    "vehicle_id", "vehicle__location_id", "date_from", "date_to", "status", "payment__amount", "payment__status",
+)
+State = namedtuple("State", "vehicle_id location_id date_from date_to status amount payment_status")
+
+CENT = Decimal("0.01")
+CHUNK_DAYS = 31
+DEFAULT_DAYS = 30
+MAX_RANGE_DAYS = 366
+# строк на один executemany/bulk_create
+BATCH_SIZE = 1000
+
+
+def load_states(booking_ids, using=None):
+    """{pk брони: State} одним запросом (JOIN авто и оплаты)."""
+    rows = Booking.objects.using(using).filter(pk__in=booking_ids).values_list("pk", *STATE_FIELDS)
+    return {pk: State(*values) for pk, *values in rows}
+
+
+def split_amount(amount, days):
+    """Сумма по дням поровну с точностью до копейки; остаток — на последний день."""
+    amount = Decimal(amount)
+    share = (amount / days).quantize(CENT, ROUND_DOWN)
+    return [share] * (days - 1) + [amount - share * (days - 1)]
+
+
+def contributions(state):
+    """{(день, авто, локация): {колонка: значение}} — вклад брони в этом состоянии."""
+    rows = {}
+    if state is None:
+        return rows
+    days = (state.date_to - state.date_from).days + 1
+
+    def add(offset, column, value):
+        key = (state.date_from + timedelta(days=offset), state.vehicle_id, state.location_id)
+        row = rows.setdefault(key, {"booked": 0, "revenue": Decimal(0), "refunds": Decimal(0)})
+        row[column] += value
+
+    if state.status in OCCUPYING_STATUSES and state.payment_status not in REFUND_STATUSES:
+        for offset in range(days):
+            add(offset, "booked", 1)
+    if state.payment_status in REVENUE_STATUSES and state.amount:
+        for offset, share in enumerate(split_amount(state.amount, days)):
+            add(offset, "revenue", share)
+            if state.payment_status in REFUND_STATUSES:
+                add(offset, "refunds", share)
+    return rows
+
+
+def delta(changes):
+    """Сумма разниц вкладов по парам (старое состояние, новое); None — брони нет."""
+    rows = {}
+    for old, new in changes:
+        for sign, state in ((-1, old), (1, new)):
+            for key, values in contributions(state).items():
+                row = rows.setdefault(key, {"booked": 0, "revenue": Decimal(0), "refunds": Decimal(0)})
+                for column, value in values.items():
+                    row[column] += sign * value
+    return {key: row for key, row in rows.items() if any(row.values())}
+
+
+def _write(items, using):
+    """INSERT ... ON CONFLICT DO UPDATE SET x = x + excluded.x (SQLite 3.24+, PostgreSQL) пачками
+    executemany: новая строка вставляется, к существующей значения прибавляются."""
+    connection = connections[using]
+    opts = DailyRollup._meta
+    fields = [opts.get_field(name) for name in ("date", "vehicle", "location", *VALUE_COLUMNS)]
+    table = connection.ops.quote_name(opts.db_table)
+    columns = [connection.ops.quote_name(field.column) for field in fields]
+    updates = ", ".join(f"{column} = {table}.{column} + excluded.{column}" for column in columns[3:])
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({', '.join(columns[:3])}) DO UPDATE SET {updates}"
+    )
+    prepared = {}  # даты, авто и суммы повторяются во многих строках — готовим каждое значение один раз
+
+    def prepare(field, value):
+        key = (field.name, value)
+        if key not in prepared:
+            prepared[key] = field.get_db_prep_save(value, connection)
+        return prepared[key]
+
+    params = [
+        [prepare(field, value) for field, value in zip(fields, (*key, *(row[c] for c in VALUE_COLUMNS)))]
+        for key, row in items
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(params), BATCH_SIZE):
+            cursor.executemany(sql, params[start:start + BATCH_SIZE])
+
+
+def apply(changes, using=None):
+    """Прибавляет к сводкам разницу вкладов; вызывается внутри транзакции изменения."""
+    rows = delta(changes)
+    if rows:
+        # один порядок блокировок строк во всех транзакциях
+        _write(sorted(rows.items()), using or router.db_for_write(DailyRollup))
+    return len(rows)
+
+
+def rebuild(date_from, date_to, using=None):
+    """Пересчитывает сводки за [date_from, date_to] из броней и оплат. Возвращает число строк."""
+    using = using or router.db_for_write(DailyRollup)
+    states = (
+        Booking.objects.using(using)
+        .filter(date_from__lte=date_to, date_to__gte=date_from)
+        .filter(Q(status__in=OCCUPYING_STATUSES) | Q(payment__status__in=REVENUE_STATUSES))
+        .values_list(*STATE_FIELDS)
+    )
+    rows = {}
+    for state in states.iterator(chunk_size=2000):
+        for key, values in contributions(State(*state)).items():
+            if date_from <= key[0] <= date_to:
+                row = rows.setdefault(key, dict.fromkeys(VALUE_COLUMNS, 0))
+                for column, value in values.items():
+                    row[column] += value
+    with transaction.atomic(using=using):
+        DailyRollup.objects.using(using).filter(date__range=(date_from, date_to)).delete()
+        # после удаления конфликтов нет: та же вставка, что и у apply(), без модельных объектов
+        _write(rows.items(), using)
+    return len(rows)
+
+
+def date_chunks(date_from, date_to, chunk_days=CHUNK_DAYS):
+    while date_from <= date_to:
+        end = min(date_from + timedelta(days=chunk_days - 1), date_to)
+        yield date_from, end
+        date_from = end + timedelta(days=1)
+
+
+def _rebuild_chunk(chunk):
+    try:
+        return chunk, rebuild(*chunk)
+    finally:
+        connections.close_all()
+
+
+def rebuild_range(date_from, date_to, chunk_days=CHUNK_DAYS, workers=4):
+    """Пересчёт по кускам дат в workers процессах, каждый кусок — своей транзакцией.
+    Отдаёт (кусок, число строк) по порядку кусков.
+
+    Процессы, а не потоки: разноска по дням — работа на Python и упирается в GIL. На SQLite
+    запись кусков всё равно идёт по очереди (busy timeout), параллельны чтение и разноска.
+    """
+    chunks = list(date_chunks(date_from, date_to, chunk_days))
+    # внутри открытой транзакции другие процессы не увидят её данных — считаем в текущем
+    if workers <= 1 or len(chunks) == 1 or connections[router.db_for_write(DailyRollup)].in_atomic_block:
+        for chunk in chunks:
+            yield chunk, rebuild(*chunk)
+        return
+    # открытые соединения не должны достаться дочерним процессам
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        yield from pool.map(_rebuild_chunk, chunks)
+
+
+# группировка -> (поля для values, подпись строки)
+GROUPS = {
+    "location": (
+        ("location_id", "location__city", "location__address"),
+        lambda row: f"{row['location__city']}, {row['location__address']}",
+    ),
+    "vehicle": (
+        ("vehicle_id", "vehicle__plate", "vehicle__title"),
+        lambda row: f"{row['vehicle__plate']} {row['vehicle__title']}",
+    ),
+    "date": (("date",), lambda row: row["date"].isoformat()),
+}
+
+
+def parse_params(params, today=None):
+    """Аргументы summary() из GET: from/to (YYYY-MM-DD, по умолчанию последние DEFAULT_DAYS дней),
+    group и location. Неверный ввод — ValueError."""
+    today = today or timezone.localdate()
+    date_to = date.fromisoformat(params["to"]) if params.get("to") else today
+    date_from = date.fromisoformat(params["from"]) if params.get("from") else date_to - timedelta(days=DEFAULT_DAYS - 1)
+    if date_from > date_to:
+        raise ValueError("from позже to")
+    if (date_to - date_from).days >= MAX_RANGE_DAYS:
+        raise ValueError(f"диапазон больше {MAX_RANGE_DAYS} дней")
+    group = params.get("group") or "location"
+    if group not in GROUPS:
+        raise ValueError(f"group: одно из {', '.join(GROUPS)}")
+    location_id = int(params["location"]) if params.get("location") else None
+    return {"date_from": date_from, "date_to": date_to, "group": group, "location_id": location_id}
+
+
+def _money(value):
+    # SQLite отдаёт суммы без дробной части, если она нулевая
+    return Decimal(value).quantize(CENT)
+
+
+def _percent(part, whole):
+    return round(100 * part / whole, 1) if whole else None
+
+
+def summary(date_from, date_to, group="location", location_id=None):
+    """Загрузка (%) и выручка за период по локациям, авто или дням — только из сводок.
+
+    Знаменатель загрузки — авто-дни: число активных авто (из справочника парка, без истории
+    броней) на число дней.
+    """
+    fields, label = GROUPS[group]
+    rollups = DailyRollup.objects.filter(date__range=(date_from, date_to))
+    fleet = Vehicle.objects.active()
+    if location_id:
+        rollups = rollups.filter(location_id=location_id)
+        fleet = fleet.filter(location_id=location_id)
+    days = (date_to - date_from).days + 1
+    fleet_sizes = dict(fleet.values_list("location_id").annotate(count=Count("pk")).order_by())
+    fleet_size = sum(fleet_sizes.values())
+
+    rows = []
+    aggregates = rollups.values(*fields).annotate(
+        booked=Sum("booked"), revenue=Sum("revenue"), refunds=Sum("refunds")
+    ).order_by(*(fields[1:] or fields))  # по городу/номеру, дни — по дате
+    for row in aggregates:
+        if group == "location":
+            capacity = fleet_sizes.get(row["location_id"], 0) * days
+        else:
+            capacity = days if group == "vehicle" else fleet_size
+        rows.append({
+            "key": row[fields[0]], "label": label(row), "booked": row["booked"], "capacity": capacity,
+            "occupancy": _percent(row["booked"], capacity),
+            "revenue": _money(row["revenue"]), "refunds": _money(row["refunds"]),
+            "net": _money(row["revenue"] - row["refunds"]),
+        })
+    total = {"booked": sum(row["booked"] for row in rows), "capacity": fleet_size * days}
+    for column in ("revenue", "refunds", "net"):
+        total[column] = _money(sum(row[column] for row in rows))
+    total["occupancy"] = _percent(total["booked"], total["capacity"])
+    return {"from": date_from, "to": date_to, "group": group, "total": total, "rows": rows}
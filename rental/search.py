@@ -0,0 +1,195 @@
+"""Полнотекстовый поиск авто по всем языковым колонкам названия, номеру, типу, особенностям и городу.
+
+SQLite: виртуальная таблица FTS5, PostgreSQL: таблица с tsvector и GIN-индексом.
+Таблицы создаются после migrate, документы обновляются сигналами (rental.signals)
+и командой rebuild_search_index.
+"""
+import re
+import uuid
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Case, IntegerField, Q, Value, When
+from modeltranslation.utils import get_translation_fields
+
+from .models import Vehicle
+
+TABLE = "rental_vehicle_search"
+# сколько лучших совпадений отдаём в выдачу
+LIMIT = getattr(settings, "SEARCH_RESULTS_LIMIT", 200)
+BATCH = 500
+
+# веса колонок: название важнее номера, номер важнее типа и т.д.
+COLUMNS = ("title", "plate", "type", "features", "city")
+FTS_WEIGHTS = (10.0, 8.0, 3.0, 1.0, 2.0)
+PG_WEIGHTS = {"title": "A", "plate": "A", "type": "B", "city": "C", "features": "D"}
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _connection(write=False):
+    return connections[router.db_for_write(Vehicle) if write else router.db_for_read(Vehicle)]
+
+
+def _vendor(connection):
+    return connection.vendor if connection.vendor in ("sqlite", "postgresql") else None
+
+
+def create_index(using="default", **kwargs):
+    """Создаёт таблицу индекса (обработчик post_migrate)."""
+    connection = connections[using]
+    vendor = _vendor(connection)
+    with connection.cursor() as cursor:
+        if vendor == "sqlite":
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+                f"vehicle_id UNINDEXED, {', '.join(COLUMNS)}, "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+        elif vendor == "postgresql":
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {TABLE} (vehicle_id uuid PRIMARY KEY, document tsvector NOT NULL)"
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING gin (document)")
+
+
+def _join(values):
+    return " ".join(v for v in values if v)
+
+
+def documents(vehicle_ids):
+    """Текст для индекса по каждому авто, по обоим языкам."""
+    title_fields = get_translation_fields("title")
+    vehicles = (
+        Vehicle.objects.filter(pk__in=vehicle_ids)
+        .select_related("type", "location")
+        .prefetch_related("features")
+    )
+    for vehicle in vehicles:
+        yield vehicle.pk, {
+            "title": _join(getattr(vehicle, f) for f in title_fields),
+            "plate": vehicle.plate,
+            "type": _join(getattr(vehicle.type, f) for f in get_translation_fields("name")),
+            "features": _join(
+                getattr(feature, f) for feature in vehicle.features.all() for f in get_translation_fields("name")
+            ),
+            "city": _join(getattr(vehicle.location, f) for f in get_translation_fields("city")),
+        }
+
+
+def _rowid(pk):
+    # rowid FTS5 — целое число; 63 бита UUID дают быстрый DELETE/REPLACE по rowid
+    return pk.int & ((1 << 63) - 1)
+
+
+def _key(pk, connection, vendor):
+    return _rowid(pk) if vendor == "sqlite" else Vehicle._meta.pk.get_db_prep_value(pk, connection)
+
+
+def index_vehicles(vehicle_ids):
+    connection = _connection(write=True)
+    vendor = _vendor(connection)
+    if not vendor:
+        return
+    vehicle_ids = list(vehicle_ids)
+    pk_field = Vehicle._meta.pk
+    for i in range(0, len(vehicle_ids), BATCH):
+        chunk = vehicle_ids[i:i + BATCH]
+        rows = [
+            (_key(pk, connection, vendor), pk_field.get_db_prep_value(pk, connection), *(doc[c] for c in COLUMNS))
+            for pk, doc in documents(chunk)
+        ]
+        # удалённые авто пропадут из индекса, остальные будут вставлены заново
+        remove_vehicles(chunk)
+        if not rows:
+            continue
+        with connection.cursor() as cursor:
+            if vendor == "sqlite":
+                cursor.executemany(
+                    f"INSERT INTO {TABLE} (rowid, vehicle_id, {', '.join(COLUMNS)}) "
+                    f"VALUES (%s, %s{', %s' * len(COLUMNS)})",
+                    rows,
+                )
+            else:
+                vector = " || ".join(
+                    f"setweight(to_tsvector('simple', %s), '{PG_WEIGHTS[c]}')" for c in COLUMNS
+                )
+                cursor.executemany(
+                    f"INSERT INTO {TABLE} (vehicle_id, document) VALUES (%s, {vector})",
+                    [row[1:] for row in rows],
+                )
+
+
+def remove_vehicles(vehicle_ids):
+    connection = _connection(write=True)
+    vendor = _vendor(connection)
+    if not vendor:
+        return
+    keys = [_key(pk, connection, vendor) for pk in vehicle_ids]
+    if not keys:
+        return
+    column = "rowid" if vendor == "sqlite" else "vehicle_id"
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE {column} IN ({', '.join(['%s'] * len(keys))})", keys)
+
+
+def rebuild():
+    connection = _connection(write=True)
+    if not _vendor(connection):
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+    ids = list(Vehicle.objects.values_list("pk", flat=True))
+    index_vehicles(ids)
+    return len(ids)
+
+
+def ranked_ids(query, queryset=None, limit=LIMIT):
+    """id авто, подходящих под запрос, от лучшего совпадения к худшему.
+
+    queryset — фильтры выдачи (активность, тип, город, свободные даты): применяются в том же
+    запросе до LIMIT, иначе лучшие совпадения среди отфильтрованных авто вытеснили бы остальные.
+    """
+    tokens = TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return []
+    connection = connections[queryset.db] if queryset is not None else _connection()
+    vendor = _vendor(connection)
+    condition, params = "", []
+    if queryset is not None:
+        subquery, params = queryset.order_by().values("pk").query.sql_with_params()
+        condition, params = f" AND vehicle_id IN ({subquery})", list(params)
+    with connection.cursor() as cursor:
+        if vendor == "sqlite":
+            # каждое слово — префикс, слова через AND; кавычки защищают от синтаксиса FTS5
+            match = " ".join(f'"{token}"*' for token in tokens)
+            weights = ", ".join(str(w) for w in (0.0, *FTS_WEIGHTS))
+            cursor.execute(
+                f"SELECT vehicle_id FROM {TABLE} WHERE {TABLE} MATCH %s{condition} "
+                f"ORDER BY bm25({TABLE}, {weights}) LIMIT %s",
+                [match, *params, limit],
+            )
+        else:
+            cursor.execute(
+                f"SELECT vehicle_id FROM {TABLE}, to_tsquery('simple', %s) query "
+                f"WHERE document @@ query{condition} ORDER BY ts_rank(document, query) DESC LIMIT %s",
+                [" & ".join(f"{token}:*" for token in tokens), *params, limit],
+            )
+        return [value if isinstance(value, uuid.UUID) else uuid.UUID(value) for value, in cursor.fetchall()]
+
+
+def search(queryset, query):
+    """Фильтрует queryset по запросу и сортирует по релевантности; остальные фильтры — до поиска."""
+    if queryset.query.is_empty():
+        return queryset
+    if not _vendor(connections[queryset.db]):
+        # прочие БД: без индекса, LIKE по языковым колонкам
+        condition = Q(plate__icontains=query)
+        for field in get_translation_fields("title"):
+            condition |= Q(**{f"{field}__icontains": query})
+        return queryset.filter(condition)
+    ids = ranked_ids(query, queryset)
+    if not ids:
+        return queryset.none()
+    rank = Case(*[When(pk=pk, then=Value(i)) for i, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).alias(search_rank=rank).order_by("search_rank")
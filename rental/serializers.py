@@ -1,11 +1,54 @@
+from collections import defaultdict
+from decimal import Decimal
+
 from rest_framework import serializers
-from .models import Vehicle, Booking
+from .models import Vehicle, Booking, Payment
+from .availability import has_conflict, hold_expired, reserve, VehicleUnavailable
+from .payments import UNPAID_BOOKING_STATUSES
+from .pricing import quote, MAX_QUOTE_DAYS, MAX_QUOTE_VEHICLES, MAX_QUOTE_RANGES
 
 class VehicleSerializer(serializers.ModelSerializer):
-    price_per_day = serializers.DecimalField(source="price.base_per_day", max_digits=10, decimal_places=2, read_only=True)
+    price_per_day = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    features = serializers.SerializerMethodField()
+
     class Meta:
         model = Vehicle
-        fields = ["id","title","type","transmission","fuel","seats","location","features","price_per_day","is_active"]
+        fields = ["id","title","type","transmission","fuel","seats","location","features","price_per_day","is_active","rating_avg","rating_count"]
+
+    def get_features(self, vehicle):
+        # по id, как в vehicle_rows; список из prefetch_related, если он есть
+        return sorted(feature.pk for feature in vehicle.features.all())
+
+
+# Быстрый путь для списка: те же поля, что у VehicleSerializer, но из .values() без моделей и полей DRF
+VEHICLE_VALUES = ["id","title","type","transmission","fuel","seats","location","price_per_day","is_active","rating_avg","rating_count","created_at"]
+CENTS = Decimal("0.01")
+
+
+def vehicle_rows(rows):
+    """Готовит ответ в формате VehicleSerializer из строк .values(VEHICLE_VALUES); особенности — одним запросом."""
+    rows = list(rows)
+    features = defaultdict(list)
+    through = Vehicle.features.through.objects.filter(vehicle_id__in=[row["id"] for row in rows])
+    for vehicle_id, feature_id in through.order_by("feature_id").values_list("vehicle_id", "feature_id"):
+        features[vehicle_id].append(feature_id)
+    return [
+        {
+            "id": str(row["id"]),
+            "title": row["title"],
+            "type": row["type"],
+            "transmission": row["transmission"],
+            "fuel": row["fuel"],
+            "seats": row["seats"],
+            "location": row["location"],
+            "features": features.get(row["id"], []),
+            "price_per_day": str(row["price_per_day"].quantize(CENTS)),
+            "is_active": row["is_active"],
+            "rating_avg": row["rating_avg"],
+            "rating_count": row["rating_count"],
+        }
+        for row in rows
+    ]
 
 class BookingCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,16 +56,67 @@ class BookingCreateSerializer(serializers.ModelSerializer):
         fields = ["vehicle","date_from","date_to"]
 
     def validate(self, data):
-        # TODO: проверить доступность авто и пересечение интервалов
+        # PATCH присылает не все поля: недостающие — из брони
+        vehicle = data.get("vehicle", getattr(self.instance, "vehicle", None))
+        date_from = data.get("date_from", getattr(self.instance, "date_from", None))
+        date_to = data.get("date_to", getattr(self.instance, "date_to", None))
+        if self.instance is not None:
+            if vehicle.pk != self.instance.vehicle_id:
+                raise serializers.ValidationError("Авто в брони не меняется, оформите новую бронь")
+            if self.instance.status not in UNPAID_BOOKING_STATUSES or hold_expired(self.instance):
+                raise serializers.ValidationError("Бронь уже нельзя изменить")
+            if Payment.objects.filter(booking=self.instance).exists():
+                # сумма платежа зафиксирована при переходе к оплате
+                raise serializers.ValidationError("Оплата брони уже начата, изменить её нельзя")
+        if date_to < date_from:
+            raise serializers.ValidationError("Дата окончания раньше даты начала")
+        if (date_to - date_from).days >= MAX_QUOTE_DAYS:
+            raise serializers.ValidationError(f"Бронь длиннее {MAX_QUOTE_DAYS} дней")
+        if has_conflict(vehicle, date_from, date_to, exclude_booking=self.instance):
+            raise serializers.ValidationError("Автомобиль недоступен на выбранные даты")
         return data
 
     def create(self, validated):
-        vehicle = validated["vehicle"]
-        days = (validated["date_to"] - validated["date_from"]).days or 1
-        total = days * vehicle.price.base_per_day
-        return Booking.objects.create(
+        booking = Booking(
             user=self.context["request"].user,
-            total_price=total,
             status="pending_payment",
             **validated
-        )
\ No newline at end of file
+        )
+        return self._reserve(booking)
+
+    def update(self, instance, validated):
+        for field, value in validated.items():
+            setattr(instance, field, value)
+        return self._reserve(instance)
+
+    def _reserve(self, booking):
+        # цена пересчитывается по датам; проверка и запись — под блокировкой авто
+        booking.total_price = quote(booking.vehicle, booking.date_from, booking.date_to)
+        try:
+            return reserve(booking)
+        except VehicleUnavailable as e:
+            raise serializers.ValidationError(str(e))
+
+
+class QuoteRangeSerializer(serializers.Serializer):
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+
+    def validate(self, data):
+        if data["date_to"] < data["date_from"]:
+            raise serializers.ValidationError("Дата окончания раньше даты начала")
+        if (data["date_to"] - data["date_from"]).days >= MAX_QUOTE_DAYS:
+            raise serializers.ValidationError(f"Диапазон больше {MAX_QUOTE_DAYS} дней")
+        return data
+
+
+class QuoteRequestSerializer(serializers.Serializer):
+    vehicles = serializers.ListField(child=serializers.UUIDField(), min_length=1, max_length=MAX_QUOTE_VEHICLES)
+    ranges = serializers.ListField(child=QuoteRangeSerializer(), min_length=1, max_length=MAX_QUOTE_RANGES)
+
+    def validate_ranges(self, ranges):
+        # расчёт идёт по всем дням от самой ранней даты до самой поздней
+        span = max(r["date_to"] for r in ranges) - min(r["date_from"] for r in ranges)
+        if span.days >= MAX_QUOTE_DAYS:
+            raise serializers.ValidationError(f"Диапазоны вместе охватывают больше {MAX_QUOTE_DAYS} дней")
+        return ranges
@@ -0,0 +1,195 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import occupancy, pricing, ratings, rollups, search, thumbnails
+from .caching import bump_catalog_version
+from .availability import ACTIVE_BOOKING_STATUSES
+from .models import (
+    Booking, VehicleAvailability, VehicleImage, Vehicle, VehicleType, Location, Feature, PriceRule, Payment,
+    Review,
+)
+
+
+def _occupancy_changed(instance, created, using, busy=True):
+    # после коммита: до него другие запросы ещё прочитали бы из БД старые даты и закэшировали их.
+    # Новая запись, которая не занимает даты, маску не меняет
+    if busy or not created:
+        transaction.on_commit(lambda: occupancy.invalidate(instance.vehicle_id), using=using)
+
+
+@receiver(post_save, sender=Booking)
+def booking_saved(sender, instance, created, using, **kwargs):
+    _occupancy_changed(instance, created, using, busy=instance.status in ACTIVE_BOOKING_STATUSES)
+
+
+@receiver(post_save, sender=VehicleAvailability)
+def vehicle_availability_saved(sender, instance, created, using, **kwargs):
+    _occupancy_changed(instance, created, using)
+
+
+@receiver(post_delete, sender=Booking)
+@receiver(post_delete, sender=VehicleAvailability)
+def occupancy_deleted(sender, instance, using, **kwargs):
+    transaction.on_commit(lambda: occupancy.invalidate(instance.vehicle_id), using=using)
+
+
+@receiver(post_save, sender=VehicleImage)
+def vehicle_image_saved(sender, instance, using, **kwargs):
+    name = instance.image.name
+    if name and instance.derivatives.get("source") != name:
+        transaction.on_commit(lambda: thumbnails.schedule(instance.pk, name), using=using)
+
+
+def _reindex(vehicle_ids, using):
+    transaction.on_commit(lambda: search.index_vehicles(vehicle_ids), using=using)
+
+
+@receiver(post_save, sender=Vehicle)
+def vehicle_saved(sender, instance, using, **kwargs):
+    _reindex([instance.pk], using)
+
+
+@receiver(post_delete, sender=Vehicle)
+def vehicle_deleted(sender, instance, using, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: search.remove_vehicles([pk]), using=using)
+
+
+@receiver(m2m_changed, sender=Vehicle.features.through)
+def vehicle_features_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            _reindex([instance.pk], using)
+    elif action == "pre_clear":
+        # после clear связи уже не найти — запоминаем авто заранее
+        instance._search_vehicle_ids = list(instance.vehicle_set.values_list("pk", flat=True))
+    elif action == "post_clear":
+        _reindex(instance.__dict__.pop("_search_vehicle_ids", []), using)
+    elif action in ("post_add", "post_remove"):
+        _reindex(list(pk_set), using)
+
+
+@receiver(post_save, sender=VehicleType)
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Feature)
+def vehicle_relation_saved(sender, instance, created, using, **kwargs):
+    if created:
+        return
+    lookup = {VehicleType: "type", Location: "location", Feature: "features"}[sender]
+    _reindex(list(Vehicle.objects.filter(**{lookup: instance}).values_list("pk", flat=True)), using)
+
+
+def _touch(vehicles, using):
+    # обновляем updated_at без save(), чтобы не вызывать сигналы повторно
+    vehicles.using(using).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Vehicle)
+@receiver(post_delete, sender=Vehicle)
+@receiver(post_save, sender=VehicleImage)
+@receiver(post_delete, sender=VehicleImage)
+@receiver(post_save, sender=VehicleType)
+@receiver(post_delete, sender=VehicleType)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=Feature)
+@receiver(post_delete, sender=Feature)
+def catalog_changed(sender, instance, using, created=False, **kwargs):
+    if sender is VehicleImage:
+        _touch(Vehicle.objects.filter(pk=instance.vehicle_id), using)
+    elif sender in (VehicleType, Location, Feature) and not created:
+        lookup = {VehicleType: "type", Location: "location", Feature: "features"}[sender]
+        _touch(Vehicle.objects.filter(**{lookup: instance}), using)
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+@receiver(m2m_changed, sender=Vehicle.features.through)
+def catalog_features_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        _touch(Vehicle.objects.filter(pk=instance.pk), using)
+    elif pk_set:
+        _touch(Vehicle.objects.filter(pk__in=pk_set), using)
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+@receiver(post_save, sender=PriceRule)
+@receiver(post_delete, sender=PriceRule)
+def price_rule_changed(sender, instance, using, **kwargs):
+    transaction.on_commit(pricing.invalidate_rules, using=using)
+
+
+@receiver(pre_save, sender=Booking)
+def booking_rollup_state(sender, instance, raw, using, **kwargs):
+    # новая бронь в сводки ещё ничего не внесла — старое состояние читаем только при правке
+    if not raw and not instance._state.adding:
+        instance._rollup_state = rollups.load_states([instance.pk], using).get(instance.pk)
+
+
+@receiver(post_save, sender=Booking)
+def booking_rollups(sender, instance, raw, using, **kwargs):
+    old = instance.__dict__.pop("_rollup_state", None)
+    if raw or (old is None and instance.status not in rollups.OCCUPYING_STATUSES):
+        return
+    same_vehicle = old is not None and old.vehicle_id == instance.vehicle_id
+    new = rollups.State(
+        instance.vehicle_id, old.location_id if same_vehicle else instance.vehicle.location_id,
+        instance.date_from, instance.date_to, instance.status,
+        old.amount if old else None, old.payment_status if old else None,
+    )
+    rollups.apply([(old, new)], using)
+
+
+@receiver(pre_save, sender=Payment)
+def payment_rollup_state(sender, instance, raw, using, **kwargs):
+    # новая неоплаченная оплата ничего не вносит: без лишнего запроса
+    if raw or (instance._state.adding and instance.status not in rollups.REVENUE_STATUSES):
+        return
+    instance._rollup_state = rollups.load_states([instance.booking_id], using).get(instance.booking_id)
+
+
+@receiver(post_save, sender=Payment)
+def payment_rollups(sender, instance, using, **kwargs):
+    old = instance.__dict__.pop("_rollup_state", None)
+    if old is not None:
+        rollups.apply([(old, old._replace(amount=instance.amount, payment_status=instance.status))], using)
+
+
+@receiver(pre_delete, sender=Booking)
+def booking_deleted_rollups(sender, instance, using, **kwargs):
+    # оплата удаляется каскадом и вычитает свой вклад сама (payment_deleted_rollups): здесь — бронь без оплаты
+    if instance.status in rollups.OCCUPYING_STATUSES:
+        state = rollups.State(instance.vehicle_id, instance.vehicle.location_id, instance.date_from,
+                              instance.date_to, instance.status, None, None)
+        rollups.apply([(state, None)], using)
+
+
+@receiver(pre_delete, sender=Payment)
+def payment_deleted_rollups(sender, instance, using, **kwargs):
+    if instance.status in rollups.REVENUE_STATUSES:
+        old = rollups.load_states([instance.booking_id], using).get(instance.booking_id)
+        if old is not None:
+            rollups.apply([(old, old._replace(amount=None, payment_status=None))], using)
+
+
+@receiver(pre_save, sender=Review)
+def review_rating_state(sender, instance, raw, using, **kwargs):
+    if not raw and not instance._state.adding:
+        instance._rating_state = ratings.load_state(instance.pk, using)
+
+
+@receiver(post_save, sender=Review)
+def review_ratings(sender, instance, raw, using, **kwargs):
+    old = instance.__dict__.pop("_rating_state", None)
+    if not raw:
+        ratings.apply([(old, (instance.vehicle_id, instance.rating, instance.is_approved))], using)
+
+
+@receiver(pre_delete, sender=Review)
+def review_deleted_ratings(sender, instance, using, **kwargs):
+    # состояние из БД: экземпляр мог устареть после пакетного одобрения
+    ratings.apply([(ratings.load_state(instance.pk, using), None)], using)
+
@@ -1,3 +1,1377 @@
-from django.test import TestCase
+import json
+import tempfile
+import random
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from uuid import UUID
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from autopark.forms import CustomLoginForm, CustomRegisterForm
+from autopark.timing import reset_histograms
+
+from . import occupancy, rollups
+from .availability import HOLD_TTL, has_conflict, reserve, VehicleUnavailable
+from .holds import expire_holds
+from .models import (
+    Vehicle, VehicleType, Location, Booking, VehicleImage, PriceRule, Payment, PaymentEvent, Review, Feature,
+    DailyRollup, VehicleAvailability,
+)
+from .payment_stub import StubServer
+from .search import rebuild as rebuild_index, search
+from .payments import get_provider, pay, reset_providers, sign_webhook
+from .webhooks import process_batch, process_pending, replay
+from .pricing import load_rules, quote, quote_many
+
+
+def make_vehicle(type_, location, n, **kwargs):
+    return Vehicle.objects.create(
+        type=type_, location=location, title=f"Авто {n}", plate=f"KG{n:05d}",
+        transmission="AT", fuel="petrol", price_per_day=kwargs.pop("price_per_day", 1000), **kwargs
+    )
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    THREADS = 8
+    ATTEMPTS = 25
+
+    def setUp(self):
+        vehicle_type = VehicleType.objects.create(name="Седан")
+        location = Location.objects.create(city="Бишкек")
+        self.vehicles = [make_vehicle(vehicle_type, location, n) for n in range(3)]
+        self.users = [User.objects.create(username=f"user{n}") for n in range(self.THREADS)]
+
+    def test_no_double_booking(self):
+        start = date(2030, 1, 1)
+        created, rejected, errors = [], [], []
+
+        def worker(user, seed):
+            rnd = random.Random(seed)
+            try:
+                for _ in range(self.ATTEMPTS):
+                    date_from = start + timedelta(days=rnd.randrange(30))
+                    booking = Booking(
+                        user=user, vehicle=rnd.choice(self.vehicles),
+                        date_from=date_from, date_to=date_from + timedelta(days=rnd.randrange(4)),
+                        total_price=1, status="pending_payment",
+                    )
+                    try:
+                        reserve(booking)
+                        created.append(booking.pk)
+                    except VehicleUnavailable:
+                        rejected.append(booking)
+            except Exception as e:  # noqa: BLE001 — ошибки потоков проверяем ниже
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user, n)) for n, user in enumerate(self.users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(created) + len(rejected), self.THREADS * self.ATTEMPTS)
+        self.assertEqual(Booking.objects.count(), len(created))
+        for vehicle in self.vehicles:
+            intervals = sorted(Booking.objects.filter(vehicle=vehicle).values_list("date_from", "date_to"))
+            for (_, prev_to), (next_from, _) in zip(intervals, intervals[1:]):
+                self.assertLess(prev_to, next_from, f"двойная бронь {vehicle}")
+
+    def test_bench_command(self):
+        out = StringIO()
+        call_command("bench_bookings", threads=4, attempts=10, stdout=out)
+        self.assertIn("40 попыток", out.getvalue())
+        # за собой бенч ничего не оставляет
+        self.assertEqual(Booking.objects.count(), 0)
+        self.assertEqual(Vehicle.objects.count(), len(self.vehicles))
+        self.assertEqual(User.objects.count(), len(self.users))
+
+
+class CatalogQueryCountTests(TestCase):
+    """Число запросов на странице не должно зависеть от числа карточек."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vehicle_type = VehicleType.objects.create(name="Седан")
+        cls.location = Location.objects.create(city="Бишкек")
+        cls.user = User.objects.create_user(username="client", password="pass")
+
+    def setUp(self):
+        cache.clear()
+        # правила цен кэшируются целиком один раз, от числа карточек не зависят
+        load_rules()
+
+    def add_vehicles(self, count):
+        start = Vehicle.objects.count()
+        for n in range(start, start + count):
+            vehicle = make_vehicle(self.vehicle_type, self.location, n)
+            VehicleImage.objects.create(vehicle=vehicle, image=f"vehicles/{n}.jpg")
+            # у нечётных авто даты заняты оплаченной бронью, у чётных бронь их не занимает
+            Booking.objects.create(
+                user=self.user, vehicle=vehicle, date_from=date(2030, 1, 1), date_to=date(2030, 1, 3),
+                status="paid" if n % 2 else "new",
+            )
+
+    def assert_flat(self, url, cold, warm, login=False):
+        """cold — карточки рендерятся заново, warm — все карточки из кэша."""
+        if login:
+            self.client.force_login(self.user)
+        for count in (2, 10):
+            self.add_vehicles(count)
+            with self.assertNumQueries(cold):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(warm):
+                self.client.get(url)
+        return response
+
+    def test_home(self):
+        self.assert_flat(reverse("home"), 3, 1)
+
+    def test_vehicles_list(self):
+        self.assert_flat(reverse("vehicles"), 3, 1)
+
+    def test_vehicles_list_with_dates(self):
+        response = self.assert_flat(reverse("vehicles") + "?date_from=2030-01-02&date_to=2030-01-05&city=Бишкек", 3, 1)
+        for n in range(12):
+            if n % 2:
+                self.assertNotContains(response, f">Авто {n}<")  # занято на выбранные даты
+            else:
+                self.assertContains(response, f">Авто {n}<")
+
+    def test_profile(self):
+        # + сессия и пользователь
+        self.assert_flat(reverse("profile"), 5, 3, login=True)
+
+    def test_vehicle_detail(self):
+        vehicle = make_vehicle(self.vehicle_type, self.location, 999)
+        for n in range(5):
+            VehicleImage.objects.create(vehicle=vehicle, image=f"vehicles/detail-{n}.jpg")
+        # + выборка updated_at для ETag/Last-Modified
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("vehicle_detail", args=[vehicle.pk]))
+        self.assertEqual(response.status_code, 200)
+
+
+class VehicleRowsTests(TestCase):
+    def test_same_shape_as_serializer(self):
+        from django.utils import translation
+        from .serializers import VEHICLE_VALUES, VehicleSerializer, vehicle_rows
+
+        vehicle_type = VehicleType.objects.create(name_ru="Седан", name_en="Sedan")
+        location = Location.objects.create(city="Бишкек")
+        features = [Feature.objects.create(name_ru=f"Опция {n}", name_en=f"Option {n}") for n in range(3)]
+        for n in range(3):
+            vehicle = make_vehicle(vehicle_type, location, n, title_ru=f"Авто {n}", title_en=f"Car {n}",
+                                   price_per_day=Decimal("1234.5"))
+            # связи добавляются не по порядку id: порядок в ответе от них не зависит
+            vehicle.features.add(*reversed(features[n:]))
+        Vehicle.objects.filter(pk=vehicle.pk).update(rating_avg=4.5, rating_count=2)
+
+        vehicles = Vehicle.objects.order_by("created_at", "id")
+        for language in ("ru", "en"):
+            with translation.override(language):
+                rows = vehicle_rows(vehicles.values(*VEHICLE_VALUES))
+                expected = json.loads(json.dumps(VehicleSerializer(vehicles.prefetch_related("features"), many=True).data))
+                self.assertEqual(rows, expected)
+                self.assertEqual(rows[0]["title"], "Авто 0" if language == "ru" else "Car 0")
+        self.assertEqual(rows[0]["features"], sorted(feature.pk for feature in features))
+
+
+class VehicleCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.vehicle_type = VehicleType.objects.create(name="Седан")
+        self.location = Location.objects.create(city="Бишкек")
+        self.vehicles = [make_vehicle(self.vehicle_type, self.location, n) for n in range(3)]
+
+    def test_edit_invalidates_only_affected_card(self):
+        self.client.get(reverse("vehicles"))
+        self.vehicles[0].title = "Новое название"
+        self.vehicles[0].save()
+        # ключ по updated_at: заново рендерится одна карточка (выборка ключей + авто + фото)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("vehicles"))
+        self.assertContains(response, "Новое название")
+
+    def test_related_edit_and_language(self):
+        self.client.get(reverse("vehicles"))
+        self.location.address = "пр. Чуй, 1"
+        self.location.save()
+        self.vehicle_type.name_en = "Sedan"
+        self.vehicle_type.save()
+        response = self.client.get(reverse("vehicles"), HTTP_ACCEPT_LANGUAGE="en")
+        self.assertContains(response, "Sedan", count=3)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.vehicle = make_vehicle(VehicleType.objects.create(name="Седан"), Location.objects.create(city="Бишкек"), 1)
+
+    def edit(self, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vehicle.title = title
+            self.vehicle.save()
+
+    def assert_revalidates(self, url, queries):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header("Last-Modified"))
+        # 304 без рендера и основных выборок
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        other_language = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"], HTTP_ACCEPT_LANGUAGE="en")
+        self.assertEqual(other_language.status_code, 200)
+        self.assertNotEqual(other_language["ETag"], first["ETag"])
+
+        self.edit(f"Правка {url}")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_catalog(self):
+        self.assert_revalidates(reverse("vehicles"), 0)
+
+    def test_api_catalog(self):
+        self.assert_revalidates(reverse("vehicle-list", kwargs={"format": "json"}), 0)
+
+    def test_vehicle_detail(self):
+        self.assert_revalidates(reverse("vehicle_detail", args=[self.vehicle.pk]), 1)  # только updated_at
+
+    def test_dates_are_not_validated(self):
+        response = self.client.get(reverse("vehicles"), {"date_from": "2030-01-01", "date_to": "2030-01-02"})
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_bump_never_repeats_version(self):
+        from .caching import bump_catalog_version, catalog_state
+        versions = {catalog_state()[0]}
+        for _ in range(3):
+            bump_catalog_version()
+            versions.add(catalog_state()[0])
+        self.assertEqual(len(versions), 4)
+        cache.delete("catalog:version")  # вытеснение
+        bump_catalog_version()
+        self.assertNotIn(catalog_state()[0], versions)
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sedan = VehicleType.objects.create(name="Седан")
+        self.suv = VehicleType.objects.create(name="Внедорожник")
+        location = Location.objects.create(city="Бишкек")
+        self.car = make_vehicle(self.sedan, location, 1)
+        self.jeep = make_vehicle(self.suv, location, 2, price_per_day=2000)
+        PriceRule.objects.create(kind="season", date_from=date(2030, 7, 1), date_to=date(2030, 7, 31),
+                                 multiplier=Decimal("1.5"))
+        PriceRule.objects.create(kind="season", vehicle_type=self.suv, date_from=date(2030, 7, 1),
+                                 date_to=date(2030, 7, 31), multiplier=Decimal("2"))
+        PriceRule.objects.create(kind="weekday", weekday=5, multiplier=Decimal("1.2"))
+        PriceRule.objects.create(kind="duration", min_days=7, multiplier=Decimal("0.9"))
+
+    def test_rules(self):
+        # 2030-06-28 пятница .. 2030-07-02: 28 пт, 29 сб (×1.2), 30 вс, 1–2 июля сезон ×1.5
+        self.assertEqual(quote(self.car, date(2030, 6, 28), date(2030, 7, 2)), Decimal("6200.00"))
+        # у типа свой сезон ×2; неделя — скидка 10%; 6 июля — суббота
+        self.assertEqual(quote(self.jeep, date(2030, 7, 1), date(2030, 7, 7)), Decimal("25920.00"))
+        # день считается включительно
+        self.assertEqual(quote(self.car, date(2030, 1, 1), date(2030, 1, 1)), Decimal("1000.00"))
+
+    def test_rules_cache_expires(self):
+        import time
+        from .pricing import RULES_TIMEOUT
+
+        cache.clear()
+        self.assertEqual(len(load_rules()), 4)
+        # правка мимо сигналов: до истечения срока правила из кэша, после — из БД
+        PriceRule.objects.filter(kind="weekday").update(is_active=False)
+        self.assertEqual(len(load_rules()), 4)
+        later = time.time() + RULES_TIMEOUT + 1
+        with mock.patch("time.time", return_value=later):
+            self.assertEqual(len(load_rules()), 3)
+
+    def test_batch_matches_single_quotes(self):
+        ranges = [(date(2030, 6, 20) + timedelta(days=n), date(2030, 6, 20) + timedelta(days=n * 2)) for n in range(20)]
+        # правила читаются одним запросом на весь пакет
+        with self.assertNumQueries(1):
+            quotes = quote_many([self.car, self.jeep], ranges)
+        self.assertEqual(len(quotes), 40)
+        for (pk, start, end), total in quotes.items():
+            self.assertEqual(total, quote(Vehicle.objects.get(pk=pk), start, end))
+
+    def test_date_span_is_bounded(self):
+        url = reverse("vehicle-quote")
+
+        def post(*ranges):
+            return self.client.post(url, {"vehicles": [str(self.car.pk)], "ranges": [
+                {"date_from": start, "date_to": end} for start, end in ranges
+            ]}, content_type="application/json")
+
+        self.assertEqual(post(("0001-01-01", "9999-12-31")).status_code, 400)
+        # каждый диапазон короткий, но вместе они охватывают тысячи лет
+        self.assertEqual(post(("0001-01-01", "0001-01-02"), ("9999-12-30", "9999-12-31")).status_code, 400)
+        self.assertEqual(post(("2030-01-01", "2030-12-31")).status_code, 200)
+        with self.assertRaises(ValueError):
+            quote_many([self.car], [(date(2030, 1, 1), date(2031, 1, 2))])
+
+        dates = {"date_from": "0001-01-01", "date_to": "9999-12-31"}
+        self.assertEqual(self.client.get(reverse("vehicle-list", kwargs={"format": "json"}), dates).status_code, 400)
+        response = self.client.get(reverse("vehicles"), dates)
+        self.assertEqual((response.status_code, response.context["cards"]), (200, []))
+
+        self.client.force_login(User.objects.create_user(username="client"))
+        response = self.client.post(reverse("booking-list"), {"vehicle": self.car.pk, **dates})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse("create_booking", args=[self.car.pk]), dates)
+        self.assertFormError(response.context["form"], "date_to", "Бронь длиннее 366 дней")
+
+    def test_rule_change_and_booking_paths(self):
+        self.assertEqual(quote(self.car, date(2030, 6, 28), date(2030, 6, 29)), Decimal("2200.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            rule = PriceRule.objects.get(kind="weekday")
+            rule.multiplier = Decimal("2")
+            rule.save()
+        expected = quote(self.car, date(2030, 6, 28), date(2030, 6, 29))
+        self.assertEqual(expected, Decimal("3000.00"))
+
+        user = User.objects.create_user(username="client", password="pass")
+        self.client.force_login(user)
+        response = self.client.post(
+            reverse("booking-list"),
+            {"vehicle": self.car.pk, "date_from": "2030-06-28", "date_to": "2030-06-29"},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Booking.objects.get().total_price, expected)
+
+        response = self.client.post(
+            reverse("vehicle-quote"),
+            {"vehicles": [str(self.car.pk)], "ranges": [{"date_from": "2030-06-28", "date_to": "2030-06-29"}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()[0]["total_price"], "3000.00")
+
+    def test_booking_update(self):
+        user = User.objects.create_user(username="client", password="pass")
+        self.client.force_login(user)
+        booking = Booking.objects.create(user=user, vehicle=self.car, status="pending_payment", total_price=1,
+                                         date_from=date(2030, 6, 24), date_to=date(2030, 6, 25))
+        Booking.objects.create(user=user, vehicle=self.car, status="paid", total_price=1,
+                               date_from=date(2030, 6, 27), date_to=date(2030, 6, 27))
+        url = reverse("booking-detail", args=[booking.pk])
+
+        # PATCH только одной даты: вторая берётся из брони, цена пересчитывается, с собой не пересекается
+        response = self.client.patch(url, {"date_to": "2030-06-26"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        booking.refresh_from_db()
+        self.assertEqual((booking.date_to, booking.total_price), (date(2030, 6, 26), Decimal("3000.00")))
+
+        response = self.client.patch(url, {"date_to": "2030-06-28"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(url, {"date_from": "2030-06-30"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)  # позже date_to
+
+        Payment.objects.create(booking=booking, provider="demo", amount=booking.total_price,
+                               status="requires_action", provider_intent_id="intent")
+        response = self.client.patch(url, {"date_to": "2030-06-25"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        booking.refresh_from_db()
+        self.assertEqual(booking.date_to, date(2030, 6, 26))
+
+
+class PaymentProviderTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubServer().start()
+        cls.addClassCleanup(cls.server.stop)
+
+    def setUp(self):
+        settings = override_settings(
+            PAYMENT_PROVIDERS={"stub": {"class": "rental.payments.HTTPProvider", "base_url": self.server.url}},
+            PAYMENT_PROVIDER="stub",
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(reset_providers)
+        reset_providers()
+
+        self.user = User.objects.create_user(username="client", password="pass")
+        vehicle = make_vehicle(VehicleType.objects.create(name="Седан"), Location.objects.create(city="Бишкек"), 1)
+        self.booking = Booking.objects.create(
+            user=self.user, vehicle=vehicle, date_from=date(2030, 1, 1), date_to=date(2030, 1, 3)
+        )
+
+    def test_payment_page_pays_through_provider(self):
+        self.client.force_login(self.user)
+        url = reverse("payment_page", args=[self.booking.pk])
+        form = {"card_number": "4000 0000 0000 0002", "exp_month": 1, "exp_year": 2030, "cvc": "123"}
+        self.client.post(url, form)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.provider, payment.status), ("stub", "failed"))
+
+        response = self.client.post(url, {**form, "card_number": "4242 4242 4242 4242"})
+        self.assertRedirects(response, reverse("profile"), fetch_redirect_response=False)
+        payment.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual((payment.status, self.booking.status), ("succeeded", "paid"))
+
+    def test_idempotent_charge_and_single_transition(self):
+        payment = Payment.objects.create(
+            booking=self.booking, provider="stub", amount=3000, status="requires_action", provider_intent_id="intent-1"
+        )
+        provider = get_provider()
+        self.assertEqual(provider.charge(payment, "4242424242424242"), "succeeded")
+        # повтор с тем же ключом — тот же ответ, без второго списания
+        self.assertEqual(provider.charge(payment, "4000000000000002"), "succeeded")
+        self.assertEqual(len(self.server.charges), 1)
+
+        stale = Payment.objects.get(pk=payment.pk)
+        self.assertEqual(pay(payment, "4242424242424242"), "succeeded")
+        # параллельный запрос со старым состоянием не меняет уже завершённый платёж
+        stale.status = "requires_action"
+        self.assertEqual(pay(stale, "4000000000000002"), "succeeded")
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, "paid")
+
+
+@override_settings(PAYMENT_PROVIDERS={"stub": {"class": "rental.payments.DemoProvider", "webhook_secret": "secret"}})
+class PaymentWebhookTests(TestCase):
+    def setUp(self):
+        reset_providers()
+        self.addCleanup(reset_providers)
+        user = User.objects.create_user(username="client")
+        vehicle = make_vehicle(VehicleType.objects.create(name="Седан"), Location.objects.create(city="Бишкек"), 1)
+        self.payments = [
+            Payment.objects.create(
+                booking=Booking.objects.create(user=user, vehicle=vehicle, status="pending_payment",
+                                               date_from=date(2030, 1, n), date_to=date(2030, 1, n)),
+                provider="stub", amount=1000, status="requires_action", provider_intent_id=f"intent-{n}",
+            )
+            for n in range(1, 5)
+        ]
+
+    def send(self, event_id, intent_id, status, secret="secret"):
+        body = json.dumps({"id": event_id, "intent_id": intent_id, "status": status}).encode()
+        return self.client.post(reverse("payment_webhook", args=["stub"]), body,
+                                content_type="application/json", HTTP_X_SIGNATURE=sign_webhook(secret, body))
+
+    def test_verify_and_dedupe(self):
+        self.assertEqual(self.send("evt-1", "intent-1", "succeeded", secret="wrong").status_code, 403)
+        self.assertEqual(self.send("evt-1", "intent-1", "succeeded").json(), {"status": "queued"})
+        self.assertEqual(self.send("evt-1", "intent-1", "succeeded").json(), {"status": "duplicate"})
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        # в очереди, но статусы ещё не тронуты
+        self.assertEqual(Payment.objects.get(provider_intent_id="intent-1").status, "requires_action")
+
+    def test_batch_apply_and_replay(self):
+        self.send("evt-1", "intent-1", "succeeded")
+        self.send("evt-2", "intent-2", "failed")
+        self.send("evt-3", "intent-3", "succeeded")
+        self.send("evt-4", "intent-3", "refunded")
+        self.send("evt-5", "unknown", "succeeded")
+        # savepoint, выборка очереди и платежей, проверка дат оплачиваемых броней под блокировкой (3),
+        # по UPDATE на вид перехода (3 + 2), дневные сводки, отметка событий
+        with self.assertNumQueries(14):
+            self.assertEqual(process_batch(batch_size=100), 5)
+        statuses = dict(Payment.objects.values_list("provider_intent_id", "status"))
+        bookings = dict(Booking.objects.values_list("payment__provider_intent_id", "status"))
+        self.assertEqual(statuses, {"intent-1": "succeeded", "intent-2": "failed",
+                                    "intent-3": "refunded", "intent-4": "requires_action"})
+        self.assertEqual(bookings, {"intent-1": "paid", "intent-2": "pending_payment",
+                                    "intent-3": "canceled", "intent-4": "pending_payment"})
+        self.assertEqual(
+            list(DailyRollup.objects.order_by("date").values_list("date", "booked", "revenue", "refunds")),
+            [(date(2030, 1, 1), 1, Decimal(1000), 0), (date(2030, 1, 3), 0, Decimal(1000), Decimal(1000))],
+        )
+
+        self.assertEqual(replay(PaymentEvent.objects.all()), 5)
+        self.assertEqual(process_pending(), 5)
+        self.assertEqual(dict(Payment.objects.values_list("provider_intent_id", "status")), statuses)
+
+
+class HoldExpiryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="client")
+        self.vehicle = make_vehicle(VehicleType.objects.create(name="Седан"), Location.objects.create(city="Бишкек"), 1)
+        self.start = timezone.localdate() + timedelta(days=10)
+        self.end = self.start + timedelta(days=2)
+
+    def book(self, status):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Booking.objects.create(user=self.user, vehicle=self.vehicle, status=status,
+                                          date_from=self.start, date_to=self.end)
+
+    def test_expired_hold_is_free_before_sweep(self):
+        hold = self.book("pending_payment")
+        # маска с бронью уже в кэше
+        self.assertFalse(self.vehicle.is_available(self.start, self.end))
+
+        later = timezone.now() + HOLD_TTL + timedelta(seconds=1)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            self.assertTrue(self.vehicle.is_available(self.start, self.end))
+            self.assertFalse(has_conflict(self.vehicle, self.start, self.end))
+
+            paid = self.book("paid")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(expire_holds(), 1)
+            self.assertFalse(self.vehicle.is_available(self.start, self.end))
+
+        hold.refresh_from_db()
+        paid.refresh_from_db()
+        self.assertEqual((hold.status, paid.status), ("expired", "paid"))
+
+    def test_expired_hold_cannot_be_paid(self):
+        hold = self.book("pending_payment")
+        Booking.objects.filter(pk=hold.pk).update(created_at=timezone.now() - HOLD_TTL)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("payment_page", args=[hold.pk]))
+        self.assertRedirects(response, reverse("create_booking", args=[self.vehicle.pk]), fetch_redirect_response=False)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_expired_hold_paid_after_dates_retaken(self):
+        from .payments import complete
+
+        hold = self.book("pending_payment")
+        payment = Payment.objects.create(booking=hold, provider="demo", amount=3000, status="requires_action",
+                                         provider_intent_id="intent-hold")
+        Booking.objects.filter(pk=hold.pk).update(created_at=timezone.now() - HOLD_TTL)
+        other = self.book("pending_payment")
+
+        # оплата со страницы: даты отданы — деньги не списываются
+        self.assertEqual(pay(payment, "4242424242424242"), "failed")
+        # списание прошло до истечения срока, ответ пришёл после — успех не применяется
+        payment.refresh_from_db()
+        with self.assertLogs("rental.payments", "ERROR"):
+            self.assertTrue(complete(payment, "succeeded"))
+        self.assertEqual(payment.status, "failed")
+
+        def webhook(event_id):
+            PaymentEvent.objects.create(provider="demo", event_id=event_id, intent_id=payment.provider_intent_id,
+                                        status="succeeded", payload={})
+            with self.captureOnCommitCallbacks(execute=True):
+                process_batch()
+
+        with self.assertLogs("rental.webhooks", "ERROR"):
+            webhook("evt-1")
+        self.assertEqual(Payment.objects.get().status, "failed")
+        self.assertEqual(Booking.objects.filter(status="paid").count(), 0)
+
+        # другой клиент отказался — даты снова свободны, и просроченная бронь оплачивается
+        Booking.objects.filter(pk=other.pk).update(status="canceled")
+        webhook("evt-2")
+        hold.refresh_from_db()
+        self.assertEqual((Payment.objects.get().status, hold.status), ("succeeded", "paid"))
+        self.assertFalse(self.vehicle.is_available(self.start, self.end))
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class OccupancyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="client")
+        vehicle_type, location = VehicleType.objects.create(name="Седан"), Location.objects.create(city="Бишкек")
+        self.vehicles = [make_vehicle(vehicle_type, location, n) for n in range(3)]
+        self.ids = [vehicle.pk for vehicle in self.vehicles]
+        self.today = timezone.localdate()
+
+    def day(self, n):
+        return self.today + timedelta(days=n)
+
+    def book(self, vehicle, first, last, status="paid"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Booking.objects.create(user=self.user, vehicle=vehicle, status=status,
+                                          date_from=self.day(first), date_to=self.day(last))
+
+    def test_masks(self):
+        origin = date(2030, 1, 1)
+        self.assertEqual(occupancy.range_mask(date(2030, 1, 2), date(2030, 1, 4), origin), 0b1110)
+        # начало до origin и конец за горизонтом обрезаются
+        self.assertEqual(occupancy.range_mask(date(2029, 12, 30), date(2030, 1, 1), origin), 0b1)
+        self.assertEqual(occupancy.range_mask(date(2029, 12, 1), date(2029, 12, 31), origin), 0)
+        self.assertEqual(occupancy.range_mask(origin, date(2040, 1, 1), origin).bit_length(), occupancy.HORIZON_DAYS)
+        intervals = [(date(2030, 1, 1), date(2030, 1, 1)), (date(2030, 1, 5), date(2030, 2, 3))]
+        self.assertEqual(occupancy.bitmap_intervals(occupancy.build_bitmap(intervals, origin), origin), intervals)
+
+    def test_fleet_bitmaps_and_free_vehicles(self):
+        car, jeep, van = self.vehicles
+        self.book(car, 3, 5)
+        self.book(jeep, 5, 6, status="pending_payment")
+        self.book(van, 1, 10, status="new")  # даты не занимает
+        VehicleAvailability.objects.create(vehicle=van, date_from=self.day(20), date_to=self.day(21))
+
+        with self.assertNumQueries(1):  # все промахи — одной выборкой
+            bitmaps = occupancy.fleet_bitmaps(self.ids)
+        self.assertEqual(bitmaps[car.pk], occupancy.range_mask(self.day(3), self.day(5), self.today))
+        with self.assertNumQueries(0):
+            self.assertEqual(occupancy.free_vehicle_ids(self.ids, self.day(5), self.day(5)), [van.pk])
+            self.assertEqual(occupancy.free_vehicle_ids(self.ids, self.day(7), self.day(20)), [car.pk, jeep.pk])
+        self.assertEqual(sorted(occupancy.free_vehicle_ids(self.ids, self.day(22), self.day(30))), sorted(self.ids))
+        with self.assertRaises(ValueError):
+            occupancy.free_vehicle_ids(self.ids, self.day(-1), self.day(1))
+
+    def test_catalog_filter_uses_masks(self):
+        from .filters import VehicleFilter
+        car, jeep, van = self.vehicles
+        self.book(car, 3, 5)
+
+        def found(first, last):
+            params = {"date_from": self.day(first).isoformat(), "date_to": self.day(last).isoformat()}
+            with CaptureQueriesContext(connection) as queries:
+                ids = set(VehicleFilter(params, queryset=Vehicle.objects.all()).qs.values_list("pk", flat=True))
+            return ids, any("rental_booking" in query["sql"] for query in queries)
+
+        self.assertEqual(found(4, 6)[0], {jeep.pk, van.pk})
+        # маски прогреты: брони не читаются
+        self.assertEqual(found(4, 6), ({jeep.pk, van.pk}, False))
+        # новая бронь сбрасывает маску авто
+        self.book(jeep, 6, 6)
+        self.assertEqual(found(4, 6)[0], {van.pk})
+        # за горизонтом — anti-join по броням
+        horizon = occupancy.HORIZON_DAYS
+        self.assertEqual(found(horizon, horizon + 1), (set(self.ids), True))
+
+    def test_availability_reads_primary(self):
+        from .availability import free_vehicles
+        # с репликой каталог читается с неё, а занятость — с основной БД
+        with mock.patch("autopark.db.CatalogReplicaRouter._has_replica", return_value=True):
+            self.assertEqual(Vehicle.objects.all().db, "replica")
+            self.assertEqual(free_vehicles(Vehicle.objects.all(), self.day(1), self.day(2)).db, "default")
+
+    def test_cache_follows_booking_changes(self):
+        car = self.vehicles[0]
+        booking = self.book(car, 3, 5, status="new")
+        self.assertTrue(occupancy.is_free(car, self.day(3), self.day(3)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = "pending_payment"
+            booking.save()
+        self.assertFalse(occupancy.is_free(car, self.day(3), self.day(3)))
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.date_from, booking.date_to = self.day(8), self.day(9)
+            booking.save()
+        self.assertEqual(occupancy.calendar_ranges(car), [{"from": self.day(8).isoformat(), "to": self.day(9).isoformat()}])
+        # пакетные UPDATE минуют сигналы и сбрасывают кэш сами (payments, webhooks, holds)
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.filter(pk=booking.pk).update(status="canceled")
+            transaction.on_commit(lambda: occupancy.invalidate(car.pk))
+        self.assertTrue(occupancy.is_free(car, self.day(8), self.day(9)))
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.delete()
+        self.assertEqual(occupancy.calendar_ranges(car), [])
+
+    def test_stale_load_is_not_served(self):
+        car = self.vehicles[0]
+        load = occupancy._load
+
+        def load_then_book(vehicle_ids, origin):
+            # бронь коммитится между выборкой маски из БД и записью её в кэш
+            loaded = load(vehicle_ids, origin)
+            self.book(car, 3, 5)
+            return loaded
+
+        with mock.patch("rental.occupancy._load", side_effect=load_then_book):
+            self.assertEqual(occupancy.vehicle_bitmap(car.pk), 0)
+        self.assertFalse(occupancy.is_free(car, self.day(3), self.day(5)))
+
+
+@override_settings(THUMBNAIL_ASYNC=False)
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.vehicle = make_vehicle(VehicleType.objects.create(name="Седан"), Location.objects.create(city="Бишкек"), 1)
+
+    def upload(self, filename, size):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        data = BytesIO()
+        Image.new("RGB", size).save(data, "PNG" if filename.endswith(".png") else "JPEG")
+        with self.captureOnCommitCallbacks(execute=True):
+            image = VehicleImage.objects.create(vehicle=self.vehicle, image=SimpleUploadedFile(filename, data.getvalue()))
+        image.refresh_from_db()
+        return image
+
+    def test_derivatives(self):
+        from PIL import Image
+        from django.core.files.storage import default_storage
+        from .thumbnails import available_formats
+
+        jpg = self.upload("car.jpg", (1200, 800))
+        png = self.upload("car.png", (200, 100))
+        self.assertEqual(jpg.derivatives["source"], "vehicles/car.jpg")
+        for fmt in available_formats():
+            self.assertEqual(jpg.derivatives[fmt], {
+                str(width): f"vehicles/derivatives/car.jpg-{width}w.{fmt}" for width in (320, 640, 1024)
+            })
+            # меньше самой малой ширины — одна копия в исходном размере, не увеличенная
+            self.assertEqual(png.derivatives[fmt], {"200": f"vehicles/derivatives/car.png-200w.{fmt}"})
+            # одноимённые фото разных форматов не затирают копии друг друга
+            for width, name in [*jpg.derivatives[fmt].items(), *png.derivatives[fmt].items()]:
+                with default_storage.open(name) as f:
+                    self.assertEqual(Image.open(f).width, int(width))
+        self.assertIn("car.jpg-320w.webp 320w", jpg.webp_srcset)
+
+        cache.clear()
+        response = self.client.get(reverse("vehicle_detail", args=[self.vehicle.pk]))
+        # миниатюры галереи — тоже из srcset: по <source> на формат у каждого из двух фото
+        self.assertContains(response, 'sizes="100px"', count=2 * len(available_formats()))
+        self.assertContains(response, "car.png-200w.webp 200w")
+
+    def test_derivatives_refresh_cards(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from .thumbnails import _build_and_store
+
+        image = self.upload("car.jpg", (400, 300))
+        catalog, detail = reverse("vehicles"), reverse("vehicle_detail", args=[self.vehicle.pk])
+
+        def rebuild(build):
+            # копии ещё не построены: карточка и страница без srcset попадают в кэш
+            VehicleImage.objects.filter(pk=image.pk).update(derivatives={})
+            with self.captureOnCommitCallbacks(execute=True):
+                Vehicle.objects.get(pk=self.vehicle.pk).save()
+            etags = [self.client.get(url)["ETag"] for url in (catalog, detail)]
+            self.assertNotContains(self.client.get(catalog), "car.jpg-400w.webp")
+            with self.captureOnCommitCallbacks(execute=True):
+                build()
+            for url, etag in zip((catalog, detail), etags):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, "car.jpg-400w.webp 400w")
+
+        rebuild(lambda: _build_and_store(image.pk, image.image.name))
+        # пул процессов не видит MEDIA_ROOT теста — команде подставляем потоки
+        with mock.patch("rental.management.commands.build_thumbnails.ProcessPoolExecutor", ThreadPoolExecutor):
+            rebuild(lambda: call_command("build_thumbnails", workers=1, stdout=StringIO()))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        sedan = VehicleType.objects.create(name_ru="Седан", name_en="Sedan")
+        self.suv = VehicleType.objects.create(name_ru="Внедорожник", name_en="SUV")
+        bishkek = Location.objects.create(city_ru="Бишкек", city_en="Bishkek")
+        osh = Location.objects.create(city_ru="Ош", city_en="Osh")
+        self.mats = Feature.objects.create(name_ru="Коврики Camry", name_en="Camry mats")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.camry = self.vehicle("Тойота Камри", "Toyota Camry", "KG00001", sedan, bishkek)
+            self.lexus = self.vehicle("Лексус", "Lexus RX", "KG00777", self.suv, osh)
+            self.lexus.features.add(self.mats)
+
+    def vehicle(self, title_ru, title_en, plate, vehicle_type, location):
+        return Vehicle.objects.create(title=title_ru, title_ru=title_ru, title_en=title_en, plate=plate,
+                                      type=vehicle_type, location=location, transmission="AT", fuel="petrol")
+
+    def found(self, query):
+        return list(search(Vehicle.objects.all(), query))
+
+    def test_fields_and_relevance(self):
+        self.assertEqual(self.found("камри"), [self.camry])      # название, ru
+        self.assertEqual(self.found("toyota cam"), [self.camry])  # en, слова — префиксы через AND
+        self.assertEqual(self.found("KG00777"), [self.lexus])     # номер
+        self.assertEqual(self.found("suv"), [self.lexus])         # тип
+        self.assertEqual(self.found("коврики"), [self.lexus])     # особенность
+        self.assertEqual(self.found("osh"), [self.lexus])         # город
+        self.assertEqual(self.found("тойота ош"), [])
+        self.assertEqual(self.found("!!!"), [])
+        # совпадение в названии весит больше, чем в особенностях
+        self.assertEqual(self.found("camry"), [self.camry, self.lexus])
+
+    def test_filters_apply_before_limit(self):
+        from .search import LIMIT
+        # совпадений больше LIMIT, и все подходят под запрос лучше Camry: "toyota" и в названии, и в типе
+        toyota = VehicleType.objects.create(name_ru="Toyota", name_en="Toyota")
+        Vehicle.objects.bulk_create([
+            Vehicle(title="Toyota", title_ru="Toyota", title_en="Toyota", plate=f"OLD{n:05d}",
+                    type=toyota, location=self.lexus.location, transmission="AT", fuel="petrol", is_active=False)
+            for n in range(LIMIT + 10)
+        ])
+        rebuild_index()
+        found = self.found("toyota")
+        self.assertEqual(len(found), LIMIT)
+        self.assertNotIn(self.camry, found)
+        self.assertEqual(list(search(Vehicle.objects.active(), "toyota")), [self.camry])
+        response = self.client.get(reverse("vehicles"), {"q": "toyota"})
+        self.assertEqual(len(response.context["cards"]), 1)
+
+        # те же авто активны, но в другом городе
+        Vehicle.objects.filter(plate__startswith="OLD").update(is_active=True)
+        response = self.client.get(reverse("vehicles"), {"q": "toyota", "city": "Bishkek"})
+        self.assertEqual(len(response.context["cards"]), 1)
+        response = self.client.get(reverse("vehicle-list", kwargs={"format": "json"}),
+                                   {"search": "toyota", "city": "Bishkek"})
+        self.assertEqual([row["id"] for row in response.json()["results"]], [str(self.camry.pk)])
+
+    def test_index_follows_edits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.camry.title_en = "Toyota Corolla"
+            self.camry.save()
+        self.assertEqual(self.found("corolla"), [self.camry])
+        self.assertEqual(self.found("camry"), [self.lexus])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.suv.name_en = "Crossover"
+            self.suv.save()
+        self.assertEqual(self.found("crossover"), [self.lexus])
+        self.assertEqual(self.found("suv"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lexus.features.remove(self.mats)
+        self.assertEqual(self.found("коврики"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lexus.delete()
+        self.assertEqual(self.found("lexus"), [])
+        self.assertEqual(rebuild_index(), 1)
+        self.assertEqual(self.found("corolla"), [self.camry])
+
+    def test_fallback_without_index(self):
+        # прочие БД: без таблицы индекса, подстрока в названии на любом языке или в номере
+        with mock.patch("rental.search._vendor", return_value=None):
+            self.assertEqual(rebuild_index(), 0)
+            self.assertEqual(self.found("amr"), [self.camry])
+            self.assertEqual(self.found("kg00777"), [self.lexus])
+            self.assertEqual(self.found("ош"), [])
+
+
+class EmailLoginTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="client", email="Client@Example.com", password="pass")
+
+    def test_login_single_lookup(self):
+        # одна выборка пользователя, без повторного поиска по username
+        with self.assertNumQueries(1):
+            form = CustomLoginForm({"email": "client@example.com", "password": "pass"})
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_user(), self.user)
+
+        response = self.client.post(reverse("login"), {"email": "CLIENT@example.com", "password": "pass"})
+        self.assertRedirects(response, reverse("home"), fetch_redirect_response=False)
+        self.assertEqual(int(self.client.session["_auth_user_id"]), self.user.pk)
+
+    def test_wrong_password_and_unknown_email(self):
+        for email, password in (("client@example.com", "wrong"), ("nobody@example.com", "pass")):
+            with self.assertNumQueries(1):
+                self.assertFalse(CustomLoginForm({"email": email, "password": password}).is_valid())
+
+    def test_email_unique_case_insensitive(self):
+        form = CustomRegisterForm({"email": "CLIENT@example.com", "password1": "S3cure-pass!", "password2": "S3cure-pass!"})
+        self.assertFalse(form.is_valid())
+        self.assertIn("email", form.errors)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user(username="other", email="client@EXAMPLE.com")
+
+
+class GenerateFleetTests(TestCase):
+    def test_generated_data(self):
+        call_command("generate_fleet", vehicles=20, bookings=400, users=30, chunk_size=150, no_index=True,
+                     stdout=open("/dev/null", "w"))
+        self.assertEqual(Vehicle.objects.count(), 20)
+        self.assertEqual(VehicleImage.objects.count(), 40)
+        self.assertEqual(Booking.objects.count(), 400)
+        self.assertFalse(Vehicle.objects.filter(Q(title_en="") | Q(title_en__isnull=True)).exists())
+        self.assertFalse(Review.objects.filter(Q(text_en="") | Q(text_en__isnull=True)).exists())
+        self.assertEqual(Payment.objects.filter(status="succeeded").count(),
+                         Booking.objects.exclude(status="canceled").count())
+        # у одного авто брони не пересекаются
+        overlapping = Booking.objects.filter(
+            vehicle__bookings__date_from__lte=F("date_to"), vehicle__bookings__date_to__gte=F("date_from"),
+        ).exclude(vehicle__bookings__id=F("id"))
+        self.assertFalse(overlapping.exists())
+        # дневные сводки пересчитаны после вставки в обход сигналов
+        booked_days = sum((b.date_to - b.date_from).days + 1 for b in Booking.objects.filter(status__in=["paid", "completed"]))
+        self.assertEqual(DailyRollup.objects.aggregate(total=Sum("booked"))["total"], booked_days)
+
+    def test_rerun_reuses_catalog(self):
+        from .management.commands.generate_fleet import TYPES
+        for prefix in ("SYN", "ALT"):
+            call_command("generate_fleet", vehicles=2, bookings=4, users=2, locations=3, prefix=prefix,
+                         no_index=True, stdout=StringIO())
+        self.assertEqual(Vehicle.objects.count(), 4)
+        self.assertEqual(VehicleType.objects.count(), len(TYPES))
+        self.assertEqual(Location.objects.count(), 3)
+
+
+class EndpointBenchTests(TestCase):
+    def test_baseline_and_regression(self):
+        call_command("generate_fleet", vehicles=5, bookings=20, users=3, no_index=True, stdout=open("/dev/null", "w"))
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = Path(tmp) / "bench.json"
+            bench = dict(baseline=baseline, repeat=2, warmup=1, stdout=open("/dev/null", "w"))
+            # все сценарии отвечают ожидаемым кодом, база записывается; хуки после коммита выполняются
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                call_command("bench_endpoints", **bench)
+            self.assertTrue(callbacks)
+            report = json.loads(baseline.read_text())
+            self.assertEqual(len(report["endpoints"]), 10)
+            self.assertFalse(Booking.objects.filter(status="pending_payment").exists())  # брони замеров удалены
+
+            report["endpoints"]["profile"]["queries"] -= 1
+            baseline.write_text(json.dumps(report))
+            with self.assertRaisesMessage(CommandError, "profile.queries"):
+                call_command("bench_endpoints", only=["profile"], **bench)
+
+
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        reset_histograms()
+        self.addCleanup(reset_histograms)
+
+    def test_server_timing_and_histograms(self):
+        response = self.client.get(reverse("home"))
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ SQL", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+
+        url = reverse("request_timings")
+        self.assertEqual(self.client.get(url).status_code, 302)  # только staff
+        staff = User.objects.create_user(username="staff", password="pass", is_staff=True)
+        self.client.force_login(staff)
+        views = self.client.get(url).json()["views"]
+        self.assertEqual(views["home"]["count"], 1)
+        self.assertEqual(sum(views["home"]["histogram_ms"].values()), 1)
+
+    def test_slow_request_logged_with_call_site(self):
+        with mock.patch("autopark.timing.SLOW_MS", 0), self.assertLogs("autopark.timing", "WARNING") as logs:
+            self.client.get(reverse("home"))
+        self.assertRegex(logs.output[0], r"rental/\w+\.py:\d+ in \w+: SELECT")
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.vehicle_type = VehicleType.objects.create(name="Седан")
+        self.location = Location.objects.create(city="Бишкек")
+        self.client.force_login(User.objects.create_superuser(username="admin", password="pass"))
+
+    def add_bookings(self, count):
+        start = Vehicle.objects.count()
+        for n in range(start, start + count):
+            user = User.objects.create_user(username=f"client{n}", email=f"client{n}@example.com")
+            vehicle = make_vehicle(self.vehicle_type, self.location, n)
+            booking = Booking.objects.create(user=user, vehicle=vehicle, date_from=date(2030, 1, 1),
+                                             date_to=date(2030, 1, 3))
+            Payment.objects.create(booking=booking, provider="demo", amount=3000, status="succeeded")
+
+    def test_query_count_does_not_grow_with_rows(self):
+        urls = [reverse("admin:rental_booking_changelist"), reverse("admin:rental_payment_changelist"),
+                reverse("admin:rental_booking_changelist") + "?status__exact=new"]
+        counts = []
+        for size in (2, 10):
+            self.add_bookings(size)
+            with CaptureQueriesContext(connection) as queries:
+                for url in urls:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_input_filters(self):
+        self.add_bookings(3)
+        url = reverse("admin:rental_booking_changelist")
+        response = self.client.get(url, {"plate": "KG00001"})
+        self.assertEqual(response.context["cl"].result_count, 1)
+        response = self.client.get(url, {"email": "CLIENT2@example.com"})
+        self.assertEqual([b.user.username for b in response.context["cl"].result_list], ["client2"])
+
+    def test_estimated_count_above_limit(self):
+        self.add_bookings(3)
+        with mock.patch("rental.admin.EXACT_COUNT_LIMIT", 2), \
+                mock.patch("rental.admin.estimated_count", return_value=1000000) as estimate:
+            response = self.client.get(reverse("admin:rental_booking_changelist"))
+            self.assertEqual(response.context["cl"].result_count, 1000000)
+            # с фильтром — COUNT не дальше предела
+            response = self.client.get(reverse("admin:rental_booking_changelist"), {"status__exact": "new"})
+            self.assertEqual(response.context["cl"].result_count, 2)
+        self.assertEqual(estimate.call_count, 1)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        vehicle_type = VehicleType.objects.create(name="Седан")
+        location = Location.objects.create(city="Бишкек")
+        self.staff = User.objects.create_user(username="accountant", email="acc@example.com", is_staff=True,
+                                              is_superuser=True)
+        client = User.objects.create_user(username="client", email="=client@example.com")
+        for n, status in enumerate(("paid", "canceled", "paid")):
+            booking = Booking.objects.create(user=client, vehicle=make_vehicle(vehicle_type, location, n),
+                                             date_from=date(2030, 1, 1), date_to=date(2030, 1, 3), status=status)
+            if status == "paid":
+                Payment.objects.create(booking=booking, provider="demo", amount=3000, status="succeeded")
+
+    def read(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_staff_only(self):
+        url = reverse("export", args=["bookings", "csv"])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url, {"created_from": "вчера"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("export", args=["users", "csv"])).status_code, 404)
+
+    def test_csv_with_filters(self):
+        self.client.force_login(self.staff)
+        today = timezone.localdate().isoformat()
+        response = self.client.get(reverse("export", args=["bookings", "csv"]),
+                                   {"status": "paid", "created_from": today, "created_to": today})
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        lines = self.read(response).lstrip("\ufeff").splitlines()
+        self.assertEqual(len(lines), 3)
+        header = lines[0].split(",")
+        row = dict(zip(header, lines[1].split(",")))
+        self.assertEqual((row["status"], row["payment_status"], row["payment_amount"]), ("paid", "succeeded", "3000.00"))
+        self.assertEqual(row["user_email"], "'=client@example.com")  # без формулы в Excel
+
+        response = self.client.get(reverse("export", args=["bookings", "csv"]), {"created_to": "2000-01-01"})
+        self.assertEqual(len(self.read(response).splitlines()), 1)
+
+    def test_ndjson_and_admin_action(self):
+        self.client.force_login(self.staff)
+        with self.assertNumQueries(3):  # сессия, пользователь и один запрос с JOIN на все строки
+            rows = [json.loads(line) for line in
+                    self.read(self.client.get(reverse("export", args=["payments", "ndjson"]))).splitlines()]
+        self.assertEqual([r["booking_status"] for r in rows], ["paid", "paid"])
+
+        response = self.client.post(reverse("admin:rental_booking_changelist"), {
+            "action": "export_csv", "_selected_action": list(Booking.objects.values_list("pk", flat=True)),
+        })
+        self.assertEqual(len(self.read(response).splitlines()), 4)
+
+
+class FleetImportTests(TestCase):
+    CSV = (
+        "plate,title_ru,title_en,type,city,transmission,fuel,seats,price_per_day,features,images\n"
+        "IMP1,Тойота Камри,Toyota Camry,Седан,Бишкек,AT,petrol,5,2500,Кондиционер|Люк,car.png\n"
+        "IMP2,Хонда Фит,,Хэтчбек,Бишкек,MT,rocket,4,1500,,\n"
+        "IMP3,Киа Рио,Kia Rio,Седан,Ош,AT,petrol,5,abc,,\n"
+        "IMP1,Тойота Камри,Toyota Camry,Седан,Бишкек,AT,petrol,5,2500,,\n"
+        "KG00000,Дубль,Duplicate,Седан,Бишкек,AT,petrol,5,2500,,\n"
+        "IMP4,Хонда Фит,,Хэтчбек,Бишкек,MT,petrol,4,1500,Кондиционер,missing.png\n"
+        "IMP5,Хонда Фит,,хэтчбек,бишкек,MT,petrol,4,1500,Новая опция,\n"
+    )
+
+    def setUp(self):
+        vehicle_type = VehicleType.objects.create(name="Седан")
+        location = Location.objects.create(city="Бишкек")
+        make_vehicle(vehicle_type, location, 0)
+        Feature.objects.create(name="Кондиционер")
+
+    def image_zip(self):
+        from io import BytesIO
+        import zipfile
+        from PIL import Image
+        png, archive = BytesIO(), BytesIO()
+        Image.new("RGB", (8, 8)).save(png, "PNG")
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("car.png", png.getvalue())
+        archive.seek(0)
+        archive.name = "photos.zip"
+        return archive
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_admin_upload_reports_rows_and_imports_the_rest(self):
+        from io import BytesIO
+        self.client.force_login(User.objects.create_superuser(username="ops", password="pass"))
+        data = BytesIO(self.CSV.encode())
+        data.name = "fleet.csv"
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("admin:rental_vehicle_import"),
+                                        {"data": data, "images": self.image_zip()})
+        result = response.context["result"]
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, _ in result.errors], [3, 4, 5, 6, 7])
+
+        camry = Vehicle.objects.get(plate="IMP1")
+        self.assertEqual((camry.title_ru, camry.title_en), ("Тойота Камри", "Toyota Camry"))
+        self.assertEqual(sorted(camry.features.values_list("name", flat=True)), ["Кондиционер", "Люк"])
+        self.assertEqual(camry.images.count(), 1)
+        self.assertEqual(Vehicle.objects.get(plate="IMP5").title_en, "Хонда Фит")  # en из ru
+        # тип и город сопоставлены без учёта регистра, новые созданы по одному разу
+        self.assertEqual(VehicleType.objects.count(), 2)
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_jsonl_lists(self):
+        from .fleet_import import FleetImporter, read_rows
+        rows = StringIO(
+            '{"plate": "J1", "title": "Авто", "type": "Седан", "city": "Бишкек", "transmission": "AT", '
+            '"fuel": "ev", "features": ["Кондиционер"], "is_active": false}\n'
+            "не json\n"
+        )
+        result = FleetImporter().run(read_rows(rows, "jsonl"))
+        self.assertEqual((result.created, [line for line, _ in result.errors]), (1, [2]))
+        self.assertFalse(Vehicle.objects.get(plate="J1").is_active)
+
+    def test_duplicate_plate_rolls_back_only_its_chunk(self):
+        from .fleet_import import FleetImporter, read_rows
+        rows = StringIO(
+            "plate,title,type,city,transmission,fuel,features\n"
+            "P1,Пикап,Пикап,Каракол,AT,rocket,\n"
+            "KG00000,Дубль,Кабриолет,Ош,AT,petrol,Люк\n"
+            "NEW1,Новое,Седан,Бишкек,AT,petrol,Кондиционер\n"
+        )
+        # номер занят уже после проверки пачки (параллельный импорт): вставка падает на уникальности
+        with mock.patch.object(FleetImporter, "existing_plates", return_value=set()):
+            result = FleetImporter(chunk_size=1).run(read_rows(rows, "csv"))
+        self.assertEqual(result.created, 1)
+        self.assertEqual([line for line, _ in result.errors], [2, 3])
+        self.assertIn("пачка не записана", result.errors[1][1])
+        self.assertTrue(Vehicle.objects.filter(plate="NEW1").exists())
+        # связанные записи отклонённых строк не создаются или откатываются вместе с пачкой
+        self.assertEqual(list(VehicleType.objects.values_list("name_ru", flat=True)), ["Седан"])
+        self.assertEqual(list(Location.objects.values_list("city_ru", flat=True)), ["Бишкек"])
+        self.assertEqual(list(Feature.objects.values_list("name_ru", flat=True)), ["Кондиционер"])
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username="manager", is_staff=True, is_superuser=True)
+        vehicle = make_vehicle(VehicleType.objects.create(name="Седан"), Location.objects.create(city="Бишкек"), 1)
+        self.booking = Booking.objects.create(
+            user=User.objects.create_user(username="client"), vehicle=vehicle, status="pending_payment",
+            date_from=date(2030, 1, 1), date_to=date(2030, 1, 3), total_price=1000,
+        )
+        self.payment = Payment.objects.create(booking=self.booking, provider="demo", amount=1000,
+                                              status="requires_action", provider_intent_id="intent")
+
+    def rows(self):
+        return list(DailyRollup.objects.exclude(booked=0, revenue=0, refunds=0).order_by("date")
+                    .values_list("date", "booked", "revenue", "refunds"))
+
+    def test_incremental_matches_rebuild(self):
+        pay(self.payment, "4242424242424242")
+        self.assertEqual(self.rows(), [
+            (date(2030, 1, 1), 1, Decimal("333.33"), 0),
+            (date(2030, 1, 2), 1, Decimal("333.33"), 0),
+            (date(2030, 1, 3), 1, Decimal("333.34"), 0),  # остаток — на последний день
+        ])
+
+        self.booking.refresh_from_db()
+        self.booking.date_from, self.booking.date_to = date(2030, 1, 5), date(2030, 1, 6)
+        self.booking.save()
+        self.payment.status = "refunded"
+        self.payment.save()
+        self.booking.status = "canceled"
+        self.booking.save()
+        incremental = self.rows()
+        # выручка валовая: возврат уходит в refunds, а не вычитается из revenue
+        self.assertEqual(incremental, [(date(2030, 1, 5), 0, Decimal(500), Decimal(500)),
+                                       (date(2030, 1, 6), 0, Decimal(500), Decimal(500))])
+
+        call_command("rebuild_rollups", "--from", "2030-01-01", "--to", "2030-01-31", "--chunk-days", "7",
+                     stdout=open("/dev/null", "w"))
+        self.assertEqual(self.rows(), incremental)
+
+        self.booking.delete()
+        self.assertEqual(self.rows(), [])
+
+    def test_stats_api_and_dashboard(self):
+        pay(self.payment, "4242424242424242")
+        url = reverse("rollup_stats")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url, {"group": "user"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"from": "2030-01-10", "to": "2030-01-01"}).status_code, 400)
+
+        with self.assertNumQueries(4):  # сессия, пользователь, размер парка и одна агрегация сводок
+            stats = self.client.get(url, {"from": "2030-01-01", "to": "2030-01-10"}).json()
+        self.assertEqual(stats["total"], {"booked": 3, "capacity": 10, "occupancy": 30.0, "revenue": "1000.00",
+                                          "refunds": "0.00", "net": "1000.00"})
+        self.assertEqual([row["label"] for row in stats["rows"]], ["Бишкек, "])
+        by_day = self.client.get(url, {"from": "2030-01-01", "to": "2030-01-10", "group": "date"}).json()
+        self.assertEqual([(row["key"], row["occupancy"]) for row in by_day["rows"]],
+                         [("2030-01-01", 100.0), ("2030-01-02", 100.0), ("2030-01-03", 100.0)])
+
+        response = self.client.get(reverse("admin:rental_dailyrollup_dashboard"),
+                                   {"from": "2030-01-01", "to": "2030-01-10", "group": "vehicle"})
+        self.assertContains(response, "KG00001")
+
+    def test_refund_counts_once(self):
+        pay(self.payment, "4242424242424242")
+        # возврат без отмены брони (правка оплаты в админке): авто в эти дни больше не считается занятым
+        self.payment.refresh_from_db()
+        self.payment.status = "refunded"
+        self.payment.save()
+        self.assertEqual([row[1:] for row in self.rows()], [(0, Decimal("333.33"), Decimal("333.33")),
+                                                            (0, Decimal("333.33"), Decimal("333.33")),
+                                                            (0, Decimal("333.34"), Decimal("333.34"))])
+        total = rollups.summary(date(2030, 1, 1), date(2030, 1, 10))["total"]
+        self.assertEqual((total["booked"], total["revenue"], total["refunds"], total["net"]),
+                         (0, Decimal(1000), Decimal(1000), Decimal(0)))
+
+        call_command("rebuild_rollups", "--from", "2030-01-01", "--to", "2030-01-31", stdout=open("/dev/null", "w"))
+        self.assertEqual(rollups.summary(date(2030, 1, 1), date(2030, 1, 10))["total"], total)
+
+    def test_webhook_rollups_follow_applied_rows(self):
+        from . import webhooks
+        PaymentEvent.objects.create(provider="demo", event_id="evt-1", intent_id="intent", status="succeeded",
+                                    payload={})
+        apply = webhooks._apply
+
+        def concurrent_cancel(queryset, rows, **extra):
+            # бронь отменили между чтением пачки и UPDATE — её условный UPDATE не проходит
+            if queryset.model is Booking:
+                Booking.objects.filter(pk=self.booking.pk).update(status="canceled")
+            return apply(queryset, rows, **extra)
+
+        with mock.patch.object(webhooks, "_apply", concurrent_cancel):
+            process_batch()
+        self.assertEqual(Payment.objects.get().status, "succeeded")
+        # выручка записана, занятость — нет: бронь оплатой не изменена
+        self.assertEqual([row[1:3] for row in self.rows()],
+                         [(0, Decimal("333.33")), (0, Decimal("333.33")), (0, Decimal("333.34"))])
+
+
+
+class RatingTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username="manager", is_staff=True, is_superuser=True)
+        self.vehicle_type = VehicleType.objects.create(name="Седан")
+        self.location = Location.objects.create(city="Бишкек")
+        self.vehicle = make_vehicle(self.vehicle_type, self.location, 1)
+
+    def review(self, n, rating, vehicle=None, **kwargs):
+        vehicle = vehicle or self.vehicle
+        user = User.objects.create_user(username=f"client{n}")
+        booking = Booking.objects.create(user=user, vehicle=vehicle, status="completed",
+                                         date_from=date(2030, 1, 1), date_to=date(2030, 1, 3))
+        return Review.objects.create(booking=booking, user=user, vehicle=vehicle, rating=rating, **kwargs)
+
+    def rating(self):
+        self.vehicle.refresh_from_db(fields=["rating_avg", "rating_count"])
+        return round(self.vehicle.rating_avg, 4), self.vehicle.rating_count
+
+    def test_incremental_matches_recompute(self):
+        reviews = [self.review(n, rating) for n, rating in enumerate((5, 4, 2))]
+        self.assertEqual(self.rating(), (0, 0))  # не одобренные не считаются
+        stale = Vehicle.objects.get(pk=self.vehicle.pk)
+
+        self.client.force_login(self.staff)
+        self.client.post(reverse("admin:rental_review_changelist"), {
+            "action": "approve_reviews", "_selected_action": [review.pk for review in reviews],
+        })
+        self.assertEqual(self.rating(), (3.6667, 3))
+        # сохранение авто, загруженного до одобрения, не затирает рейтинг
+        stale.price_per_day = 1500
+        stale.save()
+        self.assertEqual(self.rating(), (3.6667, 3))
+
+        reviews[2].refresh_from_db()
+        reviews[2].rating = 5
+        reviews[2].save()
+        self.assertEqual(self.rating(), (4.6667, 3))
+        reviews[1].is_approved = False
+        reviews[1].save()
+        self.assertEqual(self.rating(), (5, 2))
+        reviews[0].delete()
+        self.assertEqual(self.rating(), (5, 1))
+        reviews[2].delete()
+        self.assertEqual(self.rating(), (0, 0))
+
+        self.review(10, 3, is_approved=True)
+        self.review(11, 4, is_approved=True)
+        self.assertEqual(self.rating(), (3.5, 2))
+        out = tempfile.TemporaryFile("w+")
+        call_command("recompute_ratings", stdout=out)
+        out.seek(0)
+        self.assertIn("Исправлен рейтинг авто: 0", out.read())  # инкрементальные значения совпали с пересчётом
+        Vehicle.objects.update(rating_avg=0, rating_count=0)
+        call_command("recompute_ratings", stdout=out)
+        self.assertEqual(self.rating(), (3.5, 2))
+
+    def test_ordering_by_rating(self):
+        # 30 авто, у многих одинаковый рейтинг: порядок на стыках страниц должен держаться на created_at и id
+        for n in range(2, 31):
+            make_vehicle(self.vehicle_type, self.location, n)
+        for n, vehicle in enumerate(Vehicle.objects.all()):
+            Vehicle.objects.filter(pk=vehicle.pk).update(rating_avg=n % 3 + 3, rating_count=n % 2)
+        expected = [str(pk) for pk in Vehicle.objects.order_by(
+            "-rating_avg", "-rating_count", "-created_at", "-id").values_list("pk", flat=True)]
+
+        api = reverse("vehicle-list", kwargs={"format": "json"})  # /vehicles/ без суффикса — HTML-каталог
+        seen, url = [], api + "?ordering=rating"
+        while url:
+            page = self.client.get(url).json()
+            seen += [row["id"] for row in page["results"]]
+            url = page["next"]
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(self.client.get(api).json()["results"]), 24)
+
+        first = self.client.get(reverse("vehicles"), {"ordering": "rating"})
+        second = self.client.get(reverse("vehicles"), {"ordering": "rating", "cursor": first.context["next_cursor"]})
+        self.assertIsNone(second.context["next_cursor"])
+        titles = dict(Vehicle.objects.values_list("pk", "title"))
+        content = first.content.decode()
+        positions = [content.find(f">{titles[UUID(pk)]}<") for pk in expected[:24]]
+        self.assertNotIn(-1, positions)
+        self.assertEqual(positions, sorted(positions))
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="client", password="pass")
+        vehicle_type, location = VehicleType.objects.create(name="Седан"), Location.objects.create(city="Бишкек")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vehicles = [make_vehicle(vehicle_type, location, n, title_en=f"Toyota {n}") for n in range(40)]
+
+    def walk_api(self, url, key="id"):
+        seen = []
+        while url:
+            page = self.client.get(url).json()
+            seen += [row[key] for row in page["results"]]
+            url = page["next"]
+        return seen
+
+    def walk_html(self, url, params=None):
+        """Размеры страниц HTML-выдачи по ссылкам "Дальше"."""
+        sizes, cursor = [], None
+        while True:
+            response = self.client.get(url, {**(params or {}), **({"cursor": cursor} if cursor else {})})
+            sizes.append(len(response.context["cards"]))
+            cursor = response.context["next_cursor"]
+            if not cursor:
+                return sizes
+
+    def test_search_pages(self):
+        ranked = [str(v.pk) for v in search(Vehicle.objects.active(), "toyota")]
+        self.assertEqual(len(ranked), 40)
+        # API: страницы по месту в выдаче, без пропусков и повторов
+        self.assertEqual(self.walk_api(reverse("vehicle-list", kwargs={"format": "json"}) + "?search=toyota"), ranked)
+        self.assertEqual(self.walk_html(reverse("vehicles"), {"q": "toyota"}), [24, 16])
+        # испорченный курсор — первая страница
+        response = self.client.get(reverse("vehicles"), {"q": "toyota", "cursor": "???"})
+        self.assertEqual(len(response.context["cards"]), 24)
+
+    def test_default_keyset_pages(self):
+        expected = [str(pk) for pk in Vehicle.objects.order_by("-created_at", "-id").values_list("pk", flat=True)]
+        self.assertEqual(self.walk_api(reverse("vehicle-list", kwargs={"format": "json"})), expected)
+        first = self.client.get(reverse("vehicles"))
+        second = self.client.get(reverse("vehicles"), {"cursor": first.context["next_cursor"]})
+        self.assertIsNone(second.context["next_cursor"])
+        self.assertEqual(len(first.context["cards"]) + len(second.context["cards"]), 40)
+        self.assertContains(first, ">Авто 39<")  # новые первыми
+        self.assertContains(second, ">Авто 0<")
+
+    def test_booking_pages(self):
+        for vehicle in self.vehicles[:30]:
+            Booking.objects.create(user=self.user, vehicle=vehicle, date_from=date(2030, 1, 1),
+                                   date_to=date(2030, 1, 2), status="paid")
+        Booking.objects.create(user=User.objects.create_user(username="other"), vehicle=self.vehicles[0],
+                               date_from=date(2030, 2, 1), date_to=date(2030, 2, 2))
+        # у каждой брони своё авто: по нему и сверяем порядок
+        expected = [str(pk) for pk in Booking.objects.filter(user=self.user)
+                    .order_by("-created_at", "-id").values_list("vehicle_id", flat=True)]
+        self.client.force_login(self.user)
+        self.assertEqual(self.walk_api(reverse("booking-list"), key="vehicle"), expected)
+        self.assertEqual(self.walk_html(reverse("profile")), [24, 6])
@@ -0,0 +1,128 @@
+"""Уменьшенные копии фото авто (WebP, AVIF если Pillow собран с ним) для srcset.
+
+Модуль не импортирует модели: generate() выполняется в дочерних процессах пула,
+которым нужны только настройки и storage.
+"""
+import atexit
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+WIDTHS = getattr(settings, "THUMBNAIL_WIDTHS", (320, 640, 1024))
+WORKERS = getattr(settings, "THUMBNAIL_WORKERS", 2)
+QUALITY = {"webp": 80, "avif": 60}
+
+logger = logging.getLogger(__name__)
+
+
+def available_formats():
+    formats = ["webp"]
+    if "avif" in features.modules and features.check_module("avif"):
+        formats.append("avif")
+    return formats
+
+
+def derivative_name(name, width, fmt):
+    # vehicles/car.jpg -> vehicles/derivatives/car.jpg-320w.webp: имя файла целиком, с расширением,
+    # иначе car.jpg и car.png писали бы в одни и те же копии
+    folder, filename = os.path.split(name)
+    return os.path.join(folder, "derivatives", f"{filename}-{width}w.{fmt}")
+
+
+def generate(name):
+    """Строит все производные для файла из storage. Возвращает словарь для VehicleImage.derivatives."""
+    with default_storage.open(name, "rb") as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original.load()
+    if original.mode not in ("RGB", "RGBA"):
+        original = original.convert("RGBA" if "transparency" in original.info else "RGB")
+
+    # не увеличиваем: ширины больше оригинала заменяем самим оригинальным размером
+    widths = sorted({min(width, original.width) for width in WIDTHS})
+    result = {"source": name}
+    for fmt in available_formats():
+        result[fmt] = {}
+        for width in widths:
+            height = round(original.height * width / original.width)
+            image = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+            buffer = BytesIO()
+            image.save(buffer, fmt.upper(), quality=QUALITY[fmt])
+            target = derivative_name(name, width, fmt)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            result[fmt][str(width)] = default_storage.save(target, ContentFile(buffer.getvalue()))
+    return result
+
+
+def srcset(derivatives, fmt):
+    return ", ".join(
+        f"{default_storage.url(name)} {width}w" for width, name in derivatives.get(fmt, {}).items()
+    )
+
+
+def schedule(image_pk, name):
+    """Строит копии в пуле процессов, не блокируя запрос (сохранение админки)."""
+    if getattr(settings, "THUMBNAIL_ASYNC", True):
+        _dispatcher().submit(_build_and_store, image_pk, name, process_pool())
+    else:
+        _build_and_store(image_pk, name)
+
+
+def touch_vehicles(images):
+    """Поднимает updated_at авто для фото из queryset images и версию каталога.
+
+    Копии пишутся через .update()/bulk_update() без сигналов, а от updated_at зависят
+    ключи карточек (rental.cards) и ETag страницы авто.
+    """
+    from django.db import transaction
+    from django.utils import timezone
+    from .caching import bump_catalog_version
+    from .models import Vehicle
+
+    Vehicle.objects.filter(pk__in=images.values("vehicle_id")).update(updated_at=timezone.now())
+    transaction.on_commit(bump_catalog_version)
+
+
+def _build_and_store(image_pk, name, pool=None):
+    from django.db import connection, transaction
+    from .models import VehicleImage
+
+    try:
+        derivatives = pool.submit(generate, name).result() if pool else generate(name)
+        # фильтр по image: фото могли заменить, пока строились копии
+        images = VehicleImage.objects.filter(pk=image_pk, image=name)
+        with transaction.atomic():
+            if images.update(derivatives=derivatives):
+                touch_vehicles(images)
+    except Exception:
+        logger.exception("Не удалось построить миниатюры для %s", name)
+    finally:
+        if pool:
+            connection.close()
+
+
+_process_pool = None
+_dispatcher_pool = None
+
+
+def process_pool():
+    # пулы создаются лениво: процессы не нужны, пока никто не загрузил фото
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=WORKERS)
+        atexit.register(_process_pool.shutdown, wait=False)
+    return _process_pool
+
+
+def _dispatcher():
+    # поток ждёт результат процесса и пишет его в БД своим соединением
+    global _dispatcher_pool
+    if _dispatcher_pool is None:
+        _dispatcher_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="thumbnails")
+    return _dispatcher_pool
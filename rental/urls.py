@@ -13,6 +13,9 @@ urlpatterns = [
     path('vehicle/<uuid:vehicle_id>/booking/', views.create_booking, name='create_booking'),
     path('profile/', views.profile, name='profile'),
     path('booking/<uuid:booking_id>/payment/', views.payment_page, name='payment_page'),
+    path('payments/webhook/<str:provider>/', views.payment_webhook, name='payment_webhook'),
+    path('export/<str:kind>.<str:fmt>', views.export_data, name='export'),
+    path('stats/rollups/', views.rollup_stats, name='rollup_stats'),
 ]
 
 urlpatterns += router.urls
\ No newline at end of file
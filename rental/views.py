@@ -1,29 +1,77 @@
 import json
 import uuid
-from datetime import timedelta, datetime
-from decimal import Decimal
 
 from django.contrib import messages
-from rest_framework import viewsets, permissions, filters
+from rest_framework import viewsets, permissions
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from .serializers import VehicleSerializer, BookingCreateSerializer
+from .serializers import (
+    VehicleSerializer, BookingCreateSerializer, QuoteRequestSerializer, VEHICLE_VALUES, vehicle_rows
+)
 
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.utils.decorators import method_decorator
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
 from .models import Vehicle, Booking, Payment, RentalPolicy
+from .availability import hold_expired, reserve, VehicleUnavailable
+from .occupancy import calendar_ranges
+from .pricing import quote_many
+from .payments import get_provider, pay, ProviderError
+from .webhooks import ingest, InvalidSignature
+from .filters import VehicleFilter, VehicleSearchFilter
+from .search import search
+from .pagination import is_ranked, keyset_page, ordering_fields, rank_page, CreatedAtCursorPagination, VehicleCursorPagination
+from .cards import vehicle_cards, booking_cards, VEHICLE_KEY_FIELDS, BOOKING_KEY_FIELDS
+from .caching import (
+    api_catalog_etag, catalog_etag, catalog_last_modified, vehicle_etag, vehicle_last_modified
+)
 from .forms import BookingForm, DemoPaymentForm
+from .exports import CONTENT_TYPES, EXPORTS, export_response
+from .rollups import parse_params, summary
 
 
 class VehicleViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Vehicle.objects.filter(is_active=True).select_related("price","type","location").prefetch_related("features")
+    queryset = Vehicle.objects.filter(is_active=True).prefetch_related("features")
     serializer_class = VehicleSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    filterset_fields = ["type","transmission","fuel","location"]
-    search_fields = ["title","plate"]
+    filter_backends = [DjangoFilterBackend, VehicleSearchFilter]
+    filterset_class = VehicleFilter
+    pagination_class = VehicleCursorPagination  # ?ordering=rating — по рейтингу
+
+    @method_decorator(condition(etag_func=api_catalog_etag, last_modified_func=catalog_last_modified))
+    def list(self, request, *args, **kwargs):
+        # список строится из .values(): без создания моделей и полей сериализатора, формат как у VehicleSerializer
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None).values(*VEHICLE_VALUES)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(vehicle_rows(page))
+        return Response(vehicle_rows(queryset))
+
+    @method_decorator(condition(etag_func=vehicle_etag, last_modified_func=vehicle_last_modified))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=["post"])
+    def quote(self, request):
+        """Цены M авто × N диапазонов: {"vehicles": [id, ...], "ranges": [{"date_from", "date_to"}, ...]}."""
+        serializer = QuoteRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ranges = [(r["date_from"], r["date_to"]) for r in serializer.validated_data["ranges"]]
+        vehicles = Vehicle.objects.active().filter(
+            pk__in=serializer.validated_data["vehicles"]
+        ).only("id", "type", "price_per_day")
+        return Response([
+            {"vehicle": str(pk), "date_from": date_from, "date_to": date_to, "total_price": str(total)}
+            for (pk, date_from, date_to), total in quote_many(vehicles, ranges).items()
+        ])
 
 class BookingViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     queryset = Booking.objects.all()
+    pagination_class = CreatedAtCursorPagination
 
     def get_serializer_class(self):
         if self.action == "create":
@@ -35,28 +83,56 @@ class BookingViewSet(viewsets.ModelViewSet):
 
 
 def home(request):
-    vehicles = Vehicle.objects.filter(is_active=True).order_by('-id')[:6]
-    return render(request, 'rental/base.html', {'vehicles': vehicles})
+    vehicles = Vehicle.objects.active().only(*VEHICLE_KEY_FIELDS).order_by('-created_at', '-id')[:6]
+    cards = vehicle_cards(request, vehicles, 'rental/cards/landing_card.html')
+    return render(request, 'rental/base.html', {'cards': cards})
 
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
 def vehicles_list(request):
-    vehicles = Vehicle.objects.filter(is_active=True)
+    vehicles = Vehicle.objects.active().only(*VEHICLE_KEY_FIELDS)
 
-    query = request.GET.get('q')
+    # фильтры по датам/городу: свободные авто считаются одним запросом
+    filterset = VehicleFilter(request.GET, queryset=vehicles)
+    vehicles = filterset.qs
+
+    query = request.GET.get('q', '').strip()
     if query:
-        vehicles = vehicles.filter(title__icontains=query)  # поиск по названию авто
+        # полнотекстовый поиск по названию, номеру, типу, особенностям, городу — среди уже отфильтрованных
+        vehicles = search(vehicles, query)
+
+    if is_ranked(vehicles):
+        # выдача поиска отсортирована по релевантности, курсор — место в выдаче
+        vehicles, next_cursor = rank_page(vehicles, request.GET.get('cursor'))
+    else:
+        # ?ordering=rating — по рейтингу (индекс vehicle_rating_idx), по умолчанию — новые первыми
+        fields = ordering_fields(request.GET)
+        vehicles, next_cursor = keyset_page(vehicles.only(*VEHICLE_KEY_FIELDS, *fields), request.GET.get('cursor'),
+                                            fields=fields)
 
-    return render(request, 'rental/home.html', {'vehicles': vehicles})
+    # цены за выбранные даты — одним пакетным расчётом на всю страницу
+    dates = filterset.date_range()
+    quotes = None
+    if dates and vehicles:
+        quotes = {pk: price for (pk, _, _), price in quote_many(vehicles, [dates]).items()}
 
+    cards = vehicle_cards(request, vehicles, 'rental/cards/vehicle_card.html', quotes)
+    return render(request, 'rental/home.html', {'cards': cards, 'next_cursor': next_cursor})
+
+@condition(etag_func=vehicle_etag, last_modified_func=vehicle_last_modified)
 def vehicle_detail(request, vehicle_id):
-    vehicle = get_object_or_404(Vehicle, id=vehicle_id)
+    vehicle = get_object_or_404(Vehicle.objects.for_cards(), id=vehicle_id)
     return render(request, 'rental/vehicle_detail.html', {'vehicle': vehicle})
 
 
 @login_required
 def profile(request):
-    bookings = Booking.objects.filter(user=request.user).select_related("vehicle")
+    bookings, next_cursor = keyset_page(
+        Booking.objects.filter(user=request.user).select_related("vehicle").only(*BOOKING_KEY_FIELDS),
+        request.GET.get("cursor"),
+    )
     return render(request, "rental/profile.html", {
-        "bookings": bookings,
+        "cards": booking_cards(request, bookings),
+        "next_cursor": next_cursor,
         "user": request.user
     })
 
@@ -65,10 +141,15 @@ def profile(request):
 def payment_page(request, booking_id):
     booking = get_object_or_404(Booking, id=booking_id, user=request.user)
 
+    if booking.status == "expired" or hold_expired(booking):
+        # даты уже могли отдать другому клиенту — оплачивать нечего
+        messages.error(request, "Время на оплату брони истекло, оформите бронь заново.")
+        return redirect("create_booking", booking.vehicle_id)
+
     payment, _ = Payment.objects.get_or_create(
         booking=booking,
         defaults={
-            "provider": "demo",
+            "provider": get_provider().name,
             "amount": booking.total_price,
             "currency": "KGS",
             "status": "requires_action",
@@ -82,22 +163,17 @@ def payment_page(request, booking_id):
     if request.method == "POST":
         form = DemoPaymentForm(request.POST)
         if form.is_valid():
-            card = form.cleaned_data["card_number"]
-
-            if card.endswith("4242"):
-                payment.status = "succeeded"
-                payment.provider_intent_id = str(uuid.uuid4())
-                payment.save()
-
-                booking.status = "paid"
-                booking.save()
-
+            try:
+                # списание у провайдера и атомарный перевод платежа и брони (rental.payments)
+                status = pay(payment, form.cleaned_data["card_number"])
+            except ProviderError:
+                messages.error(request, "Платёжный сервис недоступен, попробуйте ещё раз.")
+                status = None
+
+            if status == "succeeded":
                 messages.success(request, "Оплата прошла успешно (демо).")
                 return redirect("profile")
-            else:
-                payment.status = "failed"
-                payment.save()
-
+            elif status == "failed":
                 messages.error(request, "Платёж отклонён (демо). Используйте тестовую карту 4242 4242 4242 4242.")
     else:
         form = DemoPaymentForm()
@@ -111,39 +187,42 @@ def payment_page(request, booking_id):
 
 
 
+@csrf_exempt
+@require_POST
+def payment_webhook(request, provider):
+    # только проверка и постановка в очередь; статусы меняет process_payment_events пачками
+    try:
+        result = ingest(provider, request.body, request.headers)
+    except KeyError:
+        return JsonResponse({"error": "unknown provider"}, status=404)
+    except InvalidSignature:
+        return JsonResponse({"error": "invalid signature"}, status=403)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"status": result})
+
+
 @login_required
 def create_booking(request, vehicle_id):
     vehicle = get_object_or_404(Vehicle, id=vehicle_id)
 
-    # собираем все занятые даты для текущего автомобиля
-    booked_dates = []
-    bookings = Booking.objects.filter(vehicle=vehicle, status__in=["pending_payment", "paid"])
-    for b in bookings:
-        current = b.date_from
-        while current <= b.date_to:
-            booked_dates.append(current.strftime("%Y-%m-%d"))
-            current += timedelta(days=1)
-
     if request.method == "POST":
         form = BookingForm(request.POST)
         if form.is_valid():
             date_from = form.cleaned_data['date_from']
             date_to = form.cleaned_data['date_to']
 
-            # проверка занятости
-            conflict = any(
-                date_from <= datetime.strptime(d, "%Y-%m-%d").date() <= date_to
-                for d in booked_dates
-            )
-            if conflict:
-                form.add_error(None, "Автомобиль недоступен на выбранные даты")
+            booking = form.save(commit=False)
+            booking.user = request.user
+            booking.vehicle = vehicle
+            booking.total_price = vehicle.get_price_for_dates(date_from, date_to)
+            booking.status = "pending_payment"
+            # проверка занятости и сохранение под блокировкой авто
+            try:
+                reserve(booking)
+            except VehicleUnavailable as e:
+                form.add_error(None, str(e))
             else:
-                booking = form.save(commit=False)
-                booking.user = request.user
-                booking.vehicle = vehicle
-                booking.total_price = vehicle.get_price_for_dates(date_from, date_to)
-                booking.status = "pending_payment"
-                booking.save()
                 return redirect('payment_page', booking.id)
     else:
         form = BookingForm()
@@ -151,5 +230,28 @@ def create_booking(request, vehicle_id):
     return render(request, "rental/booking_form.html", {
         "form": form,
         "vehicle": vehicle,
-        "booked_dates": json.dumps(booked_dates)
-    })
\ No newline at end of file
+        "booked_dates": json.dumps(calendar_ranges(vehicle))
+    })
+
+
+def export_data(request, kind, fmt):
+    """Потоковая выгрузка для бухгалтерии: ?created_from=&created_to=&status=paid,completed."""
+    if not request.user.is_staff:
+        return JsonResponse({"error": "forbidden"}, status=403)
+    if kind not in EXPORTS or fmt not in CONTENT_TYPES:
+        return JsonResponse({"error": "unknown export"}, status=404)
+    try:
+        return export_response(kind, fmt, params=request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+def rollup_stats(request):
+    """Загрузка и выручка из дневных сводок: ?from=&to=&group=location|vehicle|date&location=."""
+    if not request.user.is_staff:
+        return JsonResponse({"error": "forbidden"}, status=403)
+    try:
+        params = parse_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(summary(**params))
@@ -0,0 +1,177 @@
+"""Вебхуки платёжных провайдеров: приём в очередь и пакетное применение.
+
+Приём (ingest) делает только проверку подписи и одну вставку в PaymentEvent. Повтор
+события с тем же id отбрасывает уникальный индекс. Применение (process_batch)
+берёт пачку событий и проводит их по конечному автомату статусов в памяти. Потом
+пишет результат пакетными UPDATE, по одному на вид перехода (обычно один для
+Payment и один для Booking на пачку), а не отдельной транзакцией на событие.
+Запускается командой process_payment_events.
+"""
+import json
+import logging
+from collections import defaultdict
+
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import timezone
+
+from . import occupancy, rollups
+from .models import Booking, Payment, PaymentEvent
+from .payments import PAYABLE_BOOKING_STATUSES, PAYABLE_STATUSES, get_provider, payable_bookings
+
+BATCH_SIZE = 500
+
+# новый статус платежа -> из каких статусов он допустим
+PAYMENT_TRANSITIONS = {
+    "succeeded": PAYABLE_STATUSES,
+    "failed": ("requires_action",),
+    "refunded": ("succeeded",),
+    "requires_action": (),
+}
+# статус платежа -> (статусы брони, которые он меняет, новый статус брони);
+# в "paid" — только брони из payments.payable_bookings(), даты которых свободны
+BOOKING_TRANSITIONS = {
+    "succeeded": (PAYABLE_BOOKING_STATUSES, "paid"),
+    "refunded": (("new", "pending_payment", "paid"), "canceled"),
+}
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+def ingest(provider_name, body, headers):
+    """Проверяет и ставит событие в очередь. Возвращает "queued" или "duplicate".
+
+    Бросает InvalidSignature, ValueError (формат) и KeyError (неизвестный провайдер).
+    """
+    provider = get_provider(provider_name)
+    if not provider.verify_webhook(body, headers):
+        raise InvalidSignature(provider_name)
+    payload = json.loads(body)
+    event_id, intent_id, status = provider.parse_webhook(payload)
+    try:
+        with transaction.atomic():
+            PaymentEvent.objects.create(
+                provider=provider_name, event_id=event_id, intent_id=intent_id, status=status, payload=payload
+            )
+    except IntegrityError:
+        return "duplicate"
+    return "queued"
+
+
+def _apply(queryset, rows, **extra):
+    """rows: {pk: (прочитанный статус, новый статус)}. Возвращает pk строк, которые UPDATE изменил.
+
+    Один UPDATE на каждый вид перехода (обычно один на пачку): WHERE pk IN (...) AND status = <прочитанный>.
+    Условие по статусу не даст затереть изменение, сделанное параллельно (payments.complete()).
+    """
+    groups = defaultdict(list)
+    for pk, transition in rows.items():
+        groups[transition].append(pk)
+    changed = set()
+    for (old, new), pks in groups.items():
+        if queryset.filter(pk__in=pks, status=old).update(status=new, **extra) == len(pks):
+            changed.update(pks)
+        else:
+            # часть строк успели изменить после чтения; при блокировке строк на чтении не бывает
+            changed.update(queryset.filter(pk__in=pks, status=new).values_list("pk", flat=True))
+    return changed
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """Применяет до batch_size необработанных событий. Возвращает число обработанных событий."""
+    using = router.db_for_write(PaymentEvent)
+    with transaction.atomic(using=using):
+        queue = PaymentEvent.objects.using(using).filter(processed_at__isnull=True).order_by("id")
+        if connections[using].features.has_select_for_update_skip_locked:
+            # несколько воркеров разбирают разные пачки
+            queue = queue.select_for_update(skip_locked=True)
+        events = list(queue.values_list("id", "provider", "intent_id", "status")[:batch_size])
+        if not events:
+            return 0
+
+        payments = {}
+        rows = Payment.objects.using(using).filter(provider_intent_id__in={intent_id for _, _, intent_id, _ in events})
+        if connections[using].features.has_select_for_update_of:
+            # прочитанные статусы платежей и броней не меняются до конца транзакции (SQLite и так
+            # пишет по одной транзакции, BEGIN IMMEDIATE), поэтому условные UPDATE ниже проходят целиком
+            rows = rows.select_for_update(of=("self", "booking"))
+        rows = rows.values_list("pk", "provider", "provider_intent_id", "status", "amount", "booking_id", "booking__status",
+                      "booking__vehicle_id", "booking__vehicle__location_id", "booking__date_from", "booking__date_to")
+        for (pk, provider, intent_id, status, amount, booking_id, booking_status,
+             vehicle_id, location_id, date_from, date_to) in rows:
+            payments[(provider, intent_id)] = {
+                "pk": pk, "read": status, "status": status, "amount": amount,
+                "booking": booking_id, "booking_read": booking_status, "booking_status": booking_status,
+                "vehicle": vehicle_id, "location": location_id, "dates": (date_from, date_to),
+            }
+
+        # успех оплаты не применяем к броням, чьи даты уже заняты (просроченная бронь, отданные даты)
+        succeeded = {(provider, intent_id) for _, provider, intent_id, status in events if status == "succeeded"}
+        paying = {payments[key]["booking"] for key in succeeded if key in payments}
+        payable = payable_bookings(Booking.objects.using(using).filter(pk__in=paying)) if paying else set()
+
+        # события одной пачки проводим по порядку поступления, в БД пишем только итог
+        for _, provider, intent_id, status in events:
+            payment = payments.get((provider, intent_id))
+            if payment is None:
+                logger.warning("Событие для неизвестного платежа %s:%s", provider, intent_id)
+                continue
+            if status == "succeeded" and payment["booking"] not in payable:
+                if payment["status"] in PAYMENT_TRANSITIONS[status]:
+                    logger.error("Списание %s:%s не применено: бронь %s уже нельзя оплатить, нужен возврат",
+                                 provider, intent_id, payment["booking"])
+                status = "failed"
+            if payment["status"] not in PAYMENT_TRANSITIONS[status]:
+                continue
+            payment["status"] = status
+            if status in BOOKING_TRANSITIONS:
+                allowed, booking_status = BOOKING_TRANSITIONS[status]
+                if payment["booking_status"] in allowed:
+                    payment["booking_status"] = booking_status
+
+        changed = {p["pk"]: (p["read"], p["status"]) for p in payments.values() if p["status"] != p["read"]}
+        bookings = {
+            p["booking"]: (p["booking_read"], p["booking_status"])
+            for p in payments.values() if p["booking_status"] != p["booking_read"]
+        }
+        now = timezone.now()
+        changed = _apply(Payment.objects.using(using), changed, updated_at=now)
+        bookings = _apply(Booking.objects.using(using), bookings) if bookings else set()
+        if bookings:
+            # UPDATE минует сигналы: оплата и отмена меняют занятость авто
+            vehicle_ids = {p["vehicle"] for p in payments.values() if p["booking"] in bookings}
+            transaction.on_commit(lambda: [occupancy.invalidate(v) for v in vehicle_ids], using=using)
+        # дневные сводки — разница прочитанного состояния и записанного: только строки, которые UPDATE изменил
+        states = []
+        for p in payments.values():
+            if p["pk"] not in changed and p["booking"] not in bookings:
+                continue
+            status = p["status"] if p["pk"] in changed else p["read"]
+            booking_status = p["booking_status"] if p["booking"] in bookings else p["booking_read"]
+            states.append((
+                rollups.State(p["vehicle"], p["location"], *p["dates"], p["booking_read"], p["amount"], p["read"]),
+                rollups.State(p["vehicle"], p["location"], *p["dates"], booking_status, p["amount"], status),
+            ))
+        rollups.apply(states, using)
+        PaymentEvent.objects.using(using).filter(pk__in=[pk for pk, *_ in events]).update(processed_at=now)
+    return len(events)
+
+
+def process_pending(batch_size=BATCH_SIZE, max_batches=None):
+    """Разбирает очередь пачками до конца (или max_batches пачек)."""
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        processed = process_batch(batch_size)
+        if not processed:
+            break
+        total += processed
+        batches += 1
+    return total
+
+
+def replay(events):
+    """Возвращает уже обработанные события в очередь; применение идемпотентно по конечному автомату."""
+    return events.update(processed_at=None)